@@ -0,0 +1,128 @@
+"""Throughput per gunicorn worker mode for checkout traffic.
+
+Starts the local Stripe stand-in (``stripe_standin.py``), then for each mode
+boots gunicorn with ``config/gunicorn.py`` and fires ``--requests`` checkout
+POSTs at ``--concurrency``. Every checkout makes two Stripe calls, so with
+sync workers throughput is capped at roughly ``workers / (2 * latency)``.
+
+Needs gunicorn (and uvicorn for that mode) and PostgreSQL via ``DATABASE_URL``
+or ``PG*``: checkout keeps its transaction open across the Stripe calls, so
+SQLite's single writer serialises concurrent checkouts and times them out.
+Run from the project root:
+
+    python benchmarks/gunicorn_modes.py --requests 400 --concurrency 64 --latency-ms 300
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from startup import free_port
+from stripe_standin import start_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    # name: environment for config/gunicorn.py
+    'sync (old default)': {'GUNICORN_WORKER_MODE': 'gthread', 'GUNICORN_THREADS': '1', 'WEB_CONCURRENCY': '1'},
+    'gthread': {'GUNICORN_WORKER_MODE': 'gthread'},
+    'uvicorn': {'GUNICORN_WORKER_MODE': 'uvicorn'},
+}
+
+
+def checkout(port):
+    payload = json.dumps({
+        'payable_type': 'booking',
+        'payable_id': '1',
+        'amount_pence': 1000,
+        'customer': {'email': f'load-{uuid.uuid4().hex[:8]}@example.com'},
+        'success_url': 'https://example.com/success',
+        'cancel_url': 'https://example.com/cancel',
+        'idempotency_key': uuid.uuid4().hex,
+    }).encode()
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/api/payments/checkout/', data=payload,
+        headers={'Content-Type': 'application/json'},
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            ok = response.status == 200
+    except (urllib.error.URLError, ConnectionError):
+        ok = False
+    return ok, time.perf_counter() - started
+
+
+def wait_until_up(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/payments/status/1/', timeout=5)
+            return
+        except urllib.error.HTTPError:
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.1)
+    raise RuntimeError('gunicorn did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--latency-ms', type=int, default=300, help='Simulated Stripe latency')
+    parser.add_argument('--workers', type=int, default=None, help='WEB_CONCURRENCY for every mode')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    _, stripe_base = start_standin(latency_ms=args.latency_ms)
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'config.settings',
+        'DEBUG': 'False',
+        'STRIPE_API_BASE': stripe_base,
+        'STRIPE_SECRET_KEY': 'sk_test_standin',
+        'PAYMENTS_STRIPE_RATE_PER_SECOND': '10000',
+        'PAYMENTS_STRIPE_RATE_BURST': '10000',
+        'SERVER_TIMING_SAMPLE_RATE': '0',
+    }
+    if args.workers:
+        env['WEB_CONCURRENCY'] = str(args.workers)
+    subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    print(f'{args.requests} checkouts, concurrency {args.concurrency}, Stripe latency {args.latency_ms}ms\n')
+    print(f"{'mode':<20} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for name in args.modes:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'config/gunicorn.py', '--access-logfile', '/dev/null'],
+            cwd=ROOT, env={**env, **MODES[name], 'PORT': str(port)},
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_up(port)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(lambda _: checkout(port), range(args.requests)))
+            elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait()
+
+        latencies = sorted(latency * 1000 for ok, latency in results if ok)
+        errors = sum(1 for ok, _ in results if not ok)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        median = statistics.median(latencies) if latencies else 0
+        print(f'{name:<20} {len(latencies) / elapsed:>8.1f} {median:>8.0f} {p95:>8.0f} {errors:>7}')
+
+
+if __name__ == '__main__':
+    main()
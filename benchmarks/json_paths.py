@@ -0,0 +1,142 @@
+"""Micro-benchmark for the webhook and payment-status JSON paths.
+
+Compares, per operation:
+
+- webhook: ``stripe.Webhook.construct_event`` (signature check + ``json`` +
+  ``StripeObject`` tree) against ``construct_webhook_event`` (signature
+  check + fast parse into plain dicts);
+- status: building the status dict from a full model row and rendering it
+  with Django's ``JsonResponse`` against ``PAYMENT_STATUS_SHAPE`` and the
+  fast ``JsonResponse``.
+
+No database is needed. Run from the project root:
+
+    python benchmarks/json_paths.py --number 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+os.environ.setdefault('STRIPE_WEBHOOK_SECRET', 'whsec_benchmark')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.http import JsonResponse as DjangoJsonResponse  # noqa: E402
+
+from payments import fastjson  # noqa: E402
+from payments.models import PaymentSession  # noqa: E402
+from payments.stripe_api import construct_webhook_event, stripe  # noqa: E402
+from payments.views import PAYMENT_STATUS_SHAPE  # noqa: E402
+
+
+def checkout_completed_payload():
+    """A realistically sized checkout.session.completed event body."""
+    session_id = f'cs_test_{uuid.uuid4().hex}'
+    return json.dumps({
+        'id': f'evt_{uuid.uuid4().hex}',
+        'object': 'event',
+        'api_version': '2023-10-16',
+        'created': int(time.time()),
+        'livemode': False,
+        'pending_webhooks': 1,
+        'request': {'id': None, 'idempotency_key': None},
+        'type': 'checkout.session.completed',
+        'data': {'object': {
+            'id': session_id,
+            'object': 'checkout.session',
+            'amount_subtotal': 5000,
+            'amount_total': 5000,
+            'currency': 'gbp',
+            'customer': 'cus_benchmark',
+            'customer_details': {
+                'email': 'customer@example.com', 'name': 'Bench Mark', 'phone': None,
+                'address': {'city': None, 'country': 'GB', 'line1': None, 'line2': None,
+                            'postal_code': 'NE1 1AA', 'state': None},
+                'tax_exempt': 'none', 'tax_ids': [],
+            },
+            'metadata': {'payable_type': 'booking', 'payable_id': '42', 'payment_session_id': '17',
+                         'service_name': 'Consultation', 'booking_date': '2026-11-01T10:00:00+00:00'},
+            'mode': 'payment',
+            'payment_intent': f'pi_{uuid.uuid4().hex}',
+            'payment_method_types': ['card'],
+            'payment_status': 'paid',
+            'status': 'complete',
+            'success_url': 'https://example.com/success',
+            'cancel_url': 'https://example.com/cancel',
+            'url': None,
+        }},
+    }).encode()
+
+
+def signed(payload):
+    timestamp = int(time.time())
+    signature = stripe.WebhookSignature._compute_signature(
+        f'{timestamp}.{payload.decode()}', settings.STRIPE_WEBHOOK_SECRET
+    )
+    return f't={timestamp},v1={signature}'
+
+
+def report(name, before, after, number):
+    print(f'{name:<10} {before / number * 1e6:>9.1f}us {after / number * 1e6:>9.1f}us {before / after:>7.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+    number = args.number
+
+    payload = checkout_completed_payload()
+    header = signed(payload)
+    secret = settings.STRIPE_WEBHOOK_SECRET
+
+    def old_webhook():
+        event = stripe.Webhook.construct_event(payload, header, secret)
+        return event['data']['object']['payment_intent']
+
+    def new_webhook():
+        event = construct_webhook_event(payload, header, secret)
+        return event.object['payment_intent']
+
+    payment_session = PaymentSession(
+        id=17, payable_type='booking', payable_id='42', amount_pence=5000, currency='GBP', status='succeeded',
+        success_url='https://example.com/success', cancel_url='https://example.com/cancel',
+        idempotency_key='bench', metadata={'service_name': 'Consultation'},
+    )
+    row = tuple(getattr(payment_session, column) for column in PAYMENT_STATUS_SHAPE.columns)
+
+    def old_status():
+        return DjangoJsonResponse({
+            'payment_session_id': str(payment_session.id),
+            'payable_type': payment_session.payable_type,
+            'payable_id': payment_session.payable_id,
+            'status': payment_session.status,
+            'amount_pence': payment_session.amount_pence,
+            'currency': payment_session.currency,
+        }).content
+
+    def new_status():
+        return fastjson.JsonResponse(PAYMENT_STATUS_SHAPE.from_row(row)).content
+
+    assert old_webhook() == new_webhook()
+    assert json.loads(old_status()) == json.loads(new_status())
+
+    codec = 'orjson' if fastjson.orjson else 'stdlib json (orjson not installed)'
+    print(f'{number} iterations, fast codec: {codec}\n')
+    print(f"{'path':<10} {'before':>11} {'after':>11} {'speedup':>8}")
+    report('webhook', timeit.timeit(old_webhook, number=number), timeit.timeit(new_webhook, number=number), number)
+    report('status', timeit.timeit(old_status, number=number), timeit.timeit(new_status, number=number), number)
+    print('\n(status excludes the query; the shape also selects 6 columns instead of the whole row)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Contention benchmark: many concurrent buyers racing for one slot.
+
+Fires ``--buyers`` concurrent ``POST /api/bookings/`` requests (through the
+Django test client, one DB connection per thread) at a single slot with
+``--capacity`` seats and checks that exactly ``capacity`` bookings win.
+
+Needs a real database (PostgreSQL); in-memory SQLite cannot be shared between
+threads. Run from the project root:
+
+    python benchmarks/slot_contention.py --buyers 500 --capacity 20 --threads 100
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connections  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from bookings.models import Booking, Slot  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--buyers', type=int, default=500)
+    parser.add_argument('--capacity', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=100)
+    parser.add_argument('--keep', action='store_true', help='Keep the benchmark slot and bookings afterwards')
+    args = parser.parse_args()
+
+    starts_at = timezone.now() + timedelta(days=30)
+    slot = Slot.objects.create(
+        service_name='Contention Benchmark',
+        starts_at=starts_at,
+        ends_at=starts_at + timedelta(hours=1),
+        capacity=args.capacity,
+    )
+
+    gate = threading.Barrier(min(args.threads, args.buyers))
+    latencies = []
+    outcomes = {}
+    lock = threading.Lock()
+
+    def buy(n):
+        client = Client()
+        payload = json.dumps({
+            'customer_name': f'Buyer {n}',
+            'customer_email': f'buyer{n}@example.com',
+            'slot_id': slot.id,
+            'total_amount_pence': 0,
+            'deposit_amount_pence': 0,
+        })
+        if n < gate.parties:
+            gate.wait()
+        started = time.perf_counter()
+        response = client.post('/api/bookings/', data=payload, content_type='application/json')
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+        connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(buy, range(args.buyers)))
+    wall = time.perf_counter() - started
+
+    slot.refresh_from_db()
+    booked = Booking.objects.filter(slot=slot).exclude(status='CANCELLED').count()
+    latencies.sort()
+
+    print(f'buyers={args.buyers} capacity={args.capacity} threads={args.threads}')
+    print(f'responses: {dict(sorted(outcomes.items()))}')
+    print(f'bookings held: {booked}  slot.reserved_count: {slot.reserved_count}')
+    print(f'wall: {wall:.3f}s  throughput: {args.buyers / wall:.1f} req/s')
+    print(
+        f'latency p50={statistics.median(latencies) * 1000:.1f}ms '
+        f'p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms '
+        f'max={latencies[-1] * 1000:.1f}ms'
+    )
+    oversold = booked > args.capacity or slot.reserved_count != booked
+    print('RESULT: ' + ('OVERSOLD' if oversold else 'ok'))
+
+    if not args.keep:
+        Booking.objects.filter(slot=slot).delete()
+        slot.delete()
+
+    sys.exit(1 if oversold else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Cold-start benchmark: time from container start to first served request.
+
+Compares the old entrypoint (collectstatic + migrate + ensure_superuser, each
+a separate process, every boot) with ``manage.py boot`` on an already-prepared
+instance (the common case when Railway scales out), then starts the web
+server and polls until the first response arrives.
+
+Uses ``DATABASE_URL`` if set, otherwise a throwaway SQLite file. Run from the
+project root:
+
+    python benchmarks/startup.py --runs 3
+"""
+import argparse
+import importlib.util
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MANAGE = [sys.executable, os.path.join(ROOT, 'manage.py')]
+
+
+def run(args, env):
+    started = time.perf_counter()
+    subprocess.run(args, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_request(server_args, port, env, timeout=60):
+    started = time.perf_counter()
+    server = subprocess.Popen(server_args, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/api/payments/status/1/', timeout=5)
+                return time.perf_counter() - started
+            except urllib.error.HTTPError:
+                return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.02)
+        raise RuntimeError('Server did not answer within %ss' % timeout)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'}
+    env.setdefault('DATABASE_URL', 'sqlite:////tmp/nbne-startup-bench.db')
+
+    print('Preparing instance (first boot)...')
+    run(MANAGE + ['boot', '--force'], env)
+
+    old_path = [
+        run(MANAGE + ['collectstatic', '--noinput'], env)
+        + run(MANAGE + ['migrate', '--noinput'], env)
+        + run(MANAGE + ['ensure_superuser'], env)
+        for _ in range(args.runs)
+    ]
+    boot_path = [run(MANAGE + ['boot'], env) for _ in range(args.runs)]
+
+    if importlib.util.find_spec('gunicorn'):
+        def server(port):
+            return [sys.executable, '-m', 'gunicorn', 'config.wsgi:application', '--preload', '--bind', f'127.0.0.1:{port}']
+        server_name = 'gunicorn --preload'
+    else:
+        def server(port):
+            return MANAGE + ['runserver', '--noreload', '--skip-checks', f'127.0.0.1:{port}']
+        server_name = 'runserver (gunicorn not installed)'
+
+    first_request = []
+    for _ in range(args.runs):
+        port = free_port()
+        first_request.append(time_to_first_request(server(port), port, env))
+
+    median = statistics.median
+    print(f'\nMedian of {args.runs} runs')
+    print(f'  old entrypoint steps:                 {median(old_path):.2f}s')
+    print(f'  manage.py boot (prepared instance):   {median(boot_path):.2f}s')
+    print(f'  {server_name} to first response: {median(first_request):.2f}s')
+    print(f'  time to first request, old vs new:    '
+          f'{median(old_path) + median(first_request):.2f}s vs {median(boot_path) + median(first_request):.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Local stand-in for the Stripe API, for load tests that must not hit Stripe.
+
+Answers the endpoints payments uses with plausible objects after a fixed
+delay that mimics Stripe's latency. Point the app at it with
+``STRIPE_API_BASE=http://127.0.0.1:12111``. Run standalone:
+
+    python benchmarks/stripe_standin.py --port 12111 --latency-ms 300
+
+or import ``start_standin()`` from another benchmark.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_object(method, path):
+    n = uuid.uuid4().hex[:16]
+    parts = path.split('?')[0].strip('/').split('/')[1:]  # drop the 'v1' prefix
+    if parts[:2] == ['checkout', 'sessions']:
+        session_id = parts[2] if len(parts) > 2 else f'cs_test_standin{n}'
+        status = 'expired' if parts[-1] == 'expire' else 'open'
+        return {
+            'id': session_id, 'object': 'checkout.session', 'status': status,
+            'url': f'https://checkout.stripe.com/c/pay/{session_id}', 'payment_intent': f'pi_standin{n}',
+        }
+    if parts[:1] == ['customers']:
+        return {'id': f'cus_standin{n}', 'object': 'customer'}
+    if parts[:1] == ['refunds']:
+        return {'id': f're_standin{n}', 'object': 'refund', 'status': 'succeeded'}
+    if parts[:1] == ['payment_intents']:
+        return {'id': f'pi_standin{n}', 'object': 'payment_intent', 'status': 'succeeded'}
+    return {'id': f'obj_standin{n}', 'object': parts[0] if parts else 'unknown'}
+
+
+def make_handler(latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def respond(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                self.rfile.read(length)
+            time.sleep(latency)
+            body = json.dumps(fake_object(self.command, self.path)).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Request-Id', f'req_standin{uuid.uuid4().hex[:16]}')
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = do_DELETE = respond
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_standin(port=0, latency_ms=300):
+    """Serve in a daemon thread. Returns ``(server, base_url)``."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(latency_ms / 1000))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--latency-ms', type=int, default=300)
+    args = parser.parse_args()
+    server, base_url = start_standin(args.port, args.latency_ms)
+    print(f'Stripe stand-in listening on {base_url} ({args.latency_ms}ms latency)')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,5 +1,37 @@
-from django.contrib import admin
-from .models import Booking
+from django.contrib import admin, messages
+from .catalogue import sync_service
+from .models import Booking, Service, Slot
+
+
+@admin.register(Service)
+class ServiceAdmin(admin.ModelAdmin):
+    list_display = ['name', 'duration_minutes', 'price_display', 'deposit_display', 'is_active', 'stripe_price_id']
+    list_filter = ['is_active']
+    search_fields = ['name']
+    readonly_fields = ['stripe_product_id', 'stripe_price_id', 'stripe_price_amount_pence', 'stripe_price_currency',
+                       'created_at', 'updated_at']
+    actions = ['sync_to_stripe']
+
+    def price_display(self, obj):
+        return f"£{obj.price_pence/100:.2f}"
+    price_display.short_description = 'Price'
+
+    def deposit_display(self, obj):
+        return f"£{obj.deposit_amount_pence/100:.2f}"
+    deposit_display.short_description = 'Deposit'
+
+    @admin.action(description='Sync Stripe Product and Price')
+    def sync_to_stripe(self, request, queryset):
+        synced = sum(sync_service(service, force=True) for service in queryset)
+        self.message_user(request, f'Synced {synced} service(s) with Stripe.', messages.SUCCESS)
+
+
+@admin.register(Slot)
+class SlotAdmin(admin.ModelAdmin):
+    list_display = ['id', 'service_name', 'starts_at', 'ends_at', 'reserved_count', 'capacity']
+    list_filter = ['service_name', 'starts_at']
+    search_fields = ['service_name']
+    readonly_fields = ['reserved_count', 'created_at', 'updated_at']
 
 
 @admin.register(Booking)
@@ -7,7 +39,8 @@ class BookingAdmin(admin.ModelAdmin):
     list_display = ['id', 'customer_name', 'service_name', 'booking_date', 'status', 'deposit_display', 'created_at']
     list_filter = ['status', 'booking_date', 'created_at']
     search_fields = ['customer_name', 'customer_email', 'service_name']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['created_at', 'updated_at', 'hold_expires_at']
+    raw_id_fields = ['slot', 'service']
 
     def deposit_display(self, obj):
         return f"£{obj.deposit_amount_pence/100:.2f}"
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class BookingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bookings'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from payments.callbacks import checkout_created, register_payment_subscriber
+        from .callbacks import apply_payment_events, invalidate_checkout_bookings
+        from .catalogue import invalidate_catalogue
+
+        register_payment_subscriber('booking', apply_payment_events)
+        checkout_created.connect(invalidate_checkout_bookings, dispatch_uid='bookings.invalidate_checkout_bookings')
+        post_save.connect(invalidate_catalogue, sender='bookings.Service', dispatch_uid='bookings.invalidate_catalogue_saved')
+        post_delete.connect(invalidate_catalogue, sender='bookings.Service', dispatch_uid='bookings.invalidate_catalogue_deleted')
@@ -0,0 +1,21 @@
+from django.core.cache import cache
+from django.db import transaction
+
+
+def detail_cache_key(booking_id, include_payments):
+    return f"bookings:detail:{booking_id}:{'payments' if include_payments else 'booking'}"
+
+
+def invalidate_booking_detail(booking_ids):
+    """Drop cached detail responses for ``booking_ids`` once the current transaction commits.
+
+    Deleting after commit means a concurrent reader cannot re-cache the
+    pre-change row between our delete and our commit.
+    """
+    keys = [
+        detail_cache_key(booking_id, include_payments)
+        for booking_id in set(booking_ids)
+        for include_payments in (False, True)
+    ]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
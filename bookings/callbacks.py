@@ -0,0 +1,42 @@
+from collections import defaultdict
+
+from .cache import invalidate_booking_detail
+from .models import Booking
+
+
+def apply_payment_events(events):
+    """Apply payment status changes to bookings, one UPDATE per target status.
+
+    Registered as the in-process payments subscriber for ``payable_type``
+    ``"booking"``; also used by the legacy HTTP callback endpoint. Returns the
+    number of bookings changed.
+    """
+    ids_by_status = defaultdict(set)
+    for event in events:
+        if event.get('payable_type') != 'booking':
+            continue
+        payable_id = str(event.get('payable_id', ''))
+        if payable_id.isdigit():
+            ids_by_status[event.get('status')].add(int(payable_id))
+
+    # Payment status is part of the cached booking detail even when the booking itself is unchanged.
+    invalidate_booking_detail(booking_id for booking_ids in ids_by_status.values() for booking_id in booking_ids)
+
+    changed = 0
+    succeeded = ids_by_status.pop('succeeded', None)
+    if succeeded:
+        changed += Booking.objects.filter(id__in=succeeded).confirm()
+
+    for payment_status in ('failed', 'canceled'):
+        booking_ids = ids_by_status.pop(payment_status, None)
+        if booking_ids:
+            changed += Booking.objects.filter(id__in=booking_ids).cancel(f"Payment {payment_status}")
+
+    return changed
+
+
+def invalidate_checkout_bookings(sender, payment_session, payables, **kwargs):
+    """``checkout_created`` receiver: a new session, cart or not, is part of its bookings' cached detail."""
+    invalidate_booking_detail(
+        int(payable_id) for payable_type, payable_id in payables if payable_type == 'booking' and payable_id.isdigit()
+    )
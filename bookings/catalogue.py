@@ -0,0 +1,123 @@
+"""The service catalogue, cached in each process.
+
+``get_service()`` answers from an in-process copy of every active service,
+loaded with one query and kept for ``BOOKING_SERVICE_CACHE_SECONDS``, so
+pricing a booking costs no queries. Saving or deleting a ``Service`` drops
+the copy in the current process once the transaction commits; other
+processes reload it when theirs expires.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+
+ServiceEntry = namedtuple(
+    'ServiceEntry', 'id name duration_minutes price_pence deposit_amount_pence stripe_price_id'
+)
+
+
+class ServiceCatalogue:
+    """Active services by id, reloaded after ``ttl`` seconds or ``invalidate()``. Thread-safe."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._services = None
+        self._expires = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def services(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._services is not None and self._expires > now:
+                return self._services
+            generation = self._generation
+        services = _load()
+        with self._lock:
+            # Don't keep a copy read before a concurrent invalidate().
+            if generation == self._generation:
+                self._services, self._expires = services, now + self.ttl
+        return services
+
+    def invalidate(self):
+        with self._lock:
+            self._services = None
+            self._generation += 1
+
+
+_catalogue = None
+
+
+def get_catalogue():
+    global _catalogue
+    if _catalogue is None:
+        _catalogue = ServiceCatalogue(settings.BOOKING_SERVICE_CACHE_SECONDS)
+    return _catalogue
+
+
+def _load():
+    from .models import Service
+
+    return {
+        service.id: ServiceEntry(
+            service.id, service.name, service.duration_minutes, service.price_pence,
+            service.deposit_amount_pence, service.current_stripe_price_id,
+        )
+        for service in Service.objects.filter(is_active=True)
+    }
+
+
+def get_service(service_id):
+    """The active service ``service_id``. Raises ``Service.DoesNotExist``."""
+    entry = get_catalogue().services().get(service_id)
+    if entry is None:
+        from .models import Service
+        raise Service.DoesNotExist(f'No active service with id {service_id}')
+    return entry
+
+
+def service_required():
+    """Whether bookings must name a ``service_id`` rather than send their own amounts.
+
+    ``BOOKING_REQUIRE_SERVICE`` is ``'always'``, ``'never'`` or ``'auto'``,
+    which requires one as soon as the catalogue has an active service.
+    """
+    mode = settings.BOOKING_REQUIRE_SERVICE
+    if mode == 'auto':
+        return bool(get_catalogue().services())
+    return mode == 'always'
+
+
+def invalidate_catalogue(sender, **kwargs):
+    """``post_save``/``post_delete`` receiver for ``Service``."""
+    transaction.on_commit(get_catalogue().invalidate)
+
+
+def sync_service(service, force=False):
+    """Create the service's Stripe Product and deposit Price where missing or out of date.
+
+    A new Price replaces the old one when the deposit changes. ``force``
+    also pushes the current name to an existing Product. Services without a
+    deposit have nothing to charge at booking time and are skipped. Returns
+    ``True`` if anything was sent to Stripe.
+    """
+    from payments.catalogue import sync_price, sync_product
+
+    current_price_id = service.current_stripe_price_id
+    if not service.deposit_amount_pence or (current_price_id and not force):
+        return False
+    key = f'service-{service.id}'
+    service.stripe_product_id = sync_product(key, service.name, service.stripe_product_id or None)
+    if not current_price_id:
+        service.stripe_price_id = sync_price(
+            key, service.stripe_product_id, service.deposit_amount_pence, settings.DEFAULT_CURRENCY,
+            old_price_id=service.stripe_price_id or None,
+        )
+        service.stripe_price_amount_pence = service.deposit_amount_pence
+        service.stripe_price_currency = settings.DEFAULT_CURRENCY
+    service.save(update_fields=[
+        'stripe_product_id', 'stripe_price_id', 'stripe_price_amount_pence', 'stripe_price_currency', 'updated_at',
+    ])
+    return True
@@ -0,0 +1,134 @@
+import hashlib
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from payments.fastjson import ResponseShape, dumps
+from payments.models import PaymentSession, PaymentSessionItem, Transaction
+
+from .cache import detail_cache_key
+from .models import Booking
+
+SESSION_COLUMNS = ('id', 'status', 'amount_pence', 'currency', 'created_at')
+TRANSACTION_COLUMNS = ('id', 'gross_amount_pence', 'currency', 'provider_charge_id', 'captured_at')
+
+
+def _aware(value):
+    # Raw cursors return strings (SQLite) or naive datetimes depending on the backend.
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+def _isoformat(value):
+    value = _aware(value)
+    return value.isoformat() if value else None
+
+
+BOOKING_SHAPE = ResponseShape(
+    booking_id='id',
+    customer_name='customer_name',
+    customer_email='customer_email',
+    service_name='service_name',
+    booking_date=('booking_date', _isoformat),
+    total_amount_pence='total_amount_pence',
+    deposit_amount_pence='deposit_amount_pence',
+    status='status',
+    notes='notes',
+)
+BOOKING_COLUMNS = BOOKING_SHAPE.columns
+
+
+def load_booking_detail(booking_id, include_payments=False):
+    """The booking as a response dict, optionally with its payment sessions and transactions.
+
+    Everything is read with one query: the booking LEFT JOINed to its
+    payment sessions, whether paid alone (``payable_type`` ``booking``) or as
+    an item of a cart session, and their transactions. A cart session's
+    ``amount_pence`` is this booking's item, not the cart total.
+    Raises ``Booking.DoesNotExist``.
+    """
+    qn = connection.ops.quote_name
+    columns = [f'b.{qn(column)}' for column in BOOKING_COLUMNS]
+    joins = ''
+    params = []
+    if include_payments:
+        session_column = {name: PaymentSession._meta.get_field(name).column for name in SESSION_COLUMNS}
+        columns += [f'ps.{qn(session_column[name])}' for name in SESSION_COLUMNS]
+        columns += [f't.{qn(Transaction._meta.get_field(name).column)}' for name in TRANSACTION_COLUMNS]
+        columns.append('links.item_amount_pence')
+        # Each branch of the UNION is an index lookup on (payable_type, payable_id).
+        joins = (
+            f" LEFT JOIN ("
+            f"SELECT {qn('id')} AS session_id, NULL AS item_amount_pence FROM {qn(PaymentSession._meta.db_table)}"
+            f" WHERE {qn('payable_type')} = %s AND {qn('payable_id')} = %s"
+            f" UNION SELECT {qn('payment_session_id')}, {qn('amount_pence')} FROM {qn(PaymentSessionItem._meta.db_table)}"
+            f" WHERE {qn('payable_type')} = %s AND {qn('payable_id')} = %s"
+            f") links ON 1 = 1"
+            f" LEFT JOIN {qn(PaymentSession._meta.db_table)} ps ON ps.{qn('id')} = links.session_id"
+            f" LEFT JOIN {qn(Transaction._meta.db_table)} t ON t.{qn('payment_session_id')} = ps.{qn('id')}"
+        )
+        params += ['booking', str(booking_id)] * 2
+    sql = (
+        f"SELECT {', '.join(columns)} FROM {qn(Booking._meta.db_table)} b{joins}"
+        f" WHERE b.{qn('id')} = %s"
+    )
+    params.append(booking_id)
+    if include_payments:
+        sql += f" ORDER BY ps.{qn('created_at')}, ps.{qn('id')}, t.{qn('id')}"
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    if not rows:
+        raise Booking.DoesNotExist(f'Booking {booking_id} does not exist')
+
+    detail = BOOKING_SHAPE.from_row(rows[0][:len(BOOKING_COLUMNS)])
+    if not include_payments:
+        return detail
+
+    sessions = {}
+    session_start = len(BOOKING_COLUMNS)
+    transaction_start = session_start + len(SESSION_COLUMNS)
+    transaction_end = transaction_start + len(TRANSACTION_COLUMNS)
+    for row in rows:
+        session = dict(zip(SESSION_COLUMNS, row[session_start:transaction_start]))
+        if session['id'] is None:
+            continue
+        payment = sessions.setdefault(session['id'], {
+            'payment_session_id': str(session['id']),
+            'status': session['status'],
+            # A cart's share for this booking, not the cart total.
+            'amount_pence': session['amount_pence'] if row[transaction_end] is None else row[transaction_end],
+            'currency': session['currency'],
+            'created_at': _isoformat(session['created_at']),
+            'transactions': [],
+        })
+        txn = dict(zip(TRANSACTION_COLUMNS, row[transaction_start:transaction_end]))
+        if txn['id'] is not None:
+            payment['transactions'].append({
+                'transaction_id': txn['id'],
+                'gross_amount_pence': txn['gross_amount_pence'],
+                'currency': txn['currency'],
+                'provider_charge_id': txn['provider_charge_id'],
+                'captured_at': _isoformat(txn['captured_at']),
+            })
+    detail['payments'] = list(sessions.values())
+    return detail
+
+
+def cached_booking_detail(booking_id, include_payments=False):
+    """``(etag, json_bytes)`` for the booking detail, from the cache when possible."""
+    key = detail_cache_key(booking_id, include_payments)
+    cached = cache.get(key)
+    if cached is None:
+        body = dumps(load_booking_detail(booking_id, include_payments))
+        cached = (f'"{hashlib.md5(body).hexdigest()}"', body)
+        cache.set(key, cached, settings.BOOKING_DETAIL_CACHE_SECONDS)
+    return cached
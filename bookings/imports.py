@@ -0,0 +1,370 @@
+"""Bulk booking import from CSV or NDJSON, run by the import endpoint and ``manage.py import_bookings``.
+
+``import_bookings()`` reads the file a line at a time and validates each row
+as it goes. Valid rows are collected into chunks of ``chunk_size``, and each
+chunk is written as follows:
+
+1. seats are taken and the bookings inserted with one ``bulk_create``, in one
+   short transaction;
+2. deposit checkout sessions are created for the bookings that need one, on
+   ``concurrency`` threads, outside that transaction;
+3. a result line per input row is appended to ``out``, in input order.
+
+Only one chunk is ever held in memory, whatever the size of the file. A row
+whose checkout session cannot be created is cancelled and its seat returned,
+as ``POST /api/bookings/`` does.
+
+Each row is stored under an import key: its ``import_key`` column, or else
+one derived from its row number and content. Rows whose key is already
+imported are reported as ``exists`` rather than booked again, so an import
+that crashed can simply be run again. Deposit checkouts use an idempotency
+key per booking, so a re-run returns the session an earlier run created (or
+creates the one it never got to).
+"""
+import codecs
+import csv
+import hashlib
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from payments.fastjson import JSONDecodeError, dumps, loads
+from payments.views import create_checkout_session_internal
+
+from .catalogue import get_service, service_required
+from .models import Booking, Service, Slot
+
+FORMATS = ('csv', 'ndjson')
+RESULT_FIELDS = ('row', 'status', 'booking_id', 'booking_status', 'checkout_url', 'payment_session_id', 'error')
+
+
+def read_rows(lines, fmt):
+    """Yield ``(row_number, row_dict, error)`` for each record in ``lines`` (an iterable of bytes).
+
+    Rows are numbered from 1, not counting the CSV header or blank NDJSON lines.
+    A line that cannot be decoded ends the file with an error row.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(codecs.iterdecode(lines, 'utf-8-sig'))
+        number = 0
+        try:
+            for number, row in enumerate(reader, 1):
+                yield number, row, None
+        except (UnicodeDecodeError, csv.Error) as e:
+            yield number + 1, None, f'Unreadable CSV ({e}); the rest of the file was not read'
+        return
+
+    number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            row = loads(line)
+        except (JSONDecodeError, UnicodeDecodeError):
+            yield number, None, 'Invalid JSON'
+            continue
+        if isinstance(row, dict):
+            yield number, row, None
+        else:
+            yield number, None, 'Each line must be a JSON object'
+
+
+def _text(row, field):
+    value = row.get(field)
+    return value.strip() if isinstance(value, str) else value
+
+
+def _pence(row, field, default=None):
+    value = _text(row, field)
+    if value in (None, '') and default is not None:
+        return default
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    raise ValueError(f'{field} must be whole pence >= 0')
+
+
+def clean_row(row, base_url=None):
+    """The ``Booking`` field values for one import row. Raises ``ValueError``.
+
+    Follows the rules of ``POST /api/bookings/``: a ``service_id`` from the
+    catalogue sets the service name and amounts, and ``service_name`` and
+    ``booking_date`` may be left to the row's ``slot_id``, which is checked
+    later with the rest of its chunk.
+    """
+    fields = {
+        'customer_name': _text(row, 'customer_name'),
+        'customer_email': _text(row, 'customer_email'),
+        'customer_phone': _text(row, 'customer_phone') or '',
+        'service_name': _text(row, 'service_name'),
+        'notes': _text(row, 'notes') or '',
+        'success_url': _text(row, 'success_url') or None,
+        'cancel_url': _text(row, 'cancel_url') or None,
+        'service_id': None,
+        'stripe_price_id': None,
+        'import_key': _text(row, 'import_key') or None,
+    }
+    if fields['import_key'] is not None and (not isinstance(fields['import_key'], str) or len(fields['import_key']) > 255):
+        raise ValueError('import_key must be text of at most 255 characters')
+    service_id = _text(row, 'service_id')
+    if service_id not in (None, ''):
+        try:
+            service = get_service(int(service_id))
+        except (Service.DoesNotExist, ValueError, TypeError):
+            raise ValueError('Service not found')
+        row = {**row, 'total_amount_pence': service.price_pence, 'deposit_amount_pence': service.deposit_amount_pence}
+        fields.update(service_id=service.id, service_name=service.name, stripe_price_id=service.stripe_price_id)
+    elif service_required():
+        raise ValueError('service_id required')
+
+    slot_id = _text(row, 'slot_id')
+    if slot_id in (None, ''):
+        fields['slot_id'] = None
+    elif str(slot_id).isdigit():
+        fields['slot_id'] = int(slot_id)
+    else:
+        raise ValueError('slot_id must be an integer')
+
+    booking_date = _text(row, 'booking_date')
+    if booking_date:
+        try:
+            booking_date = parse_datetime(booking_date)
+        except (TypeError, ValueError):
+            booking_date = None
+        if booking_date is None:
+            raise ValueError('booking_date must be an ISO datetime')
+        if timezone.is_naive(booking_date):
+            booking_date = timezone.make_aware(booking_date)
+    fields['booking_date'] = booking_date or None
+
+    if not fields['customer_name'] or not fields['customer_email'] or _text(row, 'total_amount_pence') in (None, '') \
+            or (fields['slot_id'] is None and not (fields['service_name'] and fields['booking_date'])):
+        raise ValueError('Missing required fields: customer_name, customer_email, service_name, booking_date, total_amount_pence')
+    try:
+        validate_email(fields['customer_email'])
+    except ValidationError:
+        raise ValueError('customer_email is not a valid email address')
+
+    fields['total_amount_pence'] = _pence(row, 'total_amount_pence')
+    fields['deposit_amount_pence'] = _pence(row, 'deposit_amount_pence', default=0)
+    if fields['deposit_amount_pence'] > fields['total_amount_pence']:
+        raise ValueError('deposit_amount_pence cannot exceed total_amount_pence')
+    if fields['deposit_amount_pence'] and settings.PAYMENTS_ENABLED and not base_url \
+            and not (fields['success_url'] and fields['cancel_url']):
+        raise ValueError('A deposit needs success_url and cancel_url (or an import base URL)')
+    return fields
+
+
+def row_key(number, row):
+    """The import key of a row without an ``import_key`` column: its number and a digest of its values."""
+    digest = hashlib.sha256(dumps(sorted([str(key), value] for key, value in row.items()))).hexdigest()
+    return f'row:{number}:{digest[:40]}'
+
+
+def result_writer(out, fmt):
+    """A function that appends one result dict to the text stream ``out`` in ``fmt``."""
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, RESULT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        return writer.writerow
+    return lambda result: out.write(dumps(result).decode() + '\n')
+
+
+def create_deposit_checkouts(bookings, options, base_url, pool):
+    """Create the deposit checkout session of each booking. Returns ``{booking_id: (response, error)}``.
+
+    ``options`` maps booking ids to extra ``deposit_checkout_data`` arguments.
+    """
+
+    def create(booking):
+        try:
+            data = booking.deposit_checkout_data(
+                base_url, idempotency_key=f'booking-{booking.id}-import', **options[booking.id],
+            )
+            return create_checkout_session_internal(data), None
+        except Exception as e:
+            return None, f'Payment error: {e}'
+        finally:
+            close_old_connections()
+
+    return dict(zip((booking.id for booking in bookings), pool.map(create, bookings)))
+
+
+def checkout_options(fields):
+    return {key: fields[key] for key in ('success_url', 'cancel_url', 'stripe_price_id')}
+
+
+def import_chunk(rows, base_url, pool, dry_run=False):
+    """Write one chunk of cleaned rows. Returns a result dict per row.
+
+    ``rows`` holds ``(row_number, fields)``.
+    """
+    slot_ids = {fields['slot_id'] for _, fields in rows if fields['slot_id'] is not None}
+    slots = Slot.objects.only('id', 'service_name', 'starts_at').in_bulk(slot_ids)
+    imported = Booking.objects.in_bulk([fields['import_key'] for _, fields in rows], field_name='import_key')
+    results, valid, existing, seen = [], [], [], set()
+    for number, fields in rows:
+        if fields['import_key'] in seen:
+            results.append({'row': number, 'status': 'error', 'error': 'Duplicate import_key'})
+            continue
+        seen.add(fields['import_key'])
+        if fields['import_key'] in imported:
+            existing.append((number, fields, imported[fields['import_key']]))
+            continue
+        slot = slots.get(fields['slot_id'])
+        if fields['slot_id'] is not None and slot is None:
+            results.append({'row': number, 'status': 'error', 'error': 'Slot not found'})
+            continue
+        if slot:
+            fields['service_name'] = fields['service_name'] or slot.service_name
+            fields['booking_date'] = fields['booking_date'] or slot.starts_at
+        valid.append((number, fields))
+    if dry_run:
+        return results + [{'row': number, 'status': 'valid'} for number, _ in valid] + [
+            {'row': number, 'status': 'exists', 'booking_id': booking.id, 'booking_status': booking.status}
+            for number, _, booking in existing
+        ]
+
+    hold_expires_at = timezone.now() + timedelta(minutes=settings.BOOKING_SEAT_HOLD_MINUTES)
+    created, options = [], {}
+    with transaction.atomic():
+        bookings = []
+        for number, fields in valid:
+            if fields['slot_id'] is not None and not Slot.reserve_seat(fields['slot_id']):
+                results.append({'row': number, 'status': 'error', 'error': 'Slot is fully booked'})
+                continue
+            requires_payment = fields['deposit_amount_pence'] > 0 and settings.PAYMENTS_ENABLED
+            bookings.append(Booking(
+                customer_name=fields['customer_name'],
+                customer_email=fields['customer_email'],
+                customer_phone=fields['customer_phone'],
+                service_name=fields['service_name'],
+                booking_date=fields['booking_date'],
+                slot_id=fields['slot_id'],
+                service_id=fields['service_id'],
+                hold_expires_at=hold_expires_at if fields['slot_id'] and requires_payment else None,
+                total_amount_pence=fields['total_amount_pence'],
+                deposit_amount_pence=fields['deposit_amount_pence'],
+                notes=fields['notes'],
+                import_key=fields['import_key'],
+                status='PENDING_PAYMENT' if requires_payment else 'CONFIRMED',
+            ))
+            created.append((number, fields))
+        Booking.objects.bulk_create(bookings)
+
+    # Existing bookings still awaiting a deposit get the checkout their first run created, or a new one.
+    pending = [booking for booking in bookings if booking.status == 'PENDING_PAYMENT']
+    pending += [booking for _, _, booking in existing if booking.status == 'PENDING_PAYMENT']
+    for booking, (_, fields) in zip(bookings, created):
+        options[booking.id] = checkout_options(fields)
+    for _, fields, booking in existing:
+        options[booking.id] = checkout_options(fields)
+    checkouts = create_deposit_checkouts(pending, options, base_url, pool) if pending else {}
+
+    failed = defaultdict(list)
+    for booking_id, (response, error) in checkouts.items():
+        if error:
+            failed[error].append(booking_id)
+    for error, booking_ids in failed.items():
+        Booking.objects.filter(id__in=booking_ids).cancel(error)
+
+    for booking, (number, _) in zip(bookings, created):
+        response, error = checkouts.get(booking.id, (None, None))
+        if error:
+            results.append({'row': number, 'status': 'error', 'booking_id': booking.id,
+                            'booking_status': 'CANCELLED', 'error': error})
+        else:
+            results.append({
+                'row': number,
+                'status': 'created',
+                'booking_id': booking.id,
+                'booking_status': booking.status,
+                'checkout_url': response.get('checkout_url') if response else None,
+                'payment_session_id': response.get('payment_session_id') if response else None,
+            })
+    for number, _, booking in existing:
+        response, error = checkouts.get(booking.id, (None, None))
+        results.append({
+            'row': number,
+            'status': 'exists',
+            'booking_id': booking.id,
+            'booking_status': 'CANCELLED' if error else booking.status,
+            'checkout_url': response.get('checkout_url') if response else None,
+            'payment_session_id': response.get('payment_session_id') if response else None,
+            'error': error,
+        })
+    return results
+
+
+def import_bookings(lines, fmt, out, base_url=None, chunk_size=None, concurrency=None, dry_run=False, progress=None):
+    """Import the bookings in ``lines`` (an iterable of bytes) and write a result per row to ``out``.
+
+    ``base_url`` is where deposit payers are sent back to when a row has no
+    ``success_url``/``cancel_url``. With ``dry_run`` rows are only validated.
+    ``progress(summary)`` is called after every chunk.
+
+    Returns:
+        dict with keys: rows, created, confirmed, pending_payment, valid
+        (dry runs), existing, errors, chunks, elapsed_seconds, per_second
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown import format: {fmt}')
+    chunk_size = chunk_size or settings.BOOKING_IMPORT_CHUNK_SIZE
+    concurrency = concurrency or settings.BOOKING_IMPORT_CONCURRENCY
+    write = result_writer(out, fmt)
+    summary = Counter()
+    started = time.monotonic()
+
+    def flush(chunk, rejected):
+        results = rejected + (import_chunk(chunk, base_url, pool, dry_run) if chunk else [])
+        for result in sorted(results, key=lambda result: result['row']):
+            write(result)
+            summary['rows'] += 1
+            if result['status'] == 'error':
+                summary['errors'] += 1
+            elif result['status'] == 'created':
+                summary['created'] += 1
+                summary['pending_payment' if result['booking_status'] == 'PENDING_PAYMENT' else 'confirmed'] += 1
+            elif result['status'] == 'exists':
+                summary['existing'] += 1
+            else:
+                summary['valid'] += 1
+        summary['chunks'] += 1
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        if progress:
+            progress(summary)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        chunk, rejected = [], []
+        for number, row, error in read_rows(lines, fmt):
+            if not error:
+                try:
+                    fields = clean_row(row, base_url)
+                    fields['import_key'] = fields['import_key'] or row_key(number, row)
+                    chunk.append((number, fields))
+                except ValueError as e:
+                    error = str(e)
+            if error:
+                rejected.append({'row': number, 'status': 'error', 'error': error})
+            if len(chunk) + len(rejected) >= chunk_size:
+                flush(chunk, rejected)
+                chunk, rejected = [], []
+        if chunk or rejected:
+            flush(chunk, rejected)
+
+    summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    result = {key: summary[key] for key in (
+        'rows', 'created', 'confirmed', 'pending_payment', 'valid', 'existing', 'errors', 'chunks', 'elapsed_seconds',
+    )}
+    result['per_second'] = round(summary['rows'] / summary['elapsed_seconds'], 1) if summary['elapsed_seconds'] else 0
+    return result
@@ -0,0 +1,60 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from bookings.imports import FORMATS, import_bookings
+
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+class Command(BaseCommand):
+    help = 'Import bookings from a CSV or NDJSON file, creating deposit checkout sessions, with a result per row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or NDJSON file')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension')
+        parser.add_argument('--output', help='Result file (default: <path without extension>-results.<format>)')
+        parser.add_argument('--base-url', help='Public URL of this service, for deposit success/cancel redirects')
+        parser.add_argument('--chunk-size', type=int, default=settings.BOOKING_IMPORT_CHUNK_SIZE)
+        parser.add_argument('--concurrency', type=int, default=settings.BOOKING_IMPORT_CONCURRENCY,
+                            help='Concurrent checkout session creations')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the rows without importing them')
+
+    def handle(self, *args, **options):
+        root, extension = os.path.splitext(options['path'])
+        fmt = options['format'] or EXTENSIONS.get(extension.lower())
+        if not fmt:
+            raise CommandError('Cannot tell the format from the file name; pass --format')
+        output = options['output'] or f'{root}-results.{fmt}'
+
+        try:
+            with open(options['path'], 'rb') as lines, open(output, 'w', encoding='utf-8', newline='') as out:
+                summary = import_bookings(
+                    lines, fmt, out,
+                    base_url=(options['base_url'] or '').rstrip('/') or None,
+                    chunk_size=options['chunk_size'],
+                    concurrency=options['concurrency'],
+                    dry_run=options['dry_run'],
+                    progress=self.report,
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+
+        if options['dry_run']:
+            self.stdout.write(f"Dry run: {summary['valid']} of {summary['rows']} row(s) valid, {summary['errors']} invalid.")
+        else:
+            self.stdout.write(
+                f"Import done: {summary['rows']} rows, {summary['created']} created ({summary['confirmed']} confirmed, "
+                f"{summary['pending_payment']} awaiting deposit), {summary['existing']} already imported, "
+                f"{summary['errors']} errors "
+                f"in {summary['elapsed_seconds']}s ({summary['per_second']}/s)"
+            )
+        self.stdout.write(f'Results written to {output}')
+
+    def report(self, summary):
+        elapsed = summary['elapsed_seconds'] or 0
+        rate = summary['rows'] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"chunk {summary['chunks']}: rows={summary['rows']} created={summary['created']} "
+            f"errors={summary['errors']} rate={rate:.1f}/s"
+        )
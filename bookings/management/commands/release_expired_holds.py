@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from bookings.models import Booking
+
+
+class Command(BaseCommand):
+    help = 'Cancel PENDING_PAYMENT bookings whose seat hold has expired and return their seats'
+
+    def handle(self, *args, **options):
+        released = Booking.objects.expired_holds().cancel('Seat hold expired before payment')
+        self.stdout.write(f'Released {released} expired seat hold(s).')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from bookings.catalogue import sync_service
+from bookings.models import Service
+
+
+class Command(BaseCommand):
+    help = 'Create or update the Stripe Product and deposit Price of each active service'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Also push service names to existing Products')
+
+    def handle(self, *args, **options):
+        synced = sum(sync_service(service, force=options['force']) for service in Service.objects.filter(is_active=True))
+        self.stdout.write(f'Synced {synced} service(s) with Stripe.')
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.9 on 2026-10-18 22:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookings", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Slot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("service_name", models.CharField(max_length=255)),
+                ("starts_at", models.DateTimeField()),
+                ("ends_at", models.DateTimeField()),
+                ("capacity", models.PositiveIntegerField()),
+                ("reserved_count", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "bookings_slot",
+                "ordering": ["starts_at"],
+            },
+        ),
+        migrations.AddField(
+            model_name="booking",
+            name="hold_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["status", "hold_expires_at"],
+                name="bookings_bo_status_815b94_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="slot",
+            index=models.Index(
+                fields=["starts_at", "ends_at"], name="bookings_sl_starts__b679ac_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="slot",
+            index=models.Index(
+                fields=["service_name", "starts_at"],
+                name="bookings_sl_service_6c0ac5_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="slot",
+            constraint=models.CheckConstraint(
+                check=models.Q(("reserved_count__lte", models.F("capacity"))),
+                name="bookings_slot_not_oversold",
+            ),
+        ),
+        migrations.AddField(
+            model_name="booking",
+            name="slot",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="bookings",
+                to="bookings.slot",
+            ),
+        ),
+    ]
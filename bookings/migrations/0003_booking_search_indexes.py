@@ -0,0 +1,32 @@
+# Generated by Django 4.2.9 on 2026-10-18 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookings", "0002_slots_and_seat_holds"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["customer_email", "booking_date"],
+                name="bookings_bo_custome_532cf3_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["status", "booking_date"], name="bookings_bo_status_dfd677_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["booking_date", "id"], name="bookings_bo_booking_544863_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.2.9 on 2026-10-18 23:46
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookings", "0003_booking_search_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Service",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("description", models.TextField(blank=True)),
+                ("duration_minutes", models.PositiveIntegerField()),
+                ("price_pence", models.PositiveIntegerField()),
+                (
+                    "deposit_percent",
+                    models.PositiveSmallIntegerField(
+                        default=0,
+                        validators=[django.core.validators.MaxValueValidator(100)],
+                    ),
+                ),
+                (
+                    "deposit_pence",
+                    models.PositiveIntegerField(
+                        blank=True,
+                        help_text="Fixed deposit; overrides deposit_percent",
+                        null=True,
+                    ),
+                ),
+                ("is_active", models.BooleanField(default=True)),
+                ("stripe_product_id", models.CharField(blank=True, max_length=255)),
+                ("stripe_price_id", models.CharField(blank=True, max_length=255)),
+                (
+                    "stripe_price_amount_pence",
+                    models.PositiveIntegerField(blank=True, null=True),
+                ),
+                ("stripe_price_currency", models.CharField(blank=True, max_length=3)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "bookings_service",
+                "ordering": ["name"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="service",
+            constraint=models.CheckConstraint(
+                check=models.Q(("deposit_percent__lte", 100)),
+                name="bookings_service_deposit_percent",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="service",
+            constraint=models.CheckConstraint(
+                check=models.Q(("deposit_pence__lte", models.F("price_pence"))),
+                name="bookings_service_deposit_lte_price",
+            ),
+        ),
+        migrations.AddField(
+            model_name="booking",
+            name="service",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="bookings",
+                to="bookings.service",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.9 on 2026-10-19 00:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookings", "0004_service_catalogue"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booking",
+            name="import_key",
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
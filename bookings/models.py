@@ -1,4 +1,159 @@
-from django.db import models
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.validators import MaxValueValidator
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from .cache import invalidate_booking_detail
+
+
+class Service(models.Model):
+    """A bookable service, priced server-side. Read through ``bookings.catalogue``."""
+    name = models.CharField(max_length=255, unique=True)
+    description = models.TextField(blank=True)
+    duration_minutes = models.PositiveIntegerField()
+    price_pence = models.PositiveIntegerField()
+    deposit_percent = models.PositiveSmallIntegerField(default=0, validators=[MaxValueValidator(100)])
+    deposit_pence = models.PositiveIntegerField(null=True, blank=True, help_text='Fixed deposit; overrides deposit_percent')
+    is_active = models.BooleanField(default=True)
+    # The Stripe Price charges the deposit; it is replaced when the deposit changes.
+    stripe_product_id = models.CharField(max_length=255, blank=True)
+    stripe_price_id = models.CharField(max_length=255, blank=True)
+    stripe_price_amount_pence = models.PositiveIntegerField(null=True, blank=True)
+    stripe_price_currency = models.CharField(max_length=3, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'bookings_service'
+        ordering = ['name']
+        constraints = [
+            models.CheckConstraint(check=Q(deposit_percent__lte=100), name='bookings_service_deposit_percent'),
+            models.CheckConstraint(check=Q(deposit_pence__lte=F('price_pence')), name='bookings_service_deposit_lte_price'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def deposit_amount_pence(self):
+        if self.deposit_pence is not None:
+            return self.deposit_pence
+        return (self.price_pence * self.deposit_percent + 50) // 100
+
+    @property
+    def current_stripe_price_id(self):
+        """The synced Stripe Price, or ``''`` if it no longer matches the deposit."""
+        if (self.stripe_price_amount_pence, self.stripe_price_currency) != (self.deposit_amount_pence, settings.DEFAULT_CURRENCY):
+            return ''
+        return self.stripe_price_id
+
+
+class Slot(models.Model):
+    service_name = models.CharField(max_length=255)
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    capacity = models.PositiveIntegerField()
+    reserved_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'bookings_slot'
+        ordering = ['starts_at']
+        indexes = [
+            models.Index(fields=['starts_at', 'ends_at']),
+            models.Index(fields=['service_name', 'starts_at']),
+        ]
+        constraints = [
+            models.CheckConstraint(check=Q(reserved_count__lte=F('capacity')), name='bookings_slot_not_oversold'),
+        ]
+
+    def __str__(self):
+        return f"{self.service_name} @ {self.starts_at:%Y-%m-%d %H:%M} ({self.reserved_count}/{self.capacity})"
+
+    @property
+    def seats_available(self):
+        return max(self.capacity - self.reserved_count, 0)
+
+    @classmethod
+    def overlapping(cls, start, end):
+        """Slots whose [starts_at, ends_at) interval overlaps [start, end)."""
+        return cls.objects.filter(starts_at__lt=end, ends_at__gt=start)
+
+    @classmethod
+    def reserve_seat(cls, slot_id):
+        """Take one seat with a single conditional UPDATE.
+
+        The database serialises concurrent reservations on the slot row, so the
+        capacity check and the increment can never interleave and oversell.
+        """
+        updated = cls.objects.filter(
+            id=slot_id, reserved_count__lt=F('capacity')
+        ).update(reserved_count=F('reserved_count') + 1, updated_at=timezone.now())
+        return updated == 1
+
+    @classmethod
+    def release_seats(cls, slot_id, count=1):
+        return cls.objects.filter(
+            id=slot_id, reserved_count__gte=count
+        ).update(reserved_count=F('reserved_count') - count, updated_at=timezone.now())
+
+
+class BookingQuerySet(models.QuerySet):
+    def cancel(self, note):
+        """Cancel every matched booking that is not already cancelled.
+
+        Seats held by the cancelled bookings are handed back to their slots
+        (one UPDATE per slot). Returns the number of bookings cancelled.
+        """
+        with transaction.atomic():
+            rows = list(
+                self.exclude(status='CANCELLED').select_for_update().values_list('id', 'slot_id')
+            )
+            if not rows:
+                return 0
+
+            Booking.objects.filter(id__in=[booking_id for booking_id, _ in rows]).update(
+                status='CANCELLED',
+                notes=Concat(F('notes'), Value(f"\n[{note}]")),
+                hold_expires_at=None,
+                updated_at=timezone.now(),
+            )
+
+            for slot_id, count in Counter(slot_id for _, slot_id in rows if slot_id).items():
+                Slot.release_seats(slot_id, count)
+
+            invalidate_booking_detail(booking_id for booking_id, _ in rows)
+
+        return len(rows)
+
+    def confirm(self):
+        """Confirm matched bookings whose deposit has been paid.
+
+        Pending bookings are confirmed with one UPDATE. Bookings that were
+        cancelled in the meantime (e.g. their seat hold lapsed) go through
+        ``Booking.confirm`` so they only come back if their seat can be re-taken.
+        Returns the number of bookings confirmed.
+        """
+        with transaction.atomic():
+            pending_ids = list(
+                self.filter(status='PENDING_PAYMENT').select_for_update().values_list('id', flat=True)
+            )
+            confirmed = Booking.objects.filter(id__in=pending_ids).update(
+                status='CONFIRMED', hold_expires_at=None, updated_at=timezone.now()
+            )
+            invalidate_booking_detail(pending_ids)
+            for booking in self.filter(status='CANCELLED').select_for_update():
+                confirmed += booking.confirm()
+        return confirmed
+
+    def expired_holds(self, now=None):
+        return self.filter(status='PENDING_PAYMENT', hold_expires_at__lt=now or timezone.now())
 
 
 class Booking(models.Model):
@@ -14,19 +169,84 @@ class Booking(models.Model):
     customer_phone = models.CharField(max_length=50, blank=True)
     service_name = models.CharField(max_length=255)
     booking_date = models.DateTimeField()
+    slot = models.ForeignKey(Slot, on_delete=models.PROTECT, null=True, blank=True, related_name='bookings')
+    service = models.ForeignKey(Service, on_delete=models.PROTECT, null=True, blank=True, related_name='bookings')
+    hold_expires_at = models.DateTimeField(null=True, blank=True)
     total_amount_pence = models.IntegerField()
     deposit_amount_pence = models.IntegerField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING_PAYMENT', db_index=True)
     notes = models.TextField(blank=True)
+    # Set by the bulk import, so re-running an import skips rows already imported.
+    import_key = models.CharField(max_length=255, null=True, blank=True, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BookingQuerySet.as_manager()
+
     class Meta:
         db_table = 'bookings_booking'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'hold_expires_at']),
+            models.Index(fields=['customer_email', 'booking_date']),
+            models.Index(fields=['status', 'booking_date']),
+            models.Index(fields=['booking_date', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.customer_name} - {self.service_name} - {self.status}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_booking_detail([self.id])
+
     def requires_payment(self):
         return self.deposit_amount_pence > 0
+
+    def deposit_checkout_data(self, base_url, success_url=None, cancel_url=None, stripe_price_id=None,
+                              idempotency_key=None):
+        """The ``create_checkout_session_internal`` request for this booking's deposit.
+
+        ``success_url``/``cancel_url`` default to this app's redirect handlers under ``base_url``.
+        ``stripe_price_id`` is the service's synced deposit Price, if it has one.
+        ``idempotency_key`` defaults to a new key, i.e. a new checkout session per call.
+        """
+        booking_date = self.booking_date
+        data = {
+            'payable_type': 'booking',
+            'payable_id': str(self.id),
+            'amount_pence': self.deposit_amount_pence,
+            'currency': settings.DEFAULT_CURRENCY,
+            'customer': {
+                'email': self.customer_email,
+                'name': self.customer_name,
+                'phone': self.customer_phone,
+            },
+            'success_url': success_url or f"{base_url}/api/bookings/{self.id}/payment-success/?session_id={{CHECKOUT_SESSION_ID}}",
+            'cancel_url': cancel_url or f"{base_url}/api/bookings/{self.id}/payment-cancel/",
+            'metadata': {
+                'service_name': self.service_name,
+                'booking_date': booking_date if isinstance(booking_date, str) else booking_date.isoformat(),
+                'deposit_pct': int((self.deposit_amount_pence / self.total_amount_pence) * 100) if self.total_amount_pence > 0 else 0,
+            },
+            'idempotency_key': idempotency_key or f"booking-{self.id}-{uuid.uuid4()}",
+        }
+        if stripe_price_id:
+            data['stripe_price_id'] = stripe_price_id
+        return data
+
+    def confirm(self):
+        """Confirm the booking once its deposit has been paid.
+
+        A booking whose seat hold lapsed before the payment arrived has already
+        handed its seat back, so it is only confirmed if the seat can be re-taken.
+        """
+        if self.status == 'CANCELLED' and self.slot_id and not Slot.reserve_seat(self.slot_id):
+            self.notes += "\n[Payment succeeded after the seat hold expired and the slot is now full]"
+            self.save(update_fields=['notes', 'updated_at'])
+            return False
+
+        self.status = 'CONFIRMED'
+        self.hold_expires_at = None
+        self.save(update_fields=['status', 'hold_expires_at', 'updated_at'])
+        return True
@@ -1,7 +1,24 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
 from unittest.mock import patch, MagicMock
+from datetime import timedelta
+from io import StringIO
+import base64
+import csv
 import json
-from .models import Booking
+import os
+import tempfile
+from payments.callbacks import sign_payload
+from payments.models import PaymentSession, PaymentSessionItem, Transaction
+from payments.views import create_cart_checkout_session_internal, handle_checkout_completed
+from .callbacks import apply_payment_events
+from .catalogue import get_catalogue, get_service
+from .models import Booking, Service, Slot
 
 
 class BookingCreationTest(TestCase):
@@ -158,3 +175,600 @@ class BookingWebhookCallbackTest(TestCase):
         self.booking.refresh_from_db()
         self.assertEqual(self.booking.status, 'CANCELLED')
         self.assertIn('Payment failed', self.booking.notes)
+
+
+@override_settings(PAYMENTS_CALLBACK_SECRET='cb_secret')
+class BookingBatchCallbackTest(TestCase):
+    def setUp(self):
+        self.bookings = [
+            Booking.objects.create(
+                customer_name=f'Batch {n}',
+                customer_email=f'batch{n}@example.com',
+                service_name='Test Service',
+                booking_date='2026-03-15T14:00:00Z',
+                total_amount_pence=10000,
+                deposit_amount_pence=5000,
+                status='PENDING_PAYMENT',
+            )
+            for n in range(4)
+        ]
+
+    def post(self, body, secret='cb_secret'):
+        return self.client.post(
+            '/api/bookings/webhook/payment/batch/',
+            data=body,
+            content_type='application/json',
+            HTTP_X_PAYMENTS_SIGNATURE=sign_payload(body, secret),
+        )
+
+    def test_batch_applies_one_update_per_status(self):
+        statuses = ['succeeded', 'succeeded', 'failed', 'canceled']
+        body = json.dumps({'events': [
+            {'payable_type': 'booking', 'payable_id': str(booking.id), 'payment_session_id': str(n), 'status': status}
+            for n, (booking, status) in enumerate(zip(self.bookings, statuses))
+        ] + [{'payable_type': 'order', 'payable_id': '1', 'payment_session_id': '9', 'status': 'succeeded'}]}).encode()
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.post(body)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'received': 5, 'updated': 4})
+        # One UPDATE per target status: succeeded, failed and canceled.
+        updates = [q for q in captured if q['sql'].startswith('UPDATE "bookings_booking"')]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(
+            [booking.status for booking in Booking.objects.order_by('id')],
+            ['CONFIRMED', 'CONFIRMED', 'CANCELLED', 'CANCELLED'],
+        )
+
+    def test_batch_requires_valid_signature(self):
+        body = json.dumps({'events': []}).encode()
+        self.assertEqual(self.post(body, secret='wrong').status_code, 400)
+        response = self.client.post('/api/bookings/webhook/payment/batch/', data=body, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        with override_settings(PAYMENTS_CALLBACK_SECRET=''):
+            self.assertEqual(self.post(body).status_code, 500)
+
+
+class SlotReservationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.slot = Slot.objects.create(
+            service_name='Spin Class',
+            starts_at='2026-03-15T09:00:00Z',
+            ends_at='2026-03-15T10:00:00Z',
+            capacity=2,
+        )
+
+    def book(self, n, deposit=0):
+        return self.client.post(
+            '/api/bookings/',
+            data=json.dumps({
+                'customer_name': f'Rider {n}',
+                'customer_email': f'rider{n}@example.com',
+                'slot_id': self.slot.id,
+                'total_amount_pence': 2000,
+                'deposit_amount_pence': deposit,
+            }),
+            content_type='application/json'
+        )
+
+    def test_slot_cannot_be_overbooked(self):
+        self.assertEqual(self.book(1).status_code, 201)
+        self.assertEqual(self.book(2).status_code, 201)
+
+        response = self.book(3)
+        self.assertEqual(response.status_code, 409)
+
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.reserved_count, 2)
+        self.assertEqual(Booking.objects.filter(slot=self.slot).count(), 2)
+
+    def test_booking_takes_service_and_date_from_slot(self):
+        data = self.book(1).json()
+        booking = Booking.objects.get(id=data['booking_id'])
+        self.assertEqual(booking.service_name, 'Spin Class')
+        self.slot.refresh_from_db()
+        self.assertEqual(booking.booking_date, self.slot.starts_at)
+
+    @patch('bookings.views.create_checkout_session_internal')
+    def test_cancel_releases_seat_once(self, mock_checkout):
+        mock_checkout.return_value = {'checkout_url': 'https://checkout.stripe.com/test', 'payment_session_id': '1'}
+        data = self.book(1, deposit=500).json()
+        booking = Booking.objects.get(id=data['booking_id'])
+        self.assertEqual(booking.status, 'PENDING_PAYMENT')
+        self.assertIsNotNone(booking.hold_expires_at)
+
+        self.assertEqual(Booking.objects.filter(id=booking.id).cancel('Payment failed'), 1)
+        self.assertEqual(Booking.objects.filter(id=booking.id).cancel('Payment failed'), 0)
+
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.reserved_count, 0)
+
+    @patch('bookings.views.create_checkout_session_internal')
+    def test_expired_holds_are_released(self, mock_checkout):
+        mock_checkout.return_value = {'checkout_url': 'https://checkout.stripe.com/test', 'payment_session_id': '1'}
+        data = self.book(1, deposit=500).json()
+        Booking.objects.filter(id=data['booking_id']).update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+
+        call_command('release_expired_holds', stdout=StringIO())
+
+        booking = Booking.objects.get(id=data['booking_id'])
+        self.assertEqual(booking.status, 'CANCELLED')
+        self.assertIn('Seat hold expired', booking.notes)
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.reserved_count, 0)
+
+    def test_availability_uses_interval_overlap(self):
+        Slot.objects.create(
+            service_name='Spin Class',
+            starts_at='2026-03-15T18:00:00Z',
+            ends_at='2026-03-15T19:00:00Z',
+            capacity=1,
+            reserved_count=1,
+        )
+
+        response = self.client.get('/api/bookings/slots/', {
+            'start': '2026-03-15T09:30:00Z',
+            'end': '2026-03-15T23:00:00Z',
+        })
+        self.assertEqual(response.status_code, 200)
+        slots = response.json()['slots']
+        self.assertEqual([s['slot_id'] for s in slots], [self.slot.id])
+        self.assertEqual(slots[0]['seats_available'], 2)
+
+
+class BookingSearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+        for day in range(1, 6):
+            Booking.objects.create(
+                customer_name='Repeat Customer',
+                customer_email='repeat@example.com',
+                service_name='Cut',
+                booking_date=f'2026-03-0{day}T10:00:00Z',
+                total_amount_pence=3000,
+                deposit_amount_pence=0,
+                status='CONFIRMED' if day % 2 else 'CANCELLED',
+            )
+        Booking.objects.create(
+            customer_name='Someone Else',
+            customer_email='else@example.com',
+            service_name='Cut',
+            booking_date='2026-03-03T10:00:00Z',
+            total_amount_pence=3000,
+            deposit_amount_pence=0,
+            status='CONFIRMED',
+        )
+
+    def test_requires_staff(self):
+        response = self.client.get('/api/bookings/search/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_cursor_pages_through_all_results_without_overlap(self):
+        self.client.force_login(self.staff)
+        seen = []
+        cursor = None
+        while True:
+            params = {'customer_email': 'repeat@example.com', 'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get('/api/bookings/search/', params).json()
+            seen.extend(row['booking_date'] for row in data['results'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_filters_by_status_and_date_range(self):
+        self.client.force_login(self.staff)
+        data = self.client.get('/api/bookings/search/', {
+            'status': 'CONFIRMED',
+            'date_from': '2026-03-02T00:00:00Z',
+            'date_to': '2026-03-05T00:00:00Z',
+        }).json()
+
+        self.assertEqual(
+            sorted(row['customer_email'] for row in data['results']),
+            ['else@example.com', 'repeat@example.com'],
+        )
+        self.assertIsNone(data['next_cursor'])
+
+    def test_invalid_cursor_rejected(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/bookings/search/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+        bad_date = base64.urlsafe_b64encode(json.dumps(['yesterday', 1]).encode()).decode().rstrip('=')
+        response = self.client.get('/api/bookings/search/', {'cursor': bad_date})
+        self.assertEqual(response.status_code, 400)
+
+
+class InProcessPaymentSubscriberTest(TestCase):
+    def setUp(self):
+        self.bookings = [
+            Booking.objects.create(
+                customer_name=f'Customer {n}',
+                customer_email=f'customer{n}@example.com',
+                service_name='Test Service',
+                booking_date='2026-03-15T14:00:00Z',
+                total_amount_pence=10000,
+                deposit_amount_pence=5000,
+                status='PENDING_PAYMENT'
+            )
+            for n in range(3)
+        ]
+        self.payment_session = PaymentSession.objects.create(
+            payable_type='booking',
+            payable_id=str(self.bookings[0].id),
+            amount_pence=5000,
+            status='pending',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key='booking-inprocess',
+            stripe_checkout_session_id='cs_inprocess',
+        )
+
+    @patch('payments.callbacks.requests.post')
+    def test_stripe_webhook_confirms_booking_without_http_callback(self, mock_post):
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_checkout_completed({'id': 'cs_inprocess', 'payment_intent': 'pi_inprocess'}, 'evt_inprocess')
+
+        self.bookings[0].refresh_from_db()
+        self.assertEqual(self.bookings[0].status, 'CONFIRMED')
+        mock_post.assert_not_called()
+
+    def test_apply_payment_events_groups_by_status(self):
+        changed = apply_payment_events([
+            {'payable_type': 'booking', 'payable_id': str(self.bookings[0].id), 'status': 'succeeded'},
+            {'payable_type': 'booking', 'payable_id': str(self.bookings[1].id), 'status': 'failed'},
+            {'payable_type': 'booking', 'payable_id': str(self.bookings[2].id), 'status': 'canceled'},
+            {'payable_type': 'order', 'payable_id': str(self.bookings[2].id), 'status': 'succeeded'},
+        ])
+
+        self.assertEqual(changed, 3)
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[self.bookings[0].id], 'CONFIRMED')
+        self.assertEqual(statuses[self.bookings[1].id], 'CANCELLED')
+        self.assertEqual(statuses[self.bookings[2].id], 'CANCELLED')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BookingDetailTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.booking = Booking.objects.create(
+            customer_name='Dana',
+            customer_email='dana@example.com',
+            service_name='Consultation',
+            booking_date=timezone.now() + timedelta(days=3),
+            total_amount_pence=10000,
+            deposit_amount_pence=5000,
+            status='PENDING_PAYMENT',
+        )
+        self.payment_session = PaymentSession.objects.create(
+            payable_type='booking',
+            payable_id=str(self.booking.id),
+            amount_pence=5000,
+            status='pending',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key='booking-detail',
+            stripe_checkout_session_id='cs_detail',
+        )
+        self.url = f'/api/bookings/{self.booking.id}/?include=payments'
+
+    def test_booking_with_payments_in_one_query_then_from_cache(self):
+        Transaction.objects.create(payment_session=self.payment_session, gross_amount_pence=5000, provider_charge_id='pi_1')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(queries), 1)
+        data = response.json()
+        self.assertEqual(data['booking_id'], self.booking.id)
+        self.assertEqual(data['payments'][0]['payment_session_id'], str(self.payment_session.id))
+        self.assertEqual(data['payments'][0]['transactions'][0]['provider_charge_id'], 'pi_1')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertEqual(len(queries), 0)
+
+    def test_conditional_get_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_payment_status_change_invalidates_cached_detail(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_checkout_completed({'id': 'cs_detail', 'payment_intent': 'pi_detail'}, 'evt_detail')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['status'], 'CONFIRMED')
+        self.assertEqual(data['payments'][0]['status'], 'succeeded')
+
+    def test_cart_payments_are_included_and_confirm_the_booking(self):
+        cart = PaymentSession.objects.create(
+            payable_type='cart',
+            payable_id='cart-key',
+            amount_pence=8000,
+            status='succeeded',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key='cart-key',
+        )
+        PaymentSessionItem.objects.create(
+            payment_session=cart, payable_type='booking', payable_id=str(self.booking.id), amount_pence=5000,
+        )
+
+        payments = self.client.get(self.url).json()['payments']
+        self.assertEqual(
+            {payment['payment_session_id']: payment['amount_pence'] for payment in payments},
+            {str(self.payment_session.id): 5000, str(cart.id): 5000},
+        )
+
+        response = self.client.post(
+            f'/api/bookings/{self.booking.id}/confirm-payment/',
+            data=json.dumps({'payment_session_id': str(cart.id)}), content_type='application/json',
+        )
+        self.assertEqual(response.json()['status'], 'CONFIRMED')
+
+    @patch('payments.views.stripe.checkout.Session.create')
+    def test_cart_checkout_invalidates_cached_detail(self, mock_session_create):
+        mock_session_create.return_value = MagicMock(id='cs_cart_detail', url='https://checkout.stripe.com/c', payment_intent=None)
+        etag = self.client.get(self.url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_cart_checkout_session_internal({
+                'items': [
+                    {'payable_type': 'booking', 'payable_id': self.booking.id, 'amount_pence': 2000},
+                    {'payable_type': 'voucher', 'payable_id': 'v-1', 'amount_pence': 3000},
+                ],
+                'success_url': 'https://example.com/success',
+                'cancel_url': 'https://example.com/cancel',
+                'idempotency_key': 'cart-detail',
+            })
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(payment['amount_pence'] for payment in response.json()['payments']), [2000, 5000])
+
+    def test_plain_detail_has_no_payments(self):
+        data = self.client.get(f'/api/bookings/{self.booking.id}/').json()
+        self.assertNotIn('payments', data)
+        self.assertEqual(data['customer_email'], 'dana@example.com')
+
+
+class BookingImportTest(TestCase):
+    CSV = (
+        'customer_name,customer_email,service_name,booking_date,slot_id,total_amount_pence,deposit_amount_pence\n'
+        'Ann,ann@example.com,Cut,2026-03-15T09:00:00Z,,3000,\n'
+        'Bob,bob@example.com,,,{slot},2000,500\n'
+        'Cat,not-an-email,Cut,2026-03-15T10:00:00Z,,3000,0\n'
+        'Dan,dan@example.com,,,{slot},2000,500\n'
+        'Eve,eve@example.com,Cut,2026-03-15T11:00:00Z,,3000,4000\n'
+    )
+
+    def setUp(self):
+        self.client = Client()
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+        self.slot = Slot.objects.create(
+            service_name='Spin Class',
+            starts_at='2026-03-15T09:00:00Z',
+            ends_at='2026-03-15T10:00:00Z',
+            capacity=1,
+        )
+
+    def import_csv(self, **kwargs):
+        from .imports import import_bookings
+
+        out = StringIO()
+        lines = self.CSV.format(slot=self.slot.id).encode().splitlines(keepends=True)
+        summary = import_bookings(lines, 'csv', out, base_url='https://example.com', **kwargs)
+        return summary, list(csv.DictReader(StringIO(out.getvalue())))
+
+    @patch('bookings.imports.create_checkout_session_internal')
+    def test_csv_import_writes_a_result_per_row(self, mock_checkout):
+        mock_checkout.return_value = {'checkout_url': 'https://checkout.stripe.com/test', 'payment_session_id': '7'}
+
+        summary, results = self.import_csv(chunk_size=2)
+
+        self.assertEqual(summary['rows'], 5)
+        self.assertEqual(summary['created'], 2)
+        self.assertEqual(summary['errors'], 3)
+        self.assertEqual(summary['chunks'], 3)
+        self.assertEqual([result['row'] for result in results], ['1', '2', '3', '4', '5'])
+        self.assertEqual([result['status'] for result in results], ['created', 'created', 'error', 'error', 'error'])
+        self.assertEqual(results[0]['booking_status'], 'CONFIRMED')
+        self.assertEqual(results[1]['booking_status'], 'PENDING_PAYMENT')
+        self.assertEqual(results[1]['checkout_url'], 'https://checkout.stripe.com/test')
+        self.assertIn('email', results[2]['error'])
+        self.assertEqual(results[3]['error'], 'Slot is fully booked')
+        self.assertIn('cannot exceed', results[4]['error'])
+
+        booking = Booking.objects.get(id=results[1]['booking_id'])
+        self.assertEqual(booking.service_name, 'Spin Class')
+        self.assertIsNotNone(booking.hold_expires_at)
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.reserved_count, 1)
+        payment_data = mock_checkout.call_args[0][0]
+        self.assertEqual(payment_data['payable_id'], str(booking.id))
+        self.assertTrue(payment_data['success_url'].startswith(f'https://example.com/api/bookings/{booking.id}/'))
+
+    @patch('bookings.imports.create_checkout_session_internal')
+    def test_rerun_skips_rows_already_imported(self, mock_checkout):
+        mock_checkout.return_value = {'checkout_url': 'https://checkout.stripe.com/test', 'payment_session_id': '7'}
+        self.import_csv()
+        first_keys = [call.args[0]['idempotency_key'] for call in mock_checkout.call_args_list]
+
+        summary, results = self.import_csv()
+
+        self.assertEqual((summary['created'], summary['existing']), (0, 2))
+        self.assertEqual(Booking.objects.count(), 2)
+        self.assertEqual([result['status'] for result in results], ['exists', 'exists', 'error', 'error', 'error'])
+        self.assertEqual(results[1]['payment_session_id'], '7')
+        # The unpaid booking's checkout is looked up again under the same idempotency key.
+        self.assertEqual([call.args[0]['idempotency_key'] for call in mock_checkout.call_args_list[1:]], first_keys)
+
+    @patch('bookings.imports.create_checkout_session_internal')
+    def test_failed_checkout_cancels_booking_and_returns_seat(self, mock_checkout):
+        mock_checkout.side_effect = ValueError('Stripe is down')
+
+        summary, results = self.import_csv()
+
+        self.assertEqual(results[1]['status'], 'error')
+        self.assertEqual(results[1]['booking_status'], 'CANCELLED')
+        booking = Booking.objects.get(id=results[1]['booking_id'])
+        self.assertEqual(booking.status, 'CANCELLED')
+        self.assertIn('Stripe is down', booking.notes)
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.reserved_count, 0)
+
+    def test_endpoint_imports_ndjson_for_staff_only(self):
+        body = '\n'.join([
+            json.dumps({'customer_name': 'Ann', 'customer_email': 'ann@example.com', 'service_name': 'Cut',
+                        'booking_date': '2026-03-15T09:00:00Z', 'total_amount_pence': 3000}),
+            '',
+            '{not json',
+            json.dumps(['not', 'an', 'object']),
+        ])
+        response = self.client.post('/api/bookings/import/', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.post('/api/bookings/import/', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Import-Created'], '1')
+        self.assertEqual(response['X-Import-Errors'], '2')
+        results = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([result['row'] for result in results], [1, 2, 3])
+        self.assertEqual(results[0]['booking_status'], 'CONFIRMED')
+        self.assertEqual(results[1]['error'], 'Invalid JSON')
+        self.assertTrue(Booking.objects.filter(id=results[0]['booking_id'], customer_email='ann@example.com').exists())
+
+    def test_command_dry_run_only_validates(self):
+        stdout = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'diary.csv')
+            with open(path, 'w') as f:
+                f.write(self.CSV.format(slot=self.slot.id))
+
+            call_command('import_bookings', path, '--dry-run', '--base-url', 'https://example.com', stdout=stdout)
+
+            with open(os.path.join(directory, 'diary-results.csv')) as f:
+                statuses = [result['status'] for result in csv.DictReader(f)]
+        self.assertEqual(statuses, ['valid', 'valid', 'error', 'valid', 'error'])
+        self.assertIn('3 of 5 row(s) valid', stdout.getvalue())
+        self.assertFalse(Booking.objects.exists())
+
+
+class ServiceCatalogueTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        get_catalogue().invalidate()
+        self.service = Service.objects.create(
+            name='Colour', duration_minutes=90, price_pence=8000, deposit_percent=25,
+            stripe_product_id='prod_colour', stripe_price_id='price_colour',
+            stripe_price_amount_pence=2000, stripe_price_currency='GBP',
+        )
+
+    def tearDown(self):
+        get_catalogue().invalidate()
+
+    def book(self, **extra):
+        return self.client.post('/api/bookings/', data=json.dumps({
+            'customer_name': 'Fay',
+            'customer_email': 'fay@example.com',
+            'service_id': self.service.id,
+            'booking_date': '2026-03-15T14:00:00Z',
+            **extra,
+        }), content_type='application/json')
+
+    @patch('bookings.views.create_checkout_session_internal')
+    def test_booking_is_priced_from_the_cached_catalogue(self, mock_checkout):
+        mock_checkout.return_value = {'checkout_url': 'https://checkout.stripe.com/test', 'payment_session_id': '1'}
+        self.book()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.book(total_amount_pence=1, deposit_amount_pence=0)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([q for q in queries.captured_queries if 'bookings_service' in q['sql'] and 'SELECT' in q['sql']])
+        booking = Booking.objects.get(id=response.json()['booking_id'])
+        self.assertEqual((booking.service_id, booking.service_name), (self.service.id, 'Colour'))
+        self.assertEqual((booking.total_amount_pence, booking.deposit_amount_pence), (8000, 2000))
+        payment_data = mock_checkout.call_args[0][0]
+        self.assertEqual((payment_data['amount_pence'], payment_data['stripe_price_id']), (2000, 'price_colour'))
+
+        self.assertEqual(self.book(service_id=999999).status_code, 404)
+
+    @patch('bookings.views.create_checkout_session_internal')
+    def test_client_amounts_are_rejected_once_services_exist(self, mock_checkout):
+        mock_checkout.return_value = {'checkout_url': 'https://checkout.stripe.com/test', 'payment_session_id': '1'}
+        # The default keeps accepting client amounts (the shipped booking form sends no service_id).
+        self.assertEqual(self.book(service_id=None, service_name='Colour', total_amount_pence=1).status_code, 201)
+
+        with self.settings(BOOKING_REQUIRE_SERVICE='auto'):
+            response = self.book(service_id=None, service_name='Colour', total_amount_pence=1)
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'service_id required'}))
+
+            self.service.is_active = False
+            self.service.save()
+            get_catalogue().invalidate()
+            self.assertEqual(self.book(service_id=None, service_name='Colour', total_amount_pence=1).status_code, 201)
+        with self.settings(BOOKING_REQUIRE_SERVICE='always'):
+            self.assertEqual(self.book(service_id=None, service_name='Colour', total_amount_pence=1).status_code, 400)
+
+    def test_saving_a_service_invalidates_the_catalogue(self):
+        self.assertEqual(get_service(self.service.id).stripe_price_id, 'price_colour')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.deposit_pence = 1500
+            self.service.save()
+
+        entry = get_service(self.service.id)
+        self.assertEqual(entry.deposit_amount_pence, 1500)
+        # The synced Price is for the old deposit, so it is no longer offered.
+        self.assertEqual(entry.stripe_price_id, '')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.is_active = False
+            self.service.save()
+        with self.assertRaises(Service.DoesNotExist):
+            get_service(self.service.id)
+
+    @patch('payments.catalogue.stripe.Price.modify')
+    @patch('payments.catalogue.stripe.Price.create')
+    @patch('payments.catalogue.stripe.Product.create')
+    def test_sync_services_only_replaces_out_of_date_prices(self, mock_product_create, mock_price_create, mock_price_modify):
+        mock_product_create.return_value = MagicMock(id='prod_trim')
+        mock_price_create.return_value = MagicMock(id='price_trim')
+        trim = Service.objects.create(name='Trim', duration_minutes=30, price_pence=2500, deposit_pence=500)
+        Service.objects.create(name='Consultation', duration_minutes=15, price_pence=0)
+
+        call_command('sync_services', stdout=StringIO())
+
+        mock_product_create.assert_called_once()
+        mock_price_create.assert_called_once()
+        self.assertEqual(mock_price_create.call_args.kwargs['unit_amount'], 500)
+        trim.refresh_from_db()
+        self.assertEqual((trim.stripe_product_id, trim.current_stripe_price_id), ('prod_trim', 'price_trim'))
+
+        Service.objects.filter(id=self.service.id).update(deposit_percent=50)
+        mock_price_create.return_value = MagicMock(id='price_colour_2')
+        stdout = StringIO()
+        with patch('payments.catalogue.stripe.Product.modify') as mock_product_modify:
+            call_command('sync_services', stdout=stdout)
+
+        self.assertIn('Synced 1 service(s)', stdout.getvalue())
+        mock_product_modify.assert_called_once()
+        self.assertEqual(mock_price_create.call_args.kwargs['unit_amount'], 4000)
+        self.assertEqual(mock_price_modify.call_args.args, ('price_colour',))
+        self.service.refresh_from_db()
+        self.assertEqual(self.service.current_stripe_price_id, 'price_colour_2')
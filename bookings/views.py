@@ -1,20 +1,37 @@
-import json
-import uuid
+import base64
+import io
+import tempfile
+from datetime import timedelta
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.db import transaction
-from .models import Booking
+from django.db.models import F, Q
+from .models import Booking, Service, Slot
+from .cache import invalidate_booking_detail
+from .callbacks import apply_payment_events
+from .catalogue import get_service, service_required
+from .detail import cached_booking_detail
+from .imports import FORMATS, import_bookings
+from payments.callbacks import verify_signature
+from payments.fastjson import JSONDecodeError, JsonResponse, ResponseShape, dumps, isoformat, loads
+from payments.models import CART_PAYABLE_TYPE, PaymentSessionItem
+from payments.throttling import throttle
 from payments.views import create_checkout_session_internal, get_payment_status_internal
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@throttle('booking')
 def create_booking(request):
     try:
-        data = json.loads(request.body)
-    except json.JSONDecodeError:
+        data = loads(request.body)
+    except JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
     customer_name = data.get('customer_name')
@@ -22,114 +39,303 @@ def create_booking(request):
     customer_phone = data.get('customer_phone', '')
     service_name = data.get('service_name')
     booking_date = data.get('booking_date')
+    slot_id = data.get('slot_id')
     total_amount_pence = data.get('total_amount_pence')
     deposit_amount_pence = data.get('deposit_amount_pence', 0)
     notes = data.get('notes', '')
     frontend_success_url = data.get('success_url')
     frontend_cancel_url = data.get('cancel_url')
+    service_id = data.get('service_id')
+
+    # Catalogue services are priced here; the client's amounts are ignored.
+    service = None
+    if service_id is not None:
+        try:
+            service = get_service(int(service_id))
+        except (Service.DoesNotExist, ValueError, TypeError):
+            return JsonResponse({'error': 'Service not found'}, status=404)
+        service_name = service.name
+        total_amount_pence = service.price_pence
+        deposit_amount_pence = service.deposit_amount_pence
+    elif service_required():
+        return JsonResponse({'error': 'service_id required'}, status=400)
+
+    slot = None
+    if slot_id is not None:
+        try:
+            slot = Slot.objects.only('id', 'service_name', 'starts_at').get(id=slot_id)
+        except (Slot.DoesNotExist, ValueError, TypeError):
+            return JsonResponse({'error': 'Slot not found'}, status=404)
+        service_name = service_name or slot.service_name
+        booking_date = booking_date or slot.starts_at.isoformat()
 
     if any(v is None for v in [customer_name, customer_email, service_name, booking_date, total_amount_pence]):
         return JsonResponse({
             'error': 'Missing required fields: customer_name, customer_email, service_name, booking_date, total_amount_pence'
         }, status=400)
 
+    requires_payment = deposit_amount_pence > 0 and settings.PAYMENTS_ENABLED
+
+    # Keep the seat reservation and the booking insert in one short transaction
+    # so the slot row is not locked while we wait on Stripe.
     with transaction.atomic():
+        if slot and not Slot.reserve_seat(slot.id):
+            return JsonResponse({'error': 'Slot is fully booked', 'slot_id': slot.id}, status=409)
+
         booking = Booking.objects.create(
             customer_name=customer_name,
             customer_email=customer_email,
             customer_phone=customer_phone,
             service_name=service_name,
             booking_date=booking_date,
+            slot=slot,
+            service_id=service.id if service else None,
+            hold_expires_at=timezone.now() + timedelta(minutes=settings.BOOKING_SEAT_HOLD_MINUTES) if slot and requires_payment else None,
             total_amount_pence=total_amount_pence,
             deposit_amount_pence=deposit_amount_pence,
             notes=notes,
-            status='PENDING_PAYMENT' if deposit_amount_pence > 0 and settings.PAYMENTS_ENABLED else 'CONFIRMED',
+            status='PENDING_PAYMENT' if requires_payment else 'CONFIRMED',
         )
 
-        if deposit_amount_pence > 0 and settings.PAYMENTS_ENABLED:
-            try:
-                idempotency_key = f"booking-{booking.id}-{uuid.uuid4()}"
-                
-                success_url = frontend_success_url or f"{request.scheme}://{request.get_host()}/api/bookings/{booking.id}/payment-success/?session_id={{CHECKOUT_SESSION_ID}}"
-                cancel_url = frontend_cancel_url or f"{request.scheme}://{request.get_host()}/api/bookings/{booking.id}/payment-cancel/"
-
-                payment_data = {
-                    'payable_type': 'booking',
-                    'payable_id': str(booking.id),
-                    'amount_pence': deposit_amount_pence,
-                    'currency': settings.DEFAULT_CURRENCY,
-                    'customer': {
-                        'email': customer_email,
-                        'name': customer_name,
-                        'phone': customer_phone,
-                    },
-                    'success_url': success_url,
-                    'cancel_url': cancel_url,
-                    'metadata': {
-                        'service_name': service_name,
-                        'booking_date': booking_date,
-                        'deposit_pct': int((deposit_amount_pence / total_amount_pence) * 100) if total_amount_pence > 0 else 0,
-                    },
-                    'idempotency_key': idempotency_key,
-                }
-
-                payment_response = create_checkout_session_internal(payment_data)
-                return JsonResponse({
-                    'booking_id': booking.id,
-                    'status': booking.status,
-                    'checkout_url': payment_response.get('checkout_url'),
-                    'payment_session_id': payment_response.get('payment_session_id'),
-                }, status=201)
-
-            except ValueError as e:
-                booking.status = 'CANCELLED'
-                booking.notes += f"\n[Payment validation error: {str(e)}]"
-                booking.save()
-                return JsonResponse({
-                    'error': f'Payment validation error: {str(e)}',
-                    'booking_id': booking.id,
-                }, status=400)
-            except Exception as e:
-                booking.status = 'CANCELLED'
-                booking.notes += f"\n[Payment error: {str(e)}]"
-                booking.save()
-                return JsonResponse({
-                    'error': f'Payment system error: {str(e)}',
-                    'booking_id': booking.id,
-                }, status=500)
+    if requires_payment:
+        try:
+            payment_data = booking.deposit_checkout_data(
+                f"{request.scheme}://{request.get_host()}", frontend_success_url, frontend_cancel_url,
+                stripe_price_id=service.stripe_price_id if service else None,
+            )
+            payment_response = create_checkout_session_internal(payment_data)
+            invalidate_booking_detail([booking.id])
+            return JsonResponse({
+                'booking_id': booking.id,
+                'status': booking.status,
+                'checkout_url': payment_response.get('checkout_url'),
+                'payment_session_id': payment_response.get('payment_session_id'),
+                'hold_expires_at': booking.hold_expires_at.isoformat() if booking.hold_expires_at else None,
+            }, status=201)
 
-        return JsonResponse({
-            'booking_id': booking.id,
-            'status': booking.status,
-            'message': 'Booking confirmed without payment' if not deposit_amount_pence else 'Booking created',
-        }, status=201)
+        except ValueError as e:
+            Booking.objects.filter(id=booking.id).cancel(f"Payment validation error: {str(e)}")
+            return JsonResponse({
+                'error': f'Payment validation error: {str(e)}',
+                'booking_id': booking.id,
+            }, status=400)
+        except Exception as e:
+            Booking.objects.filter(id=booking.id).cancel(f"Payment error: {str(e)}")
+            return JsonResponse({
+                'error': f'Payment system error: {str(e)}',
+                'booking_id': booking.id,
+            }, status=500)
+
+    return JsonResponse({
+        'booking_id': booking.id,
+        'status': booking.status,
+        'message': 'Booking confirmed without payment' if not deposit_amount_pence else 'Booking created',
+    }, status=201)
+
+
+@require_http_methods(["GET"])
+def list_available_slots(request):
+    start = parse_datetime(request.GET.get('start', '') or '')
+    end = parse_datetime(request.GET.get('end', '') or '')
+    if not start or not end or end <= start:
+        return JsonResponse({'error': 'start and end must be ISO datetimes with start < end'}, status=400)
+
+    slots = Slot.overlapping(start, end).filter(reserved_count__lt=F('capacity'))
+    service_name = request.GET.get('service_name')
+    if service_name:
+        slots = slots.filter(service_name=service_name)
+
+    return JsonResponse({
+        'slots': [
+            {
+                'slot_id': slot['id'],
+                'service_name': slot['service_name'],
+                'starts_at': slot['starts_at'].isoformat(),
+                'ends_at': slot['ends_at'].isoformat(),
+                'capacity': slot['capacity'],
+                'seats_available': slot['capacity'] - slot['reserved_count'],
+            }
+            for slot in slots.values('id', 'service_name', 'starts_at', 'ends_at', 'capacity', 'reserved_count')
+        ]
+    })
 
 
 @require_http_methods(["GET"])
 def get_booking(request, booking_id):
+    """Booking detail; ``?include=payments`` adds its payment sessions and transactions.
+
+    Responses are cached per booking until its booking or payment status
+    changes, and carry an ``ETag`` so polling clients get a 304.
+    """
+    include_payments = 'payments' in request.GET.get('include', '').split(',')
     try:
-        booking = Booking.objects.get(id=booking_id)
-        return JsonResponse({
-            'booking_id': booking.id,
-            'customer_name': booking.customer_name,
-            'customer_email': booking.customer_email,
-            'service_name': booking.service_name,
-            'booking_date': booking.booking_date.isoformat(),
-            'total_amount_pence': booking.total_amount_pence,
-            'deposit_amount_pence': booking.deposit_amount_pence,
-            'status': booking.status,
-            'notes': booking.notes,
-        })
+        etag, body = cached_booking_detail(booking_id, include_payments)
     except Booking.DoesNotExist:
         return JsonResponse({'error': 'Booking not found'}, status=404)
 
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+SEARCH_RESULT_SHAPE = ResponseShape(
+    booking_id='id',
+    customer_name='customer_name',
+    customer_email='customer_email',
+    service_name='service_name',
+    booking_date=('booking_date', isoformat),
+    status='status',
+    total_amount_pence='total_amount_pence',
+    deposit_amount_pence='deposit_amount_pence',
+)
+SEARCH_DEFAULT_LIMIT = 25
+SEARCH_MAX_LIMIT = 100
+
+
+def encode_cursor(booking_date, booking_id):
+    raw = dumps([booking_date.isoformat(), booking_id])
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    booking_date, booking_id = loads(raw)
+    after_date = parse_datetime(booking_date)
+    if after_date is None:
+        raise ValueError(f'Invalid cursor date: {booking_date!r}')
+    return after_date, int(booking_id)
+
+
+@require_http_methods(["GET"])
+def search_bookings(request):
+    """Staff listing of bookings, newest-first keyset pagination.
+
+    Pages are addressed by an opaque cursor over ``(booking_date, id)`` rather
+    than an OFFSET, so every page is a bounded index range scan no matter how
+    deep the client has paged.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+
+    bookings = Booking.objects.all()
+
+    customer_email = request.GET.get('customer_email')
+    if customer_email:
+        bookings = bookings.filter(customer_email=customer_email)
+
+    status = request.GET.get('status')
+    if status:
+        if status not in dict(Booking.STATUS_CHOICES):
+            return JsonResponse({'error': f'Unknown status: {status}'}, status=400)
+        bookings = bookings.filter(status=status)
+
+    for param, lookup in (('date_from', 'booking_date__gte'), ('date_to', 'booking_date__lt')):
+        value = request.GET.get(param)
+        if value:
+            parsed = parse_datetime(value)
+            if not parsed:
+                return JsonResponse({'error': f'{param} must be an ISO datetime'}, status=400)
+            bookings = bookings.filter(**{lookup: parsed})
+
+    try:
+        limit = min(int(request.GET.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    if limit < 1:
+        return JsonResponse({'error': 'limit must be positive'}, status=400)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            after_date, after_id = decode_cursor(cursor)
+        except (ValueError, TypeError):
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        bookings = bookings.filter(
+            Q(booking_date__lt=after_date) | Q(booking_date=after_date, id__lt=after_id)
+        )
+
+    rows = list(
+        bookings.order_by('-booking_date', '-id').values_list('booking_date', *SEARCH_RESULT_SHAPE.columns)[:limit + 1]
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+
+    return JsonResponse({
+        'results': [SEARCH_RESULT_SHAPE.from_row(row[1:]) for row in rows],
+        'next_cursor': next_cursor,
+    })
+
+
+IMPORT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+@require_http_methods(["POST"])
+def bulk_import_bookings(request):
+    """Staff import of bookings from a CSV or NDJSON upload; responds with the per-row result file.
+
+    The file is the request body (or a multipart ``file`` field) and is read a
+    line at a time; results are spooled to a temporary file, so neither is
+    held in memory. The format comes from ``?format=`` or the upload's type.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+
+    upload = request.FILES.get('file') if request.content_type == 'multipart/form-data' else None
+    fmt = request.GET.get('format')
+    if not fmt:
+        content_type = upload.content_type if upload else request.content_type
+        fmt = IMPORT_CONTENT_TYPES.get(content_type)
+        if not fmt and upload:
+            fmt = {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(upload.name.rsplit('.', 1)[-1].lower())
+    if fmt not in FORMATS:
+        return JsonResponse({'error': 'format must be csv or ndjson'}, status=400)
+
+    results = tempfile.TemporaryFile()
+    out = io.TextIOWrapper(results, encoding='utf-8', newline='')
+    summary = import_bookings(
+        upload if upload else request, fmt, out,
+        base_url=f"{request.scheme}://{request.get_host()}",
+        dry_run=request.GET.get('dry_run') in ('1', 'true'),
+    )
+    out.flush()
+    out.detach()
+    results.seek(0)
+
+    response = FileResponse(
+        results, content_type='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        as_attachment=True, filename=f'booking-import-results.{fmt}',
+    )
+    for key in ('rows', 'created', 'existing', 'errors'):
+        response[f'X-Import-{key.capitalize()}'] = str(summary[key])
+    return response
+
+
+def pays_for_booking(payment_data, booking_id):
+    """Whether the payment session in ``payment_data`` paid for the booking, alone or as a cart item."""
+    if payment_data.get('payable_type') != CART_PAYABLE_TYPE:
+        return payment_data.get('payable_id') == str(booking_id)
+    # A cart's payable_id is its idempotency key; the bookings it paid for are its items.
+    return PaymentSessionItem.objects.filter(
+        payment_session_id=payment_data.get('payment_session_id'), payable_type='booking', payable_id=str(booking_id),
+    ).exists()
+
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def confirm_booking_payment(request, booking_id):
     try:
-        data = json.loads(request.body)
-    except json.JSONDecodeError:
+        data = loads(request.body)
+    except JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
     payment_session_id = data.get('payment_session_id')
@@ -145,9 +351,9 @@ def confirm_booking_payment(request, booking_id):
     try:
         payment_data = get_payment_status_internal(payment_session_id)
 
-        if payment_data.get('status') == 'succeeded' and payment_data.get('payable_id') == str(booking_id):
-            booking.status = 'CONFIRMED'
-            booking.save(update_fields=['status', 'updated_at'])
+        if payment_data.get('status') == 'succeeded' and pays_for_booking(payment_data, booking_id):
+            if booking.status != 'CONFIRMED':
+                booking.confirm()
             return JsonResponse({
                 'booking_id': booking.id,
                 'status': booking.status,
@@ -169,33 +375,45 @@ def confirm_booking_payment(request, booking_id):
 @require_http_methods(["POST"])
 def payment_webhook_callback(request):
     try:
-        data = json.loads(request.body)
-    except json.JSONDecodeError:
+        data = loads(request.body)
+    except JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
     payable_type = data.get('payable_type')
     payable_id = data.get('payable_id')
-    payment_status = data.get('status')
 
     if payable_type != 'booking':
         return JsonResponse({'message': 'Not a booking payment'})
 
-    try:
-        booking = Booking.objects.get(id=payable_id)
-    except Booking.DoesNotExist:
+    if not str(payable_id).isdigit() or not Booking.objects.filter(id=payable_id).exists():
         return JsonResponse({'error': 'Booking not found'}, status=404)
 
-    if payment_status == 'succeeded':
-        booking.status = 'CONFIRMED'
-        booking.save(update_fields=['status', 'updated_at'])
-    elif payment_status in ['failed', 'canceled']:
-        booking.status = 'CANCELLED'
-        booking.notes += f"\n[Payment {payment_status}]"
-        booking.save(update_fields=['status', 'notes', 'updated_at'])
+    apply_payment_events([data])
 
     return JsonResponse({'message': 'Booking updated'})
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def payment_webhook_batch_callback(request):
+    """Apply a signed ``{"events": [...]}`` batch from the payments batch callback mode."""
+    secret = settings.PAYMENTS_CALLBACK_SECRET
+    if not secret:
+        return JsonResponse({'error': 'Callback secret not configured'}, status=500)
+    if not verify_signature(request.body, request.META.get('HTTP_X_PAYMENTS_SIGNATURE'), secret):
+        return JsonResponse({'error': 'Invalid signature'}, status=400)
+
+    try:
+        events = loads(request.body).get('events')
+    except (JSONDecodeError, AttributeError):
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not isinstance(events, list):
+        return JsonResponse({'error': 'events must be a list'}, status=400)
+
+    updated = apply_payment_events(event for event in events if isinstance(event, dict))
+    return JsonResponse({'received': len(events), 'updated': updated})
+
+
 @require_http_methods(["GET"])
 def payment_success(request, booking_id):
     session_id = request.GET.get('session_id')
@@ -215,16 +433,13 @@ def payment_success(request, booking_id):
 
 @require_http_methods(["GET"])
 def payment_cancel(request, booking_id):
-    try:
-        booking = Booking.objects.get(id=booking_id)
-        booking.status = 'CANCELLED'
-        booking.notes += '\n[Payment cancelled by user]'
-        booking.save(update_fields=['status', 'notes', 'updated_at'])
-    except Booking.DoesNotExist:
+    if not Booking.objects.filter(id=booking_id).exists():
         return JsonResponse({'error': 'Booking not found'}, status=404)
 
+    Booking.objects.filter(id=booking_id).cancel('Payment cancelled by user')
+
     return JsonResponse({
         'message': 'Payment cancelled',
-        'booking_id': booking.id,
-        'status': booking.status
+        'booking_id': booking_id,
+        'status': 'CANCELLED'
     })
@@ -5,3 +5,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Payments loads the Stripe SDK lazily so management commands start fast. A
+# serving process needs it anyway: import it here so that, under
+# `gunicorn --preload`, it is loaded once in the master and shared by workers.
+from payments.stripe_api import stripe  # noqa: E402
+
+stripe.load()
@@ -0,0 +1,55 @@
+"""Gunicorn configuration, selected by environment variables.
+
+    gunicorn -c config/gunicorn.py
+
+GUNICORN_WORKER_MODE
+    ``gthread`` (default): WSGI workers with a thread pool, so a worker keeps
+    serving while some threads wait on Stripe. ``uvicorn``: ASGI workers
+    (needs ``uvicorn``); Django runs the sync views on one thread per worker,
+    so this only pays off for async views.
+GUNICORN_ROLE
+    ``api`` (default) or ``webhook``. Webhook handlers never call Stripe and
+    Stripe retries on failure, so that role gets short timeouts and recycles
+    stuck workers quickly; API requests may wait on Stripe checkout creation.
+WEB_CONCURRENCY / GUNICORN_THREADS
+    Override the CPU-derived worker and thread counts.
+"""
+import multiprocessing
+import os
+
+mode = os.environ.get('GUNICORN_WORKER_MODE', 'gthread')
+role = os.environ.get('GUNICORN_ROLE', 'api')
+cpus = multiprocessing.cpu_count()
+
+ROLE_TIMEOUTS = {
+    # (timeout, graceful_timeout, keepalive)
+    'api': (30, 30, 5),
+    'webhook': (15, 10, 2),
+}
+if mode not in ('gthread', 'uvicorn'):
+    raise ValueError(f'Unknown GUNICORN_WORKER_MODE: {mode}')
+if role not in ROLE_TIMEOUTS:
+    raise ValueError(f'Unknown GUNICORN_ROLE: {role}')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+preload_app = True
+
+if mode == 'gthread':
+    wsgi_app = 'config.wsgi:application'
+    worker_class = 'gthread'
+    workers = int(os.environ.get('WEB_CONCURRENCY', cpus + 1))
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+else:
+    wsgi_app = 'config.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    workers = int(os.environ.get('WEB_CONCURRENCY', cpus * 2 + 1))
+
+timeout, graceful_timeout, keepalive = ROLE_TIMEOUTS[role]
+
+# Recycle workers periodically to cap slow leaks; jitter stops them all restarting at once.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+
+accesslog = '-'
+errorlog = '-'
+proc_name = f'nbne-payments-{role}'
@@ -26,6 +26,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'payments.middleware.server_timing_middleware',
+    'payments.middleware.slow_request_profiler_middleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -92,9 +94,118 @@ REST_FRAMEWORK = {
 
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+# Override the Stripe API host, e.g. to point load tests at benchmarks/stripe_standin.py.
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE', '')
+# Client timeout per Stripe request; transactions that wrap Stripe calls can last a few of these.
+STRIPE_TIMEOUT_SECONDS = int(os.environ.get('STRIPE_TIMEOUT_SECONDS', '80'))
+# Per-tenant Stripe credentials (payments.Tenant) cached per process (see payments.tenants).
+PAYMENTS_TENANT_CACHE_SIZE = int(os.environ.get('PAYMENTS_TENANT_CACHE_SIZE', '1000'))
+PAYMENTS_TENANT_CACHE_SECONDS = int(os.environ.get('PAYMENTS_TENANT_CACHE_SECONDS', '300'))
 PAYMENTS_ENABLED = os.environ.get('PAYMENTS_ENABLED', 'True') == 'True'
 DEFAULT_CURRENCY = os.environ.get('DEFAULT_CURRENCY', 'GBP')
 PAYMENTS_WEBHOOK_CALLBACK_URL = os.environ.get('PAYMENTS_WEBHOOK_CALLBACK_URL', '')
+# Opt-in batch mode: coalesce callbacks for a short window and POST them as one
+# {"events": [...]} body to this URL instead of one request per change.
+PAYMENTS_WEBHOOK_CALLBACK_BATCH_URL = os.environ.get('PAYMENTS_WEBHOOK_CALLBACK_BATCH_URL', '')
+PAYMENTS_CALLBACK_BATCH_WINDOW_MS = int(os.environ.get('PAYMENTS_CALLBACK_BATCH_WINDOW_MS', '250'))
+PAYMENTS_CALLBACK_BATCH_MAX_EVENTS = int(os.environ.get('PAYMENTS_CALLBACK_BATCH_MAX_EVENTS', '500'))
+# HMAC key for the X-Payments-Signature header on callbacks; required by batch receivers.
+PAYMENTS_CALLBACK_SECRET = os.environ.get('PAYMENTS_CALLBACK_SECRET', '')
+
+PAYMENTS_SWEEP_MAX_AGE_MINUTES = int(os.environ.get('PAYMENTS_SWEEP_MAX_AGE_MINUTES', '60'))
+PAYMENTS_SWEEP_BATCH_SIZE = int(os.environ.get('PAYMENTS_SWEEP_BATCH_SIZE', '200'))
+PAYMENTS_SWEEP_CONCURRENCY = int(os.environ.get('PAYMENTS_SWEEP_CONCURRENCY', '8'))
+PAYMENTS_SWEEP_INTERVAL_SECONDS = int(os.environ.get('PAYMENTS_SWEEP_INTERVAL_SECONDS', '60'))
+# Webhook events parked while waiting for their payment session are dropped after this.
+PAYMENTS_PARKED_EVENT_MAX_AGE_HOURS = int(os.environ.get('PAYMENTS_PARKED_EVENT_MAX_AGE_HOURS', '72'))
+
+# Admin bulk actions on payment sessions (see payments.batches).
+PAYMENTS_BATCH_CHUNK_SIZE = int(os.environ.get('PAYMENTS_BATCH_CHUNK_SIZE', '100'))
+PAYMENTS_BATCH_CONCURRENCY = int(os.environ.get('PAYMENTS_BATCH_CONCURRENCY', '8'))
+
+# Off-session recurring charges (see `manage.py run_billing`).
+PAYMENTS_BILLING_BATCH_SIZE = int(os.environ.get('PAYMENTS_BILLING_BATCH_SIZE', '200'))
+PAYMENTS_BILLING_CONCURRENCY = int(os.environ.get('PAYMENTS_BILLING_CONCURRENCY', '8'))
+PAYMENTS_BILLING_RETRY_DAYS = int(os.environ.get('PAYMENTS_BILLING_RETRY_DAYS', '3'))
+PAYMENTS_BILLING_MAX_FAILURES = int(os.environ.get('PAYMENTS_BILLING_MAX_FAILURES', '3'))
+
+PAYMENTS_REFUND_CONCURRENCY = int(os.environ.get('PAYMENTS_REFUND_CONCURRENCY', '8'))
+PAYMENTS_REFUND_RATE_PER_SECOND = float(os.environ.get('PAYMENTS_REFUND_RATE_PER_SECOND', '20'))
+
+# Incremental projections over the payment event log (see `manage.py update_payment_projections`).
+PAYMENTS_PROJECTION_BATCH_SIZE = int(os.environ.get('PAYMENTS_PROJECTION_BATCH_SIZE', '1000'))
+# How long a missing event id is waited for before it counts as rolled back. It must exceed the
+# longest transaction that writes events: a checkout holds one across two Stripe calls.
+PAYMENTS_PROJECTION_GAP_SECONDS = int(os.environ.get('PAYMENTS_PROJECTION_GAP_SECONDS', str(10 * STRIPE_TIMEOUT_SECONDS)))
+PAYMENTS_PROJECTION_INTERVAL_SECONDS = int(os.environ.get('PAYMENTS_PROJECTION_INTERVAL_SECONDS', '60'))
+
+# Outbound Stripe rate limit shared by every worker: 'file' (one host),
+# 'database' (many hosts) or 'memory' (single process).
+PAYMENTS_STRIPE_RATE_LIMIT_BACKEND = os.environ.get('PAYMENTS_STRIPE_RATE_LIMIT_BACKEND', 'file')
+PAYMENTS_STRIPE_RATE_LIMIT_PATH = os.environ.get('PAYMENTS_STRIPE_RATE_LIMIT_PATH', '/tmp/nbne-payments-stripe.bucket')
+PAYMENTS_STRIPE_RATE_LIMIT_DB_ALIAS = 'stripe_ratelimit'
+PAYMENTS_STRIPE_RATE_PER_SECOND = float(os.environ.get('PAYMENTS_STRIPE_RATE_PER_SECOND', '25'))
+PAYMENTS_STRIPE_RATE_BURST = float(os.environ.get('PAYMENTS_STRIPE_RATE_BURST', '25'))
+PAYMENTS_STRIPE_BACKGROUND_RESERVE = float(os.environ.get('PAYMENTS_STRIPE_BACKGROUND_RESERVE', '0.2'))
+
+if PAYMENTS_STRIPE_RATE_LIMIT_BACKEND == 'database':
+    # Separate connection so the bucket row lock never waits on the caller's transaction.
+    DATABASES[PAYMENTS_STRIPE_RATE_LIMIT_DB_ALIAS] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+# Inbound throttling of checkout and booking creation per user or IP (see payments.throttling).
+# Rates are '<requests>/<second|minute|hour|day>'; an empty rate disables that route's limit.
+PAYMENTS_THROTTLE_ENABLED = os.environ.get('PAYMENTS_THROTTLE_ENABLED', 'True') == 'True'
+# Counters live in the 'throttle' cache (see CACHES): Redis with REDIS_URL, else per-process memory.
+PAYMENTS_THROTTLE_BACKEND = os.environ.get('PAYMENTS_THROTTLE_BACKEND', 'cache')
+PAYMENTS_THROTTLE_CACHE = 'throttle'
+PAYMENTS_THROTTLE_DB_ALIAS = 'default'
+# Proxies that append the client address to X-Forwarded-For (1 behind Railway's edge proxy).
+PAYMENTS_THROTTLE_NUM_PROXIES = int(os.environ.get('PAYMENTS_THROTTLE_NUM_PROXIES', '0'))
+PAYMENTS_THROTTLE_RATES = {
+    'checkout': os.environ.get('PAYMENTS_THROTTLE_CHECKOUT_RATE', '30/minute'),
+    'booking': os.environ.get('PAYMENTS_THROTTLE_BOOKING_RATE', '30/minute'),
+}
+
+# Fraction of requests that get a Server-Timing header and timing log line (0 disables).
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get('SERVER_TIMING_SAMPLE_RATE', '1.0'))
+
+# Sampling profiler for slow requests and webhook events (see `manage.py profile_summary`).
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'False') == 'True'
+PROFILER_THRESHOLD_MS = int(os.environ.get('PROFILER_THRESHOLD_MS', '1000'))
+PROFILER_INTERVAL_MS = int(os.environ.get('PROFILER_INTERVAL_MS', '5'))
+PROFILER_DIR = os.environ.get('PROFILER_DIR', '/tmp/nbne-profiles')
+PROFILER_MAX_CAPTURES = int(os.environ.get('PROFILER_MAX_CAPTURES', '200'))
+
+# Shared by all workers on a host so cache invalidation reaches every worker;
+# set REDIS_URL when running on more than one host.
+# Throttle counters need an atomic incr, which the file cache lacks.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.environ['REDIS_URL']},
+        'throttle': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.environ['REDIS_URL']},
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', '/tmp/nbne-payments-cache'),
+        },
+        'throttle': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'nbne-throttle'},
+    }
+
+BOOKING_DETAIL_CACHE_SECONDS = int(os.environ.get('BOOKING_DETAIL_CACHE_SECONDS', '300'))
+BOOKING_SEAT_HOLD_MINUTES = int(os.environ.get('BOOKING_SEAT_HOLD_MINUTES', '30'))
+
+# Service catalogue copy kept by each process (see bookings.catalogue).
+BOOKING_SERVICE_CACHE_SECONDS = int(os.environ.get('BOOKING_SERVICE_CACHE_SECONDS', '300'))
+# When bookings must carry a service_id instead of client amounts:
+# 'auto' once any service is active, 'always', or 'never'. The shipped booking
+# form sends no service_id, so 'never' until the frontend books by service.
+BOOKING_REQUIRE_SERVICE = os.environ.get('BOOKING_REQUIRE_SERVICE', 'never')
+
+# Bulk booking import (see `manage.py import_bookings`).
+BOOKING_IMPORT_CHUNK_SIZE = int(os.environ.get('BOOKING_IMPORT_CHUNK_SIZE', '500'))
+BOOKING_IMPORT_CONCURRENCY = int(os.environ.get('BOOKING_IMPORT_CONCURRENCY', '8'))
 
 CSRF_TRUSTED_ORIGINS = os.environ.get('CSRF_TRUSTED_ORIGINS', 'http://localhost:3000').split(',')
 
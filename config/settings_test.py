@@ -10,3 +10,8 @@ DATABASES = {
 STRIPE_SECRET_KEY = 'sk_test_fake_key_for_testing'
 STRIPE_WEBHOOK_SECRET = 'whsec_fake_secret_for_testing'
 PAYMENTS_ENABLED = True
+PAYMENTS_STRIPE_RATE_LIMIT_BACKEND = 'memory'
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'throttle': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
@@ -9,7 +9,7 @@ import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Input } from "@/components/ui/input";
 import { Label } from "@/components/ui/label";
 import { Badge } from "@/components/ui/badge";
-import { getBooking, formatPence, type BookingDetails } from "@/lib/api";
+import { getBookingWithPayments, formatPence, type BookingWithPayments } from "@/lib/api";
 
 function statusColor(status: string) {
   switch (status) {
@@ -39,7 +39,7 @@ export default function BookingLookupPage() {
 function BookingLookupContent() {
   const searchParams = useSearchParams();
   const [bookingId, setBookingId] = useState(searchParams.get("id") || "");
-  const [booking, setBooking] = useState<BookingDetails | null>(null);
+  const [booking, setBooking] = useState<BookingWithPayments | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
 
@@ -52,7 +52,7 @@ function BookingLookupContent() {
     setBooking(null);
 
     try {
-      const data = await getBooking(parseInt(bookingId));
+      const data = await getBookingWithPayments(parseInt(bookingId));
       setBooking(data);
     } catch {
       setError("Booking not found. Please check the ID and try again.");
@@ -6,10 +6,13 @@ import { CheckCircle, Loader2 } from "lucide-react";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
-import { getBooking, formatPence, type BookingDetails } from "@/lib/api";
+import { getBookingWithPayments, formatPence, type BookingWithPayments } from "@/lib/api";
+
+const POLL_INTERVAL_MS = 2000;
+const MAX_POLLS = 5;
 
 export default function BookingSuccessPage() {
-  const [booking, setBooking] = useState<BookingDetails | null>(null);
+  const [booking, setBooking] = useState<BookingWithPayments | null>(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState("");
 
@@ -22,19 +25,26 @@ export default function BookingSuccessPage() {
       return;
     }
 
+    let polls = 0;
+    let timer: ReturnType<typeof setTimeout>;
+
+    // Poll until the webhook has confirmed the booking; unchanged responses are 304s.
     const fetchBooking = async () => {
+      polls += 1;
       try {
-        const data = await getBooking(parseInt(bookingId));
+        const data = await getBookingWithPayments(parseInt(bookingId));
         setBooking(data);
+        if (data.status === "PENDING_PAYMENT" && polls < MAX_POLLS) {
+          timer = setTimeout(fetchBooking, POLL_INTERVAL_MS);
+          return;
+        }
       } catch {
         setError("Could not load booking details.");
-      } finally {
-        setLoading(false);
       }
+      setLoading(false);
     };
 
-    // Small delay to allow webhook to process
-    const timer = setTimeout(fetchBooking, 2000);
+    timer = setTimeout(fetchBooking, POLL_INTERVAL_MS);
     return () => clearTimeout(timer);
   }, []);
 
@@ -95,7 +105,11 @@ export default function BookingSuccessPage() {
                 <div className="flex justify-between text-sm">
                   <span className="text-muted-foreground">Deposit Paid</span>
                   <span className="font-semibold text-green-600">
-                    {formatPence(booking.deposit_amount_pence)}
+                    {formatPence(
+                      booking.payments
+                        .filter((payment) => payment.status === "succeeded")
+                        .reduce((total, payment) => total + payment.amount_pence, 0)
+                    )}
                   </span>
                 </div>
                 <div className="flex justify-between text-sm">
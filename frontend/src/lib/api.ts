@@ -33,6 +33,27 @@ export interface BookingDetails {
   notes: string;
 }
 
+export interface PaymentTransaction {
+  transaction_id: number;
+  gross_amount_pence: number;
+  currency: string;
+  provider_charge_id: string | null;
+  captured_at: string;
+}
+
+export interface BookingPayment {
+  payment_session_id: string;
+  status: string;
+  amount_pence: number;
+  currency: string;
+  created_at: string;
+  transactions: PaymentTransaction[];
+}
+
+export interface BookingWithPayments extends BookingDetails {
+  payments: BookingPayment[];
+}
+
 export async function createBooking(data: BookingRequest): Promise<BookingResponse> {
   const res = await fetch(`${API_URL}/api/bookings/`, {
     method: 'POST',
@@ -60,6 +81,21 @@ export async function getBooking(bookingId: number): Promise<BookingDetails> {
   return json;
 }
 
+// One request for the booking and its payments. `no-cache` makes the browser
+// revalidate with the ETag, so polling an unchanged booking costs a 304.
+export async function getBookingWithPayments(bookingId: number): Promise<BookingWithPayments> {
+  const res = await fetch(`${API_URL}/api/bookings/${bookingId}/?include=payments`, {
+    cache: 'no-cache',
+  });
+  const json = await res.json();
+
+  if (!res.ok) {
+    throw new Error(json.error || 'Failed to fetch booking');
+  }
+
+  return json;
+}
+
 export async function confirmBookingPayment(
   bookingId: number,
   paymentSessionId: string
@@ -1,27 +1,90 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.urls import reverse
 from django.utils.html import format_html
-from .models import Customer, PaymentSession, Transaction, Refund
+from .batches import ACTIONS, start_batch
+from .changelist import EstimatedCountPaginator, LedgerAdminMixin, cached_values_filter
+from .models import (
+    BatchJob, Customer, ParkedEvent, PaymentDailyTotal, PaymentEvent, PaymentSession, PaymentSessionItem,
+    RecurringCharge, Tenant, Transaction, Refund,
+)
+
+
+@admin.register(Tenant)
+class TenantAdmin(admin.ModelAdmin):
+    list_display = ['slug', 'name', 'is_active', 'webhook_url', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['slug', 'name']
+    prepopulated_fields = {'slug': ('name',)}
+    readonly_fields = ['webhook_url', 'created_at', 'updated_at']
+
+    def webhook_url(self, obj):
+        return reverse('tenant_stripe_webhook', args=[obj.slug]) if obj.slug else '-'
+    webhook_url.short_description = 'Stripe webhook URL'
 
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(LedgerAdminMixin, admin.ModelAdmin):
     list_display = ['email', 'name', 'phone', 'provider', 'provider_customer_id', 'created_at']
-    list_filter = ['provider', 'created_at']
-    search_fields = ['email', 'name', 'phone', 'provider_customer_id']
+    list_filter = ['tenant', cached_values_filter('provider'), 'created_at']
+    search_fields = ['email', 'provider_customer_id']
+    search_help_text = 'Email (prefix), Stripe customer id (cus_...) or customer id'
+    search_routes = [('cus_', 'provider_customer_id')]
+    search_email_field = 'email'
     readonly_fields = ['created_at', 'updated_at']
 
 
+class PaymentSessionItemInline(admin.TabularInline):
+    model = PaymentSessionItem
+    fields = ['payable_type', 'payable_id', 'name', 'amount_pence', 'status']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class PaymentEventInline(admin.TabularInline):
+    model = PaymentEvent
+    fields = ['seq', 'from_status', 'to_status', 'stripe_event_id', 'created_at']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(PaymentSession)
-class PaymentSessionAdmin(admin.ModelAdmin):
+class PaymentSessionAdmin(LedgerAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'payable_type', 'payable_id', 'amount_display', 'status', 'customer', 'created_at']
-    list_filter = ['status', 'payable_type', 'provider', 'currency', 'created_at']
+    list_filter = [
+        'tenant', 'status', cached_values_filter('payable_type'), cached_values_filter('provider'),
+        cached_values_filter('currency'), 'created_at',
+    ]
+    list_select_related = ['customer']
+    list_only = [
+        'id', 'payable_type', 'payable_id', 'amount_pence', 'currency', 'status', 'created_at',
+        'customer__email', 'customer__provider',
+    ]
+    date_hierarchy = 'created_at'
     search_fields = ['payable_id', 'stripe_checkout_session_id', 'stripe_payment_intent_id', 'idempotency_key']
-    readonly_fields = ['created_at', 'updated_at', 'stripe_checkout_session_id', 'stripe_payment_intent_id', 'processed_events']
+    search_help_text = (
+        'Checkout session (cs_...), payment intent (pi_...), customer email, '
+        'payable id or idempotency key (prefix), or session id'
+    )
+    search_routes = [('cs_', 'stripe_checkout_session_id'), ('pi_', 'stripe_payment_intent_id')]
+    search_email_field = 'customer__email'
+    search_text_fields = ['payable_id', 'idempotency_key']
+    readonly_fields = ['tenant', 'created_at', 'updated_at', 'stripe_checkout_session_id', 'stripe_payment_intent_id', 'processed_events']
     raw_id_fields = ['customer']
+    inlines = [PaymentSessionItemInline, PaymentEventInline]
+    actions = list(ACTIONS)
     
     fieldsets = (
         ('Payable Information', {
-            'fields': ('payable_type', 'payable_id', 'idempotency_key')
+            'fields': ('tenant', 'payable_type', 'payable_id', 'idempotency_key')
         }),
         ('Payment Details', {
             'fields': ('amount_pence', 'currency', 'status', 'provider')
@@ -47,12 +110,44 @@ class PaymentSessionAdmin(admin.ModelAdmin):
         return f"£{obj.amount_pence/100:.2f}"
     amount_display.short_description = 'Amount'
 
+    def get_action(self, action):
+        if action not in ACTIONS:
+            return super().get_action(action)
+
+        def run(modeladmin, request, queryset):
+            query = request.GET.copy()
+            if request.POST.get('select_across') != '1':
+                query['id__in'] = ','.join(request.POST.getlist(helpers.ACTION_CHECKBOX_NAME))
+            total = EstimatedCountPaginator(queryset, 1).count
+            job = start_batch(action, query.urlencode(), total, request.user)
+            url = reverse('admin:payments_batchjob_change', args=[job.id])
+            self.message_user(
+                request,
+                format_html('Queued {} for {} sessions: <a href="{}">batch job {}</a>',
+                            ACTIONS[action][0], job.total, url, job.id),
+                messages.SUCCESS,
+            )
+        return run, action, ACTIONS[action][0]
+
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(LedgerAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'payment_session', 'gross_amount_display', 'fee_amount_display', 'net_amount_display', 'captured_at']
-    list_filter = ['currency', 'captured_at', 'created_at']
+    list_filter = ['tenant', cached_values_filter('currency'), 'captured_at', 'created_at']
+    list_select_related = ['payment_session']
+    list_only = [
+        'id', 'gross_amount_pence', 'fee_amount_pence', 'net_amount_pence', 'currency', 'captured_at',
+        'payment_session__payable_type', 'payment_session__payable_id', 'payment_session__status',
+        'payment_session__amount_pence', 'payment_session__currency',
+    ]
+    date_hierarchy = 'captured_at'
     search_fields = ['provider_charge_id', 'payment_session__stripe_checkout_session_id']
+    search_help_text = 'Charge or payment intent (ch_... / pi_...), checkout session (cs_...), or transaction / session id'
+    search_routes = [
+        ('pi_', 'provider_charge_id'), ('ch_', 'provider_charge_id'),
+        ('cs_', 'payment_session__stripe_checkout_session_id'),
+    ]
+    search_id_fields = ['pk', 'payment_session_id']
     readonly_fields = ['created_at', 'captured_at']
     raw_id_fields = ['payment_session']
 
@@ -74,10 +169,19 @@ class TransactionAdmin(admin.ModelAdmin):
 
 
 @admin.register(Refund)
-class RefundAdmin(admin.ModelAdmin):
+class RefundAdmin(LedgerAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'transaction', 'amount_display', 'status', 'reason_short', 'created_at']
-    list_filter = ['status', 'created_at']
-    search_fields = ['provider_refund_id', 'reason']
+    list_filter = ['tenant', 'status', 'created_at']
+    list_select_related = ['transaction']
+    list_only = [
+        'id', 'amount_pence', 'status', 'reason', 'created_at',
+        'transaction__gross_amount_pence', 'transaction__currency',
+    ]
+    date_hierarchy = 'created_at'
+    search_fields = ['provider_refund_id']
+    search_help_text = 'Stripe refund id (re_...), or refund / transaction id'
+    search_routes = [('re_', 'provider_refund_id')]
+    search_id_fields = ['pk', 'transaction_id']
     readonly_fields = ['created_at']
     raw_id_fields = ['transaction']
 
@@ -90,3 +194,66 @@ class RefundAdmin(admin.ModelAdmin):
             return obj.reason[:50] + '...' if len(obj.reason) > 50 else obj.reason
         return '-'
     reason_short.short_description = 'Reason'
+
+
+@admin.register(RecurringCharge)
+class RecurringChargeAdmin(admin.ModelAdmin):
+    list_display = [
+        'id', 'payable_type', 'payable_id', 'customer', 'amount_display', 'interval_months', 'next_charge_on',
+        'status', 'failure_count',
+    ]
+    list_filter = ['tenant', 'status', 'payable_type']
+    list_select_related = ['customer']
+    search_fields = ['payable_id', 'customer__email']
+    readonly_fields = ['failure_count', 'last_charged_on', 'last_error', 'created_at', 'updated_at']
+    raw_id_fields = ['customer']
+
+    def amount_display(self, obj):
+        return f"£{obj.amount_pence/100:.2f}"
+    amount_display.short_description = 'Amount'
+
+
+@admin.register(PaymentDailyTotal)
+class PaymentDailyTotalAdmin(admin.ModelAdmin):
+    list_display = ['day', 'payable_type', 'status', 'count', 'amount_display']
+    list_filter = ['status', 'payable_type']
+    date_hierarchy = 'day'
+
+    def amount_display(self, obj):
+        return f"£{obj.amount_pence/100:.2f}"
+    amount_display.short_description = 'Amount'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ParkedEvent)
+class ParkedEventAdmin(admin.ModelAdmin):
+    list_display = ['stripe_event_id', 'event_type', 'payment_intent_id', 'checkout_session_id', 'created_at']
+    list_filter = ['event_type', 'created_at']
+    search_fields = ['stripe_event_id', 'payment_intent_id', 'checkout_session_id', 'charge_id', 'payment_session_id']
+    readonly_fields = ['created_at']
+
+
+@admin.register(BatchJob)
+class BatchJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'action', 'status', 'progress', 'stats', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['action', 'status']
+    fields = ['action', 'status', 'query', 'progress', 'stats', 'errors', 'created_by', 'created_at', 'started_at',
+              'finished_at', 'updated_at']
+    readonly_fields = fields
+
+    def get_queryset(self, request):
+        # The changelist doesn't show these; the change page loads them when it does.
+        return super().get_queryset(request).defer('query', 'errors')
+
+    def progress(self, obj):
+        if not obj.total:
+            return f"{obj.processed}"
+        return f"{obj.processed} / ~{obj.total} ({min(obj.processed / obj.total, 1):.0%})"
+
+    def has_add_permission(self, request):
+        return False
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from .tenants import evict_tenant
+        from .timing import install_sql_timing
+
+        connection_created.connect(install_sql_timing, dispatch_uid='payments.install_sql_timing')
+        post_save.connect(evict_tenant, sender='payments.Tenant', dispatch_uid='payments.evict_tenant_saved')
+        post_delete.connect(evict_tenant, sender='payments.Tenant', dispatch_uid='payments.evict_tenant_deleted')
@@ -0,0 +1,193 @@
+"""Background bulk actions on payment sessions, started from the admin.
+
+``start_batch()`` queues a ``BatchJob`` with the changelist query string of
+the selection (its filters, search and any ticked ids), and the
+``run_batch_jobs --loop`` worker process claims and runs it, so jobs survive
+web worker restarts. The worker rebuilds the selection from the query and
+walks it by id (``id > position ORDER BY id LIMIT chunk``),
+``PAYMENTS_BATCH_CHUNK_SIZE`` sessions at a time, so neither side holds the
+selection in memory. It saves its position and counts after every chunk.
+"""
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .callbacks import callback_payloads, dispatch_payment_events
+from .models import BatchJob, PaymentSession
+from .stripe_api import BACKGROUND, call_stripe, stripe
+from .sweeper import cancel_sessions, expire_checkout_session
+from .tenants import preload_tenants
+from .views import handle_checkout_completed, handle_checkout_expired
+
+logger = logging.getLogger(__name__)
+
+MAX_ERRORS = 100
+
+
+def _in_worker(func):
+    """Run ``func`` on a pool thread, releasing its database connection afterwards."""
+    def run(*args):
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return run
+
+
+def resync_from_stripe(sessions, pool):
+    """Fetch each session's Checkout Session and apply what Stripe reports.
+
+    Paid sessions go through the ``checkout.session.completed`` handler and
+    expired ones through ``checkout.session.expired``, so transactions,
+    event log rows and consumer callbacks are produced as for a webhook.
+    """
+    stats, errors = Counter(), []
+
+    def fetch(payment_session):
+        try:
+            return payment_session, call_stripe(
+                stripe.checkout.Session.retrieve, payment_session.stripe_checkout_session_id,
+                priority=BACKGROUND, tenant_id=payment_session.tenant_id,
+            ), None
+        except stripe.error.StripeError as e:
+            return payment_session, None, str(e)
+
+    linked = [payment_session for payment_session in sessions if payment_session.stripe_checkout_session_id]
+    stats['skipped'] += len(sessions) - len(linked)
+    for payment_session, checkout_session, error in pool.map(_in_worker(fetch), linked):
+        if error:
+            stats['error'] += 1
+            errors.append({'payment_session_id': payment_session.id, 'error': error})
+        elif checkout_session.get('status') == 'complete' and checkout_session.get('payment_status') != 'unpaid':
+            handle_checkout_completed(checkout_session, None, payment_session.tenant_id)
+            stats['complete'] += 1
+        elif checkout_session.get('status') == 'expired':
+            handle_checkout_expired(checkout_session, None, payment_session.tenant_id)
+            stats['expired'] += 1
+        else:
+            stats['open'] += 1
+    return stats, errors
+
+
+def resend_callback(sessions, pool):
+    """Send each session's current status to its consumer again."""
+    dispatch_payment_events(callback_payloads(sessions))
+    return Counter(sent=len(sessions)), []
+
+
+def expire_in_stripe(sessions, pool):
+    """Expire open sessions in Stripe and cancel the ones Stripe confirms as expired."""
+    stats, errors = Counter(), []
+    open_sessions = [payment_session for payment_session in sessions if payment_session.status in ('created', 'pending')]
+    stats['skipped'] += len(sessions) - len(open_sessions)
+
+    outcomes = list(pool.map(
+        _in_worker(expire_checkout_session),
+        [payment_session.stripe_checkout_session_id for payment_session in open_sessions],
+        [payment_session.tenant_id for payment_session in open_sessions],
+    ))
+    stats.update(outcomes)
+    errors += [
+        {'payment_session_id': payment_session.id, 'error': 'Stripe could not expire the session'}
+        for payment_session, outcome in zip(open_sessions, outcomes) if outcome == 'error'
+    ]
+    expired_ids = [payment_session.id for payment_session, outcome in zip(open_sessions, outcomes) if outcome == 'expired']
+    stats['canceled'] += cancel_sessions(expired_ids) if expired_ids else 0
+    return stats, errors
+
+
+# name: (admin label, handler(sessions, pool) -> (Counter, errors))
+ACTIONS = {
+    'resync_from_stripe': ('Resync from Stripe', resync_from_stripe),
+    'resend_callback': ('Resend consumer callback', resend_callback),
+    'expire_in_stripe': ('Expire in Stripe', expire_in_stripe),
+}
+
+
+def start_batch(action, query='', total=None, user=None):
+    """Queue a ``BatchJob`` for ``action`` over the sessions the ``PaymentSessionAdmin`` changelist query ``query`` selects.
+
+    Each chunk is read from the selection as it is then, so sessions that
+    stop matching a filter (e.g. ``status``) before their turn are skipped.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown batch action: {action}')
+    return BatchJob.objects.create(
+        action=action,
+        query=query,
+        total=total,
+        created_by=user.get_username() if user else '',
+    )
+
+
+def selection(job):
+    """The sessions ``job`` runs over, ordered by id."""
+    from django.contrib import admin
+    from .admin import PaymentSessionAdmin
+
+    return PaymentSessionAdmin(PaymentSession, admin.site).changelist_selection(job.query).order_by('id')
+
+
+def claim_batch_job(stale_minutes=5):
+    """Mark the oldest queued job, or a running one idle for ``stale_minutes``, as running. Returns its id or ``None``.
+
+    Rows are claimed with ``SKIP LOCKED``, so several workers never take the same job.
+    """
+    cutoff = timezone.now() - timedelta(minutes=stale_minutes)
+    with transaction.atomic():
+        job = (
+            BatchJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='queued') | Q(status='running', updated_at__lt=cutoff))
+            .order_by('id').only('id').first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.save(update_fields=['status', 'updated_at'])
+    return job.id
+
+
+def run_batch(job_id, chunk_size=None, concurrency=None):
+    """Run (or resume) a batch job to the end. Returns the job."""
+    chunk_size = chunk_size or settings.PAYMENTS_BATCH_CHUNK_SIZE
+    job = BatchJob.objects.get(id=job_id)
+    handler = ACTIONS[job.action][1]
+    stats = Counter(job.stats)
+
+    job.status = 'running'
+    job.started_at = job.started_at or timezone.now()
+    job.save(update_fields=['status', 'started_at', 'updated_at'])
+    try:
+        selected = selection(job).values_list('id', flat=True)
+        with ThreadPoolExecutor(max_workers=concurrency or settings.PAYMENTS_BATCH_CONCURRENCY) as pool:
+            while True:
+                ids = list(selected.filter(id__gt=job.position)[:chunk_size])
+                if not ids:
+                    break
+                sessions = list(PaymentSession.objects.filter(id__in=ids).order_by('id'))
+                preload_tenants(payment_session.tenant_id for payment_session in sessions)
+                chunk_stats, errors = handler(sessions, pool)
+                stats.update(chunk_stats)
+
+                job.position = ids[-1]
+                job.processed += len(ids)
+                job.stats = dict(+stats)
+                job.errors = (job.errors + errors)[:MAX_ERRORS]
+                job.save(update_fields=['position', 'processed', 'stats', 'errors', 'updated_at'])
+                if len(ids) < chunk_size:
+                    break
+        job.status = 'finished'
+    except Exception as e:
+        logger.exception('Batch job %s (%s) failed', job.id, job.action)
+        job.status = 'failed'
+        job.errors = (job.errors + [{'error': str(e)}])[:MAX_ERRORS]
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'errors', 'finished_at', 'updated_at'])
+    return job
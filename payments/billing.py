@@ -0,0 +1,301 @@
+"""Off-session recurring charges, run by ``manage.py run_billing``.
+
+``run_billing()`` reads the active ``RecurringCharge`` rows due on or before
+``as_of`` in ``(next_charge_on, id)`` index order, ``batch_size`` at a time.
+For each batch it:
+
+1. creates the batch's ``PaymentSession`` rows with one ``bulk_create``
+   (reusing any left by an interrupted run), and commits them;
+2. creates and confirms an off-session PaymentIntent per charge on
+   ``concurrency`` threads, under the shared outbound Stripe limiter at
+   ``BACKGROUND`` priority;
+3. records every outcome in one transaction: one ``transition()`` per
+   outcome status, one ``bulk_create`` of transactions and one
+   ``bulk_update`` of the charges.
+
+Sessions and PaymentIntents share the idempotency key
+``nbne-billing-<charge id>-<due date>``. A re-run for the same due date
+therefore reuses the session, and Stripe returns the PaymentIntent it
+already created instead of charging twice.
+"""
+import calendar
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .callbacks import callback_payloads, dispatch_payment_events
+from .models import PaymentEvent, PaymentSession, RecurringCharge, Transaction
+from .stripe_api import BACKGROUND, call_stripe, stripe
+from .tenants import preload_tenants
+from .views import replay_parked_events
+
+logger = logging.getLogger(__name__)
+
+MAX_FAILURES_REPORTED = 100
+
+# PaymentIntent status -> session status
+OUTCOMES = {
+    'succeeded': 'succeeded',
+    'processing': 'pending',
+}
+
+
+def add_months(day, months, anchor_day):
+    """``day`` moved ``months`` on, to ``anchor_day`` or the last day of a shorter month."""
+    month = day.month - 1 + months
+    year, month = day.year + month // 12, month % 12 + 1
+    return date(year, month, min(anchor_day, calendar.monthrange(year, month)[1]))
+
+
+def billing_key(charge):
+    return f"nbne-billing-{charge.id}-{charge.next_charge_on.isoformat()}"
+
+
+def ensure_sessions(charges):
+    """The ``PaymentSession`` for each charge's current period, created in bulk where missing."""
+    keys = {billing_key(charge): charge for charge in charges}
+    sessions = {
+        payment_session.idempotency_key: payment_session
+        for payment_session in PaymentSession.objects.filter(idempotency_key__in=list(keys))
+    }
+    missing = [
+        PaymentSession(
+            tenant_id=charge.tenant_id,
+            customer_id=charge.customer_id,
+            payable_type=charge.payable_type,
+            payable_id=charge.payable_id,
+            amount_pence=charge.amount_pence,
+            currency=charge.currency,
+            status='created',
+            event_seq=1,
+            metadata={**charge.metadata, 'recurring_charge_id': str(charge.id)},
+            idempotency_key=key,
+        )
+        for key, charge in keys.items() if key not in sessions
+    ]
+    if missing:
+        # bulk_create skips PaymentSession.save(), so write the first events here.
+        with transaction.atomic():
+            PaymentSession.objects.bulk_create(missing)
+            PaymentEvent.objects.bulk_create(
+                PaymentEvent(payment_session=payment_session, seq=1, to_status='created',
+                             created_at=payment_session.created_at)
+                for payment_session in missing
+            )
+        sessions.update((payment_session.idempotency_key, payment_session) for payment_session in missing)
+    return [sessions[billing_key(charge)] for charge in charges]
+
+
+def create_payment_intent(charge, payment_session):
+    """Charge the saved card. Returns ``(payment_intent_or_None, decline_or_None, error_or_None)``.
+
+    A decline is final for this attempt; an error (network, API) leaves the
+    charge due so the next run tries again with the same idempotency key.
+    """
+    customer = charge.customer
+    try:
+        return call_stripe(
+            stripe.PaymentIntent.create,
+            amount=charge.amount_pence,
+            currency=charge.currency.lower(),
+            customer=customer.provider_customer_id,
+            payment_method=customer.default_payment_method_id,
+            off_session=True,
+            confirm=True,
+            metadata={
+                'payable_type': charge.payable_type,
+                'payable_id': charge.payable_id,
+                'payment_session_id': str(payment_session.id),
+                'recurring_charge_id': str(charge.id),
+            },
+            idempotency_key=payment_session.idempotency_key,
+            priority=BACKGROUND,
+            tenant_id=charge.tenant_id,
+        ), None, None
+    except stripe.error.CardError as e:
+        return (e.error.get('payment_intent') if e.error else None), str(e), None
+    except stripe.error.StripeError as e:
+        return None, None, str(e)
+
+
+def cancel_payment_intent(payment_intent_id, tenant_id):
+    """Cancel an intent booked as failed, so it can't still complete after the charge is retried under a new key."""
+    try:
+        call_stripe(stripe.PaymentIntent.cancel, payment_intent_id, priority=BACKGROUND, tenant_id=tenant_id)
+    except stripe.error.StripeError:
+        logger.warning('Could not cancel PaymentIntent %s', payment_intent_id, exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def next_due(charge, as_of):
+    """The first charge date after ``as_of`` on the charge's schedule (missed periods are not billed)."""
+    due = charge.next_charge_on
+    while due <= as_of:
+        due = add_months(due, charge.interval_months, charge.anchor_day)
+    return due
+
+
+def record_outcomes(results, as_of, summary, failures):
+    """Write one batch's outcomes to its sessions, transactions and charges.
+
+    ``results`` holds ``(charge, payment_session, payment_intent, decline)``;
+    the session is ``None`` for charges that were never sent to Stripe.
+    Returns ``(payment_intent_id, tenant_id)`` for intents left in a
+    non-terminal status (e.g. ``requires_action``) that were booked as
+    failed; the caller cancels them.
+    """
+    now = timezone.now()
+    by_status = {'succeeded': [], 'pending': [], 'failed': []}
+    with_intent = []
+    to_cancel = []
+    for charge, payment_session, payment_intent, decline in results:
+        if payment_intent:
+            payment_session.stripe_payment_intent_id = payment_intent['id']
+            with_intent.append(payment_session)
+        status = 'failed' if decline else OUTCOMES.get(payment_intent['status'], 'failed')
+        if payment_session:
+            by_status[status].append(payment_session.id)
+
+        charge.updated_at = now
+        if status == 'failed':
+            if payment_intent and not decline:
+                to_cancel.append((payment_intent['id'], charge.tenant_id))
+            charge.failure_count += 1
+            charge.last_error = decline or f"PaymentIntent {payment_intent['status']}"
+            charge.next_charge_on = as_of + timedelta(days=settings.PAYMENTS_BILLING_RETRY_DAYS)
+            if charge.failure_count >= settings.PAYMENTS_BILLING_MAX_FAILURES:
+                charge.status = 'past_due'
+                summary['past_due'] += 1
+            summary['declined'] += 1
+            if len(failures) < MAX_FAILURES_REPORTED:
+                failures.append({
+                    'recurring_charge_id': charge.id,
+                    'payment_session_id': str(payment_session.id) if payment_session else None,
+                    'error': charge.last_error,
+                })
+        else:
+            charge.failure_count = 0
+            charge.last_error = ''
+            charge.last_charged_on = charge.next_charge_on
+            charge.next_charge_on = next_due(charge, as_of)
+            summary['succeeded' if status == 'succeeded' else 'pending'] += 1
+
+    with transaction.atomic():
+        PaymentSession.objects.bulk_update(with_intent, ['stripe_payment_intent_id'])
+        changed = []
+        for status, session_ids in by_status.items():
+            if session_ids:
+                changed += PaymentSession.objects.filter(id__in=session_ids).transition(status)
+        Transaction.objects.bulk_create(
+            Transaction(
+                tenant_id=payment_session.tenant_id,
+                payment_session_id=payment_session.id,
+                gross_amount_pence=payment_session.amount_pence,
+                currency=payment_session.currency,
+                provider_charge_id=payment_session.stripe_payment_intent_id,
+                captured_at=now,
+            )
+            for payment_session in changed if payment_session.status == 'succeeded'
+        )
+        RecurringCharge.objects.bulk_update(
+            [charge for charge, *_ in results],
+            ['next_charge_on', 'failure_count', 'status', 'last_charged_on', 'last_error', 'updated_at'],
+        )
+        if changed:
+            events = callback_payloads(changed)
+            transaction.on_commit(lambda: dispatch_payment_events(events))
+        # Webhooks for these intents may have arrived before their ids were stored.
+        replay_parked_events(payment_intent_id=[payment_session.stripe_payment_intent_id for payment_session in with_intent])
+    return to_cancel
+
+
+def run_billing(as_of=None, batch_size=None, concurrency=None, progress=None):
+    """Charge every active ``RecurringCharge`` due on or before ``as_of`` (default: today).
+
+    Charges whose customer has no saved card count as declined without a
+    Stripe call. Declines are retried ``PAYMENTS_BILLING_RETRY_DAYS`` later
+    and the charge becomes ``past_due`` after
+    ``PAYMENTS_BILLING_MAX_FAILURES`` in a row; Stripe errors leave the
+    charge due for the next run. ``progress(summary)`` is called after
+    every batch.
+
+    Returns:
+        dict with keys: due, succeeded, pending, declined, errors, past_due,
+        batches, elapsed_seconds, per_second, failures
+    """
+    as_of = as_of or timezone.localdate()
+    batch_size = batch_size or settings.PAYMENTS_BILLING_BATCH_SIZE
+    concurrency = concurrency or settings.PAYMENTS_BILLING_CONCURRENCY
+    summary = Counter()
+    failures = []
+    started = time.monotonic()
+    after = None
+
+    def charge_card(charge, payment_session):
+        try:
+            return create_payment_intent(charge, payment_session)
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            due = RecurringCharge.objects.filter(status='active', next_charge_on__lte=as_of)
+            if after:
+                due = due.filter(Q(next_charge_on__gt=after[0]) | Q(next_charge_on=after[0], id__gt=after[1]))
+            batch = list(due.select_related('customer').order_by('next_charge_on', 'id')[:batch_size])
+            if not batch:
+                break
+            after = (batch[-1].next_charge_on, batch[-1].id)
+
+            chargeable, results = [], []
+            for charge in batch:
+                if charge.customer.provider_customer_id and charge.customer.default_payment_method_id:
+                    chargeable.append(charge)
+                else:
+                    results.append((charge, None, None, 'No saved payment method'))
+            sessions = ensure_sessions(chargeable)
+            preload_tenants(charge.tenant_id for charge in chargeable)
+            outcomes = pool.map(charge_card, chargeable, sessions)
+
+            for charge, payment_session, (payment_intent, decline, error) in zip(chargeable, sessions, outcomes):
+                if error:
+                    summary['errors'] += 1
+                    if len(failures) < MAX_FAILURES_REPORTED:
+                        failures.append({
+                            'recurring_charge_id': charge.id,
+                            'payment_session_id': str(payment_session.id),
+                            'error': error,
+                        })
+                else:
+                    results.append((charge, payment_session, payment_intent, decline))
+            to_cancel = record_outcomes(results, as_of, summary, failures)
+            if to_cancel:
+                list(pool.map(cancel_payment_intent, *zip(*to_cancel)))
+
+            summary['batches'] += 1
+            summary['due'] += len(batch)
+            summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+            if progress:
+                progress(summary)
+            if len(batch) < batch_size:
+                break
+
+    summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    attempted = summary['due'] - summary['errors']
+    per_second = round(attempted / summary['elapsed_seconds'], 1) if summary['elapsed_seconds'] else 0
+    result = {key: summary[key] for key in (
+        'due', 'succeeded', 'pending', 'declined', 'errors', 'past_due', 'batches', 'elapsed_seconds',
+    )}
+    result.update(per_second=per_second, failures=failures)
+    if failures:
+        logger.warning('Billing run finished with %d declined and %d errored charge(s)',
+                       summary['declined'], summary['errors'])
+    return result
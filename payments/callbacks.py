@@ -0,0 +1,222 @@
+import atexit
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import Signal
+
+from .fastjson import dumps
+from .lazy import LazyModule
+from .models import CART_PAYABLE_TYPE, PaymentSessionItem
+from .timing import timed
+
+logger = logging.getLogger(__name__)
+
+requests = LazyModule('requests')
+
+_subscribers = defaultdict(list)
+
+# Sent inside the checkout transaction once a new session is pending, with
+# ``payment_session`` and ``payables``: ``(payable_type, payable_id)`` for the
+# session, or for each item of a cart. Consumers use it to drop cached views
+# of those payables; status changes still arrive through the subscribers.
+checkout_created = Signal()
+
+
+def register_payment_subscriber(payable_type, handler):
+    """Deliver payment status changes for ``payable_type`` to ``handler`` in-process.
+
+    ``handler(events)`` is called after the payment transaction commits with a
+    list of callback payloads (the same dicts the HTTP callback would POST).
+    Consumer apps register from ``AppConfig.ready()``. Payable types with a
+    subscriber are never sent to ``PAYMENTS_WEBHOOK_CALLBACK_URL``.
+    """
+    if handler not in _subscribers[payable_type]:
+        _subscribers[payable_type].append(handler)
+
+
+def unregister_payment_subscriber(payable_type, handler):
+    if handler in _subscribers.get(payable_type, []):
+        _subscribers[payable_type].remove(handler)
+
+
+def callback_payload(payment_session):
+    return {
+        'payable_type': payment_session.payable_type,
+        'payable_id': payment_session.payable_id,
+        'payment_session_id': str(payment_session.id),
+        'status': payment_session.status,
+    }
+
+
+def callback_payloads(sessions):
+    """The callback payloads for ``sessions``: one per session, or one per item for carts.
+
+    Cart items come from ``cart_items`` when ``transition()`` has set it and
+    are otherwise read with one query for all the carts.
+    """
+    unloaded = [
+        payment_session.id for payment_session in sessions
+        if payment_session.payable_type == CART_PAYABLE_TYPE and not hasattr(payment_session, 'cart_items')
+    ]
+    items = defaultdict(list)
+    if unloaded:
+        for item in PaymentSessionItem.objects.filter(payment_session_id__in=unloaded):
+            items[item.payment_session_id].append(item)
+
+    payloads = []
+    for payment_session in sessions:
+        if payment_session.payable_type != CART_PAYABLE_TYPE:
+            payloads.append(callback_payload(payment_session))
+            continue
+        for item in getattr(payment_session, 'cart_items', None) or items[payment_session.id]:
+            payloads.append({
+                'payable_type': item.payable_type,
+                'payable_id': item.payable_id,
+                'payment_session_id': str(payment_session.id),
+                'status': payment_session.status,
+            })
+    return payloads
+
+
+def trigger_callback(payment_session):
+    """Notify the consumer of ``payment_session``'s new status once the current transaction commits."""
+    events = callback_payloads([payment_session])
+    transaction.on_commit(lambda: dispatch_payment_events(events))
+
+
+def dispatch_payment_events(events):
+    by_type = defaultdict(list)
+    for event in events:
+        by_type[event['payable_type']].append(event)
+
+    for payable_type, typed_events in by_type.items():
+        handlers = _subscribers.get(payable_type)
+        if handlers:
+            for handler in handlers:
+                try:
+                    handler(typed_events)
+                except Exception:
+                    logger.exception('Payment subscriber %r failed for %s', handler, payable_type)
+        elif settings.PAYMENTS_WEBHOOK_CALLBACK_BATCH_URL:
+            batcher.add(settings.PAYMENTS_WEBHOOK_CALLBACK_BATCH_URL, typed_events)
+        elif settings.PAYMENTS_WEBHOOK_CALLBACK_URL:
+            for event in typed_events:
+                post_callback(event)
+
+
+def post_callback(event):
+    body = dumps(event)
+    try:
+        with timed('callback'):
+            requests.post(
+                settings.PAYMENTS_WEBHOOK_CALLBACK_URL,
+                data=body,
+                headers=callback_headers(body),
+                timeout=5
+            )
+    except Exception:
+        pass
+
+
+SIGNATURE_HEADER = 'X-Payments-Signature'
+
+
+def sign_payload(body, secret, timestamp=None):
+    """``t=<unix time>,v1=<hex HMAC-SHA256 of "<t>.<body>">``, as Stripe signs webhooks."""
+    timestamp = int(timestamp or time.time())
+    digest = hmac.new(secret.encode(), f'{timestamp}.'.encode() + body, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={digest}'
+
+
+def verify_signature(body, header, secret, tolerance=300):
+    """Whether ``header`` is a valid ``sign_payload`` signature of ``body`` made within ``tolerance`` seconds."""
+    try:
+        parts = dict(item.split('=', 1) for item in (header or '').split(','))
+        timestamp = int(parts['t'])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign_payload(body, secret, timestamp), f"t={timestamp},v1={parts.get('v1', '')}")
+
+
+def callback_headers(body):
+    headers = {'Content-Type': 'application/json'}
+    if settings.PAYMENTS_CALLBACK_SECRET:
+        headers[SIGNATURE_HEADER] = sign_payload(body, settings.PAYMENTS_CALLBACK_SECRET)
+    return headers
+
+
+class CallbackBatcher:
+    """Coalesces callback events per URL and POSTs them as one ``{"events": [...]}`` body.
+
+    The first event for a URL opens a window of ``PAYMENTS_CALLBACK_BATCH_WINDOW_MS``;
+    everything queued for that URL until it closes (or until
+    ``PAYMENTS_CALLBACK_BATCH_MAX_EVENTS`` are queued) goes out in one signed
+    request. Within a batch only the latest status of each payable in each payment
+    session is sent, so every item of a cart goes out.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.timers = {}
+
+    def add(self, url, events):
+        with self.lock:
+            queued = self.pending.setdefault(url, {})
+            for event in events:
+                key = (event['payable_type'], event['payable_id'], event['payment_session_id'])
+                queued.pop(key, None)
+                queued[key] = event
+            if len(queued) >= settings.PAYMENTS_CALLBACK_BATCH_MAX_EVENTS:
+                full = True
+            else:
+                full = False
+                if url not in self.timers:
+                    timer = threading.Timer(settings.PAYMENTS_CALLBACK_BATCH_WINDOW_MS / 1000, self.flush, [url])
+                    timer.daemon = True
+                    self.timers[url] = timer
+                    timer.start()
+        if full:
+            self.flush(url)
+
+    def flush(self, url=None):
+        """Send what is queued for ``url`` (every URL by default) now."""
+        with self.lock:
+            urls = [url] if url else list(self.pending)
+            batches = []
+            for target in urls:
+                timer = self.timers.pop(target, None)
+                if timer:
+                    timer.cancel()
+                events = self.pending.pop(target, None)
+                if events:
+                    batches.append((target, list(events.values())))
+        for target, events in batches:
+            post_batch(target, events)
+
+    def clear(self):
+        with self.lock:
+            for timer in self.timers.values():
+                timer.cancel()
+            self.pending.clear()
+            self.timers.clear()
+
+
+def post_batch(url, events):
+    body = dumps({'events': events})
+    try:
+        requests.post(url, data=body, headers=callback_headers(body), timeout=10)
+    except Exception:
+        logger.warning('Batch callback of %d events to %s failed', len(events), url, exc_info=True)
+
+
+batcher = CallbackBatcher()
+atexit.register(batcher.flush)
@@ -0,0 +1,46 @@
+"""Stripe Products and Prices for consumer catalogues.
+
+Checkout sends ad-hoc ``price_data`` by default, so Stripe creates a
+throwaway Product for every session. A consumer with a fixed catalogue
+(services, memberships) syncs each entry once with ``sync_product()`` and
+``sync_price()``, keeps the ids, and passes ``stripe_price_id`` to
+``create_checkout_session_internal``. ``key`` names the entry in Stripe
+metadata and idempotency keys, e.g. ``service-12``.
+"""
+from .stripe_api import BACKGROUND, call_stripe, stripe
+
+
+def sync_product(key, name, product_id=None, tenant_id=None):
+    """The id of the entry's Product: ``product_id`` renamed to ``name``, or a new Product."""
+    if product_id:
+        call_stripe(stripe.Product.modify, product_id, name=name, priority=BACKGROUND, tenant_id=tenant_id)
+        return product_id
+    return call_stripe(
+        stripe.Product.create,
+        name=name,
+        metadata={'catalogue_key': key},
+        idempotency_key=f'nbne-product-{key}',
+        priority=BACKGROUND,
+        tenant_id=tenant_id,
+    ).id
+
+
+def sync_price(key, product_id, amount_pence, currency, old_price_id=None, tenant_id=None):
+    """Create the Product's Price for ``amount_pence`` and archive ``old_price_id``.
+
+    Stripe Prices cannot change amount, so a new price replaces the old one;
+    archived prices stay valid for sessions already created with them.
+    """
+    price = call_stripe(
+        stripe.Price.create,
+        product=product_id,
+        unit_amount=amount_pence,
+        currency=currency.lower(),
+        metadata={'catalogue_key': key},
+        idempotency_key=f'nbne-price-{key}-{amount_pence}-{currency.lower()}-{old_price_id or "new"}',
+        priority=BACKGROUND,
+        tenant_id=tenant_id,
+    )
+    if old_price_id and old_price_id != price.id:
+        call_stripe(stripe.Price.modify, old_price_id, active=False, priority=BACKGROUND, tenant_id=tenant_id)
+    return price.id
@@ -0,0 +1,83 @@
+"""JSON encoding/decoding for API views.
+
+Uses ``orjson`` when it is installed and the standard library otherwise; both
+produce the same output for the types our views return (dates and decimals
+are encoded as ``DjangoJSONEncoder`` would).
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised where orjson is absent
+    orjson = None
+
+_django_default = DjangoJSONEncoder().default
+
+if orjson is not None:
+    JSONDecodeError = orjson.JSONDecodeError
+    _OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        """Encode ``obj`` to compact JSON bytes."""
+        return orjson.dumps(obj, default=_django_default, option=_OPTIONS)
+else:
+    JSONDecodeError = json.JSONDecodeError
+    _encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+    def loads(data):
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+    def dumps(obj):
+        """Encode ``obj`` to compact JSON bytes."""
+        return _encoder.encode(obj).encode('utf-8')
+
+
+class JsonResponse(HttpResponse):
+    """Drop-in for ``django.http.JsonResponse`` that encodes with ``dumps``."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+
+class ResponseShape:
+    """A fixed response layout, compiled once and filled from ``values_list()`` rows.
+
+    ``ResponseShape(booking_id='id', booking_date=('booking_date', isoformat))``
+    maps each output key to a column, optionally with a converter. ``fetch()``
+    selects only those columns instead of loading the whole model.
+    """
+
+    def __init__(self, **fields):
+        self.keys = tuple(fields)
+        self.columns = tuple(spec if isinstance(spec, str) else spec[0] for spec in fields.values())
+        self.converters = tuple(
+            (index, spec[1]) for index, spec in enumerate(fields.values()) if not isinstance(spec, str)
+        )
+
+    def from_row(self, row):
+        if self.converters:
+            row = list(row)
+            for index, convert in self.converters:
+                if row[index] is not None:
+                    row[index] = convert(row[index])
+        return dict(zip(self.keys, row))
+
+    def fetch(self, queryset):
+        """The shaped dict for the single row of ``queryset``; raises ``DoesNotExist`` like ``get()``."""
+        return self.from_row(queryset.values_list(*self.columns).get())
+
+    def fetch_all(self, queryset):
+        return [self.from_row(row) for row in queryset.values_list(*self.columns)]
+
+
+def isoformat(value):
+    return value.isoformat()
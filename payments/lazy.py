@@ -0,0 +1,35 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    ``stripe`` and ``requests`` take around half a second to import; deferring
+    them keeps management commands and worker boot fast. Attribute access
+    (including ``mock.patch('payments.views.stripe.Customer.create')``) is
+    forwarded to the real module. ``on_load(module)`` runs once after import.
+    """
+
+    def __init__(self, name, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_load:
+                        self._on_load(module)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
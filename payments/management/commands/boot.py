@@ -0,0 +1,72 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+STATIC_FINGERPRINT_FILE = '.boot-fingerprint'
+STATIC_MANIFEST_FILE = 'staticfiles.json'
+
+
+def static_fingerprint():
+    """Hash of every collectable static file's path, size and mtime, plus the storage backend."""
+    digest = hashlib.sha256(settings.STATICFILES_STORAGE.encode())
+    entries = []
+    for finder in get_finders():
+        for path, storage in finder.list(['CVS', '.*', '*~']):
+            stat = os.stat(storage.path(path))
+            entries.append(f'{path}\0{stat.st_size}\0{stat.st_mtime_ns}')
+    for entry in sorted(entries):
+        digest.update(entry.encode())
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = 'Prepare the instance for serving: collectstatic and migrate only if needed, then ensure_superuser'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Run collectstatic and migrate unconditionally')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.step('collectstatic', lambda: self.collectstatic(options['force']))
+        self.step('migrate', lambda: self.migrate(options['force']))
+        self.step('ensure_superuser', lambda: call_command('ensure_superuser', stdout=self.stdout))
+        self.stdout.write(f'Boot finished in {time.monotonic() - started:.2f}s')
+
+    def step(self, name, func):
+        started = time.monotonic()
+        outcome = func() or 'done'
+        self.stdout.write(f'{name}: {outcome} ({time.monotonic() - started:.2f}s)')
+
+    def collectstatic(self, force):
+        fingerprint_path = os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT_FILE)
+        fingerprint = static_fingerprint()
+        if not force and os.path.exists(os.path.join(settings.STATIC_ROOT, STATIC_MANIFEST_FILE)):
+            try:
+                with open(fingerprint_path) as f:
+                    if f.read() == fingerprint:
+                        return 'unchanged, skipped'
+            except FileNotFoundError:
+                pass
+
+        try:
+            call_command('collectstatic', interactive=False, verbosity=0)
+        except Exception as e:
+            # Matches the old entrypoint's `collectstatic || true`: serve without fresh assets.
+            self.stderr.write(f'collectstatic failed: {e}')
+            return 'failed'
+        with open(fingerprint_path, 'w') as f:
+            f.write(fingerprint)
+
+    def migrate(self, force):
+        if not force:
+            executor = MigrationExecutor(connection)
+            if not executor.migration_plan(executor.loader.graph.leaf_nodes()):
+                return 'no unapplied migrations, skipped'
+        call_command('migrate', interactive=False, verbosity=1, stdout=self.stdout)
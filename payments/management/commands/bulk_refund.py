@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from payments.refunds import create_refunds_bulk_internal
+
+
+def id_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Refund many succeeded payments at once (e.g. a cancelled class or salon day)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session-ids', type=id_list, help='Comma-separated payment session ids')
+        parser.add_argument('--payable-type', help='Refund payments for this payable type, e.g. booking')
+        parser.add_argument('--payable-ids', type=id_list, help='Comma-separated payable ids (with --payable-type)')
+        parser.add_argument('--amount-pence', type=int, help='Partial refund amount per payment (default: full)')
+        parser.add_argument('--reason', default='', help='Reason stored on each Refund row')
+        parser.add_argument('--concurrency', type=int, default=settings.PAYMENTS_REFUND_CONCURRENCY)
+        parser.add_argument('--rate', type=float, default=settings.PAYMENTS_REFUND_RATE_PER_SECOND,
+                            help='Max Stripe refund calls per second')
+
+    def handle(self, *args, **options):
+        if options['payable_ids'] and not options['payable_type']:
+            raise CommandError('--payable-ids requires --payable-type')
+
+        try:
+            summary = create_refunds_bulk_internal(
+                payment_session_ids=options['session_ids'],
+                payable_type=options['payable_type'],
+                payable_ids=options['payable_ids'],
+                amount_pence=options['amount_pence'],
+                reason=options['reason'],
+                concurrency=options['concurrency'],
+                rate_per_second=options['rate'],
+                progress=self.report,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for failure in summary['failures']:
+            self.stderr.write(
+                f"  session {failure['payment_session_id']} (refund {failure['refund_id']}): {failure['error']}"
+            )
+        self.stdout.write(
+            f"Done: {summary['requested']} requested, {summary['succeeded']} succeeded, "
+            f"{summary['pending']} pending in Stripe, {summary['failed']} failed, {summary['skipped']} skipped"
+        )
+        if summary['unconfirmed']:
+            self.stdout.write(
+                f"{summary['unconfirmed']} refund(s) could not be confirmed with Stripe; run again to retry them"
+            )
+
+    def report(self, summary):
+        self.stdout.write(
+            f"  {summary['requested']} requested, {summary['succeeded']} succeeded, "
+            f"{summary['pending']} pending, {summary['failed']} failed"
+        )
@@ -0,0 +1,53 @@
+import json
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Summarise the hottest frames across slow request/webhook profile captures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Capture directory (default: PROFILER_DIR)')
+        parser.add_argument('--kind', choices=['request', 'webhook'], help='Only include this kind of capture')
+        parser.add_argument('--limit', type=int, default=20, help='Frames to show')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.PROFILER_DIR
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.json')) if os.path.isdir(directory) else []
+
+        own = Counter()
+        inclusive = Counter()
+        slowest = []
+        total_samples = 0
+        for name in names:
+            with open(os.path.join(directory, name)) as f:
+                capture = json.load(f)
+            if options['kind'] and capture['kind'] != options['kind']:
+                continue
+            slowest.append((capture['elapsed_ms'], capture['kind'], capture['metadata']))
+            for stack, count in capture['stacks'].items():
+                frames = stack.split(';')
+                total_samples += count
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    inclusive[frame] += count
+
+        if not total_samples:
+            self.stdout.write(f'No profile captures in {directory}.')
+            return
+
+        self.stdout.write(f'{len(slowest)} captures, {total_samples} samples from {directory}\n')
+        self.stdout.write('Slowest:')
+        for elapsed_ms, kind, metadata in sorted(slowest, key=lambda c: c[0], reverse=True)[:5]:
+            self.stdout.write(f'  {elapsed_ms:>8.0f}ms  {kind}  {json.dumps(metadata)}')
+
+        self.stdout.write('\nSelf time (frame on top of the stack):')
+        for frame, count in own.most_common(options['limit']):
+            self.stdout.write(f'  {count / total_samples:>6.1%}  {frame}')
+
+        self.stdout.write('\nTotal time (frame anywhere on the stack):')
+        for frame, count in inclusive.most_common(options['limit']):
+            self.stdout.write(f'  {count / total_samples:>6.1%}  {frame}')
@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from payments.batches import claim_batch_job, run_batch
+
+
+class Command(BaseCommand):
+    help = 'Run queued admin batch jobs and resume interrupted ones (run with --loop as a worker process)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help='Jobs to run; default: queued and interrupted jobs')
+        parser.add_argument('--stale-minutes', type=int, default=5,
+                            help='A running job with no progress for this long counts as interrupted')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for jobs every --interval seconds')
+        parser.add_argument('--interval', type=int, default=5)
+
+    def handle(self, *args, **options):
+        for job_id in options['job_ids']:
+            self.run(job_id)
+        if options['job_ids']:
+            return
+
+        while True:
+            job_id = claim_batch_job(options['stale_minutes'])
+            if job_id is not None:
+                self.run(job_id)
+                continue
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def run(self, job_id):
+        job = run_batch(job_id)
+        self.stdout.write(f"Job {job.id} {job.action}: {job.status}, {job.processed} sessions, {job.stats}")
@@ -0,0 +1,46 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from payments.billing import run_billing
+
+
+class Command(BaseCommand):
+    help = 'Charge the saved cards of recurring charges (memberships) that are due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', help='Charge what is due on or before this date (YYYY-MM-DD, default today)')
+        parser.add_argument('--batch-size', type=int, default=settings.PAYMENTS_BILLING_BATCH_SIZE)
+        parser.add_argument('--concurrency', type=int, default=settings.PAYMENTS_BILLING_CONCURRENCY,
+                            help='Concurrent Stripe PaymentIntent calls')
+
+    def handle(self, *args, **options):
+        try:
+            as_of = date.fromisoformat(options['as_of']) if options['as_of'] else None
+        except ValueError:
+            raise CommandError('--as-of must be a date in YYYY-MM-DD format')
+
+        summary = run_billing(
+            as_of=as_of,
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            progress=self.report,
+        )
+        for failure in summary['failures']:
+            self.stderr.write(
+                f"  charge {failure['recurring_charge_id']} (session {failure['payment_session_id']}): {failure['error']}"
+            )
+        self.stdout.write(
+            f"Billing done: {summary['due']} due, {summary['succeeded']} succeeded, {summary['pending']} pending, "
+            f"{summary['declined']} declined ({summary['past_due']} now past due), {summary['errors']} Stripe errors "
+            f"in {summary['elapsed_seconds']}s ({summary['per_second']}/s)"
+        )
+
+    def report(self, summary):
+        elapsed = summary['elapsed_seconds'] or 0
+        rate = summary['due'] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"batch {summary['batches']}: due={summary['due']} succeeded={summary['succeeded']} "
+            f"pending={summary['pending']} declined={summary['declined']} errors={summary['errors']} "
+            f"rate={rate:.1f}/s"
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from payments.stripe_api import get_stripe_limiter
+
+
+class Command(BaseCommand):
+    help = 'Show outbound Stripe rate-limiter wait times per priority, across all workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, help="Tenant id; default: the default account's limiter")
+
+    def handle(self, *args, **options):
+        metrics = get_stripe_limiter(options['tenant']).metrics()
+        if not metrics:
+            self.stdout.write('No Stripe calls recorded yet.')
+            return
+
+        for priority, stats in sorted(metrics.items()):
+            average = stats['wait_seconds'] / stats['waited_calls'] if stats['waited_calls'] else 0
+            self.stdout.write(
+                f"{priority}: {stats['calls']} calls, {stats['waited_calls']} waited, "
+                f"avg wait {average * 1000:.0f}ms, max wait {stats['max_wait_seconds'] * 1000:.0f}ms"
+            )
@@ -0,0 +1,50 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.sweeper import purge_parked_events, sweep_stale_sessions
+from payments.throttling import purge_idle_buckets
+
+
+class Command(BaseCommand):
+    help = 'Expire checkout sessions left pending too long and cancel them (and their payables)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-minutes', type=int, default=settings.PAYMENTS_SWEEP_MAX_AGE_MINUTES,
+                            help='Sweep sessions pending for longer than this')
+        parser.add_argument('--batch-size', type=int, default=settings.PAYMENTS_SWEEP_BATCH_SIZE)
+        parser.add_argument('--concurrency', type=int, default=settings.PAYMENTS_SWEEP_CONCURRENCY,
+                            help='Concurrent Stripe expire calls')
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping every --interval seconds')
+        parser.add_argument('--interval', type=int, default=settings.PAYMENTS_SWEEP_INTERVAL_SECONDS)
+
+    def handle(self, *args, **options):
+        while True:
+            stats = sweep_stale_sessions(
+                max_age_minutes=options['max_age_minutes'],
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                progress=self.report,
+            )
+            self.stdout.write(
+                f"Sweep done: {stats['scanned']} stale, {stats['canceled']} canceled, "
+                f"{stats['complete']} already paid, {stats['error']} Stripe errors "
+                f"in {stats['elapsed_seconds'] or 0}s"
+            )
+            purged = purge_parked_events()
+            if purged:
+                self.stdout.write(f"Purged {purged} unclaimed parked webhook events")
+            purged = purge_idle_buckets()
+            if purged:
+                self.stdout.write(f"Purged {purged} idle throttle buckets")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def report(self, stats):
+        elapsed = stats['elapsed_seconds'] or 0
+        rate = stats['scanned'] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"batch {stats['batches']}: scanned={stats['scanned']} expired={stats['expired']} "
+            f"canceled={stats['canceled']} complete={stats['complete']} errors={stats['error']} "
+            f"rate={rate:.1f}/s"
+        )
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.throttling import purge_idle_buckets, reset_throttled_counts, throttled_counts
+
+
+class Command(BaseCommand):
+    help = 'Show how many requests each throttled route has rejected'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after showing them')
+        parser.add_argument('--purge', action='store_true', help='Delete idle throttle buckets from the database')
+
+    def handle(self, *args, **options):
+        for route, count in sorted(throttled_counts().items()):
+            rate = settings.PAYMENTS_THROTTLE_RATES[route] or 'unlimited'
+            self.stdout.write(f'{route} ({rate}): {count} throttled')
+        if options['reset']:
+            reset_throttled_counts()
+            self.stdout.write('Counters reset.')
+        if options['purge']:
+            self.stdout.write(f'Purged {purge_idle_buckets()} idle bucket(s).')
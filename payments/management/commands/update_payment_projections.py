@@ -0,0 +1,32 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.projections import update_projections
+
+
+class Command(BaseCommand):
+    help = 'Apply new payment events to the status and daily total projections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.PAYMENTS_PROJECTION_BATCH_SIZE)
+        parser.add_argument('--gap-seconds', type=int, default=settings.PAYMENTS_PROJECTION_GAP_SECONDS,
+                            help='Stop waiting for a missing event id after this long')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop the projections and replay the whole event log')
+        parser.add_argument('--loop', action='store_true', help='Keep updating every --interval seconds')
+        parser.add_argument('--interval', type=int, default=settings.PAYMENTS_PROJECTION_INTERVAL_SECONDS)
+
+    def handle(self, *args, **options):
+        rebuild = options['rebuild']
+        while True:
+            started = time.monotonic()
+            applied = update_projections(
+                batch_size=options['batch_size'], gap_seconds=options['gap_seconds'], rebuild=rebuild,
+            )
+            counts = ', '.join(f'{name}={count}' for name, count in applied.items())
+            self.stdout.write(f"{'Rebuilt' if rebuild else 'Updated'} projections: {counts} "
+                              f"in {time.monotonic() - started:.2f}s")
+            if not options['loop']:
+                return
+            rebuild = False
+            time.sleep(options['interval'])
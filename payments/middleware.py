@@ -0,0 +1,75 @@
+import logging
+import random
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from . import timing
+from .profiling import profile_if_slow
+
+logger = logging.getLogger('payments.timing')
+
+
+def _sampled():
+    rate = settings.SERVER_TIMING_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def _finish(request, response, timings):
+    response['Server-Timing'] = timings.server_timing_header()
+    fields = timings.log_fields()
+    logger.info(
+        'request method=%s path=%s status=%s %s',
+        request.method, request.path, response.status_code,
+        ' '.join(f'{key}={value}' for key, value in fields.items()),
+        extra={'timings': fields},
+    )
+    return response
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """Add a ``Server-Timing`` header and a log line with SQL, Stripe and callback time.
+
+    Only ``SERVER_TIMING_SAMPLE_RATE`` of requests are timed; the rest pass
+    straight through. Works under both WSGI and ASGI.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not _sampled():
+                return await get_response(request)
+            timings, token = timing.begin()
+            try:
+                response = await get_response(request)
+            finally:
+                timing.end(token)
+            return _finish(request, response, timings)
+    else:
+        def middleware(request):
+            if not _sampled():
+                return get_response(request)
+            timings, token = timing.begin()
+            try:
+                response = get_response(request)
+            finally:
+                timing.end(token)
+            return _finish(request, response, timings)
+
+    return middleware
+
+
+def slow_request_profiler_middleware(get_response):
+    """Profile requests slower than ``PROFILER_THRESHOLD_MS``. Removed entirely unless ``PROFILER_ENABLED``."""
+    if not settings.PROFILER_ENABLED:
+        raise MiddlewareNotUsed
+
+    def middleware(request):
+        metadata = {'method': request.method, 'path': request.path}
+        with profile_if_slow('request', metadata):
+            response = get_response(request)
+            metadata['status'] = response.status_code
+        return response
+
+    return middleware
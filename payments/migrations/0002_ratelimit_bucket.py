@@ -0,0 +1,28 @@
+# Generated by Django 4.2.9 on 2026-10-18 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RateLimitBucket",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("tokens", models.FloatField()),
+                ("updated", models.FloatField()),
+                ("stats", models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                "db_table": "payments_ratelimit_bucket",
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.9 on 2026-10-18 23:00
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+def merge_case_duplicate_customers(apps, schema_editor):
+    """Fold customers whose emails differ only by case/whitespace into one row.
+
+    The survivor is the row that already has a Stripe customer id (oldest
+    first); payment sessions of the others are moved onto it and its blank
+    name/phone are filled from them.
+    """
+    Customer = apps.get_model("payments", "Customer")
+    PaymentSession = apps.get_model("payments", "PaymentSession")
+
+    groups = {}
+    for customer in Customer.objects.order_by("created_at", "id"):
+        groups.setdefault(customer.email.strip().lower(), []).append(customer)
+
+    for email, customers in groups.items():
+        customers.sort(key=lambda c: not c.provider_customer_id)
+        keeper, duplicates = customers[0], customers[1:]
+        for duplicate in duplicates:
+            keeper.name = keeper.name or duplicate.name
+            keeper.phone = keeper.phone or duplicate.phone
+        if duplicates:
+            duplicate_ids = [duplicate.id for duplicate in duplicates]
+            PaymentSession.objects.filter(customer_id__in=duplicate_ids).update(customer=keeper)
+            Customer.objects.filter(id__in=duplicate_ids).delete()
+        if duplicates or keeper.email != email:
+            keeper.email = email
+            keeper.save(update_fields=["email", "name", "phone"])
+
+
+class Migration(migrations.Migration):
+    # The data fix commits in its own transaction before the schema change:
+    # PostgreSQL refuses to ALTER a table with pending deferred FK triggers.
+    atomic = False
+
+    dependencies = [
+        ("payments", "0002_ratelimit_bucket"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_case_duplicate_customers, migrations.RunPython.noop, atomic=True),
+        migrations.AlterField(
+            model_name="customer",
+            name="email",
+            field=models.EmailField(db_index=True, max_length=254),
+        ),
+        migrations.AddConstraint(
+            model_name="customer",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.text.Lower("email"),
+                name="payments_customer_email_ci_unique",
+            ),
+        ),
+    ]
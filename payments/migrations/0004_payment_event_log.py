@@ -0,0 +1,170 @@
+# Generated by Django 4.2.9 on 2026-10-18 23:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def seed_event_log(apps, schema_editor):
+    """Start every existing session's log with one event at its current status.
+
+    History before the log existed is not recoverable; the seed event is
+    dated at the session's last update.
+    """
+    PaymentSession = apps.get_model("payments", "PaymentSession")
+    PaymentEvent = apps.get_model("payments", "PaymentEvent")
+    sessions = PaymentSession.objects.order_by("id").values_list("id", "status", "updated_at")
+    batch = []
+    for session_id, status, updated_at in sessions.iterator(chunk_size=2000):
+        batch.append(
+            PaymentEvent(payment_session_id=session_id, seq=1, to_status=status, created_at=updated_at)
+        )
+        if len(batch) == 2000:
+            PaymentEvent.objects.bulk_create(batch)
+            batch = []
+    PaymentEvent.objects.bulk_create(batch)
+    PaymentSession.objects.update(event_seq=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0003_customer_email_normalized"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentDailyTotal",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("payable_type", models.CharField(max_length=100)),
+                ("status", models.CharField(max_length=20)),
+                ("count", models.BigIntegerField(default=0)),
+                ("amount_pence", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "db_table": "payments_daily_total",
+                "ordering": ["-day", "payable_type", "status"],
+            },
+        ),
+        migrations.CreateModel(
+            name="PaymentEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("seq", models.PositiveIntegerField()),
+                (
+                    "from_status",
+                    models.CharField(blank=True, default="", max_length=20),
+                ),
+                ("to_status", models.CharField(max_length=20)),
+                (
+                    "stripe_event_id",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "payments_event",
+                "ordering": ["payment_session", "seq"],
+            },
+        ),
+        migrations.CreateModel(
+            name="PaymentStatusTotal",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("payable_type", models.CharField(max_length=100)),
+                ("status", models.CharField(max_length=20)),
+                ("count", models.BigIntegerField(default=0)),
+                ("amount_pence", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "db_table": "payments_status_total",
+                "ordering": ["payable_type", "status"],
+            },
+        ),
+        migrations.CreateModel(
+            name="ProjectionCheckpoint",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("position", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "payments_projection_checkpoint",
+            },
+        ),
+        migrations.AddField(
+            model_name="paymentsession",
+            name="event_seq",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="paymentsession",
+            name="previous_status",
+            field=models.CharField(blank=True, default="", max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name="paymentstatustotal",
+            constraint=models.UniqueConstraint(
+                fields=("payable_type", "status"), name="payments_status_total_unique"
+            ),
+        ),
+        migrations.AddField(
+            model_name="paymentevent",
+            name="payment_session",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="events",
+                to="payments.paymentsession",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="paymentdailytotal",
+            constraint=models.UniqueConstraint(
+                fields=("day", "payable_type", "status"),
+                name="payments_daily_total_unique",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="paymentevent",
+            constraint=models.UniqueConstraint(
+                fields=("payment_session", "seq"),
+                name="payments_event_session_seq_unique",
+            ),
+        ),
+        migrations.RunPython(seed_event_log, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.9 on 2026-10-18 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0005_parked_event"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="paymentsession",
+            index=models.Index(
+                fields=["created_at", "id"], name="payments_session_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="refund",
+            index=models.Index(
+                fields=["created_at", "id"], name="payments_refund_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["captured_at", "id"], name="payments_txn_captured_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,148 @@
+# Generated by Django 4.2.9 on 2026-10-18 23:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0007_batch_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tenant",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("slug", models.SlugField(max_length=100, unique=True)),
+                ("name", models.CharField(max_length=255)),
+                ("stripe_secret_key", models.CharField(max_length=255)),
+                ("stripe_webhook_secret", models.CharField(blank=True, max_length=255)),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "payments_tenant",
+                "ordering": ["slug"],
+            },
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="tenant",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="payments.tenant",
+            ),
+        ),
+        migrations.AddField(
+            model_name="paymentsession",
+            name="tenant",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="payments.tenant",
+            ),
+        ),
+        migrations.AddField(
+            model_name="refund",
+            name="tenant",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="payments.tenant",
+            ),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="tenant",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="payments.tenant",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="paymentsession",
+            name="idempotency_key",
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="paymentsession",
+            index=models.Index(
+                fields=["tenant", "payable_type", "payable_id"],
+                name="payments_session_tnt_payable",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paymentsession",
+            index=models.Index(
+                fields=["tenant", "status", "created_at"],
+                name="payments_session_tnt_status",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paymentsession",
+            index=models.Index(
+                fields=["tenant", "created_at", "id"],
+                name="payments_session_tnt_created",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="refund",
+            index=models.Index(
+                fields=["tenant", "created_at", "id"],
+                name="payments_refund_tnt_created",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["tenant", "captured_at", "id"], name="payments_txn_tnt_captured"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="customer",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.comparison.Coalesce(
+                    "tenant", models.Value(0)
+                ),
+                django.db.models.functions.text.Lower("email"),
+                name="payments_customer_tenant_email_unique",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="paymentsession",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.comparison.Coalesce(
+                    "tenant", models.Value(0)
+                ),
+                models.F("idempotency_key"),
+                name="payments_session_tenant_idem_unique",
+            ),
+        ),
+        migrations.RemoveConstraint(
+            model_name="customer",
+            name="payments_customer_email_ci_unique",
+        ),
+    ]
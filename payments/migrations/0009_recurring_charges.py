@@ -0,0 +1,94 @@
+# Generated by Django 4.2.9 on 2026-10-18 23:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0008_tenants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customer",
+            name="default_payment_method_id",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.CreateModel(
+            name="RecurringCharge",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("payable_type", models.CharField(max_length=100)),
+                ("payable_id", models.CharField(max_length=255)),
+                ("amount_pence", models.IntegerField()),
+                ("currency", models.CharField(default="GBP", max_length=3)),
+                ("interval_months", models.PositiveSmallIntegerField(default=1)),
+                ("anchor_day", models.PositiveSmallIntegerField(blank=True)),
+                ("next_charge_on", models.DateField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("active", "Active"),
+                            ("past_due", "Past due"),
+                            ("canceled", "Canceled"),
+                        ],
+                        default="active",
+                        max_length=20,
+                    ),
+                ),
+                ("failure_count", models.PositiveSmallIntegerField(default=0)),
+                ("last_charged_on", models.DateField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True)),
+                ("metadata", models.JSONField(blank=True, default=dict)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "customer",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="recurring_charges",
+                        to="payments.customer",
+                    ),
+                ),
+                (
+                    "tenant",
+                    models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        to="payments.tenant",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "payments_recurring_charge",
+                "ordering": ["next_charge_on", "id"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "next_charge_on", "id"],
+                        name="payments_recurring_due_idx",
+                    ),
+                    models.Index(
+                        fields=["tenant", "status", "next_charge_on"],
+                        name="payments_recurring_tnt_due",
+                    ),
+                    models.Index(
+                        fields=["payable_type", "payable_id"],
+                        name="payments_recurring_payable",
+                    ),
+                ],
+            },
+        ),
+    ]
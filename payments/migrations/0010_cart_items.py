@@ -0,0 +1,73 @@
+# Generated by Django 4.2.9 on 2026-10-18 23:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0009_recurring_charges"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentSessionItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("payable_type", models.CharField(max_length=100)),
+                ("payable_id", models.CharField(max_length=255)),
+                ("amount_pence", models.IntegerField()),
+                ("name", models.CharField(blank=True, max_length=255)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("created", "Created"),
+                            ("pending", "Pending"),
+                            ("succeeded", "Succeeded"),
+                            ("failed", "Failed"),
+                            ("canceled", "Canceled"),
+                            ("refunded", "Refunded"),
+                        ],
+                        default="created",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "payment_session",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="items",
+                        to="payments.paymentsession",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "payments_session_item",
+                "ordering": ["payment_session", "id"],
+                "indexes": [
+                    models.Index(
+                        fields=["payable_type", "payable_id"],
+                        name="payments_session_item_payable",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="paymentsessionitem",
+            constraint=models.UniqueConstraint(
+                fields=("payment_session", "payable_type", "payable_id"),
+                name="payments_session_item_unique",
+            ),
+        ),
+    ]
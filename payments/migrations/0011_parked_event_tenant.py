@@ -0,0 +1,25 @@
+# Generated by Django 4.2.9 on 2026-10-18 23:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0010_cart_items"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="parkedevent",
+            name="tenant",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="payments.tenant",
+            ),
+        ),
+    ]
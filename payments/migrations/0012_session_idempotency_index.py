@@ -0,0 +1,19 @@
+# Generated by Django 4.2.9 on 2026-10-19 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0011_parked_event_tenant"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="paymentsession",
+            index=models.Index(
+                fields=["idempotency_key"], name="payments_session_idem_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.9 on 2026-10-19 00:05
+
+from django.db import migrations, models
+
+
+def fail_unfinished_jobs(apps, schema_editor):
+    """Jobs queued with a pickled selection can't be resumed; fail them so they can be started again."""
+    BatchJob = apps.get_model("payments", "BatchJob")
+    BatchJob.objects.filter(status__in=["queued", "running"]).update(
+        status="failed", errors=[{"error": "Selection format changed on upgrade; start the action again"}],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0012_session_idempotency_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_unfinished_jobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="batchjob",
+            name="selection",
+        ),
+        migrations.AddField(
+            model_name="batchjob",
+            name="session_ids",
+            field=models.JSONField(default=list),
+        ),
+    ]
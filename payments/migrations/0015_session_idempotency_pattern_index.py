@@ -0,0 +1,25 @@
+# Generated by Django 4.2.9 on 2026-10-19 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0014_batch_job_query"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="paymentsession",
+            name="payments_session_idem_idx",
+        ),
+        migrations.AddIndex(
+            model_name="paymentsession",
+            index=models.Index(
+                fields=["idempotency_key"],
+                name="payments_session_idem_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+    ]
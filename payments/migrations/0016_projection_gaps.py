@@ -0,0 +1,18 @@
+# Generated by Django 4.2.9 on 2026-10-19 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0015_session_idempotency_pattern_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="projectioncheckpoint",
+            name="gaps",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
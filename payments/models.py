@@ -1,23 +1,204 @@
-from django.db import models
+import json
+
+from django.db import connections, models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Lower
+from django.db.models.sql import UpdateQuery
 from django.utils import timezone
 
 
+class AppendToJSONList(models.Expression):
+    """Append ``item`` to a JSON list column inside the UPDATE itself."""
+
+    def __init__(self, field_name, item):
+        super().__init__(output_field=models.JSONField())
+        self.target = F(field_name)
+        self.item = item
+
+    def get_source_expressions(self):
+        return [self.target]
+
+    def set_source_expressions(self, exprs):
+        (self.target,) = exprs
+
+    def as_sql(self, compiler, connection):
+        field_sql, field_params = compiler.compile(self.target)
+        return f"({field_sql} || %s::jsonb)", (*field_params, json.dumps([self.item]))
+
+    def as_sqlite(self, compiler, connection):
+        field_sql, field_params = compiler.compile(self.target)
+        return f"json_insert({field_sql}, '$[#]', %s)", (*field_params, self.item)
+
+
+class Tenant(models.Model):
+    """A business whose payments go through its own Stripe account.
+
+    Rows with no tenant belong to the default account configured by
+    ``STRIPE_SECRET_KEY`` / ``STRIPE_WEBHOOK_SECRET``. Credentials are read
+    through ``payments.tenants``, which caches them per process.
+    """
+    slug = models.SlugField(max_length=100, unique=True)
+    name = models.CharField(max_length=255)
+    stripe_secret_key = models.CharField(max_length=255)
+    stripe_webhook_secret = models.CharField(max_length=255, blank=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'payments_tenant'
+        ordering = ['slug']
+
+    def __str__(self):
+        return self.slug
+
+
+# Unique constraints treat "no tenant" as tenant 0 so the default account's
+# rows stay unique among themselves (NULLs never conflict).
+TENANT_KEY = Coalesce('tenant', Value(0))
+
+
+def normalize_email(email):
+    """Customers are matched on the trimmed, lowercased email address."""
+    return (email or '').strip().lower()
+
+
+class CustomerQuerySet(models.QuerySet):
+    UPSERT_RETURNING_FIELDS = ('id', 'tenant_id', 'email', 'name', 'phone', 'provider', 'provider_customer_id')
+
+    def upsert(self, email, name='', phone='', tenant_id=None):
+        """Return ``tenant_id``'s customer for ``email``, creating it if needed, in one statement.
+
+        Runs ``INSERT ... ON CONFLICT (tenant, lower(email)) DO UPDATE ... RETURNING``,
+        so concurrent checkouts for the same new address cannot race into an
+        ``IntegrityError`` and ``Bob@x.com`` resolves to ``bob@x.com``'s row.
+        A blank name or phone on the existing row is filled from the new values.
+        """
+        connection = connections[self.db]
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        table = qn(opts.db_table)
+        now = opts.get_field('created_at').get_db_prep_value(timezone.now(), connection)
+        returning = ', '.join(qn(opts.get_field(name).column) for name in self.UPSERT_RETURNING_FIELDS)
+        sql = (
+            f"INSERT INTO {table} (tenant_id, email, name, phone, provider, created_at, updated_at) "
+            f"VALUES (%s, %s, %s, %s, %s, %s, %s) "
+            f"ON CONFLICT ((COALESCE(tenant_id, 0)), (LOWER(email))) DO UPDATE SET "
+            f"name = COALESCE(NULLIF({table}.name, ''), excluded.name), "
+            f"phone = COALESCE(NULLIF({table}.phone, ''), excluded.phone), "
+            f"updated_at = excluded.updated_at "
+            f"RETURNING {returning}"
+        )
+        params = [tenant_id, normalize_email(email), name or '', phone or '', 'stripe', now, now]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        return self.model.from_db(self.db, self.UPSERT_RETURNING_FIELDS, row)
+
+
 class Customer(models.Model):
-    email = models.EmailField(unique=True, db_index=True)
+    tenant = models.ForeignKey(Tenant, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
+    email = models.EmailField(db_index=True)
     name = models.CharField(max_length=255, blank=True, null=True)
     phone = models.CharField(max_length=50, blank=True, null=True)
     provider = models.CharField(max_length=50, default='stripe')
     provider_customer_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    # Card saved for off-session charges (checkout with save_payment_method).
+    default_payment_method_id = models.CharField(max_length=255, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CustomerQuerySet.as_manager()
+
     class Meta:
         db_table = 'payments_customer'
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(TENANT_KEY, Lower('email'), name='payments_customer_tenant_email_unique'),
+        ]
 
     def __str__(self):
         return f"{self.email} ({self.provider})"
 
+    def save(self, *args, **kwargs):
+        self.email = normalize_email(self.email)
+        super().save(*args, **kwargs)
+
+
+# payable_type of sessions paying for several payables (see PaymentSessionItem).
+CART_PAYABLE_TYPE = 'cart'
+
+
+def update_returning(queryset, values, returning_fields):
+    """Run ``queryset.update(**values)`` as one ``UPDATE ... RETURNING`` and return the changed rows as models."""
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    connection = connections[queryset.db]
+    sql, params = query.get_compiler(queryset.db).as_sql()
+    returning = ', '.join(
+        connection.ops.quote_name(queryset.model._meta.get_field(name).column) for name in returning_fields
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} RETURNING {returning}", params)
+        rows = cursor.fetchall()
+    return [queryset.model.from_db(queryset.db, returning_fields, row) for row in rows]
+
+
+class PaymentSessionQuerySet(models.QuerySet):
+    RETURNING_FIELDS = (
+        'id', 'tenant_id', 'payable_type', 'payable_id', 'amount_pence', 'currency', 'status',
+        'stripe_checkout_session_id', 'stripe_payment_intent_id', 'customer_id',
+        'previous_status', 'event_seq',
+    )
+
+    def with_keys(self, keys, tenant_id=None):
+        """Sessions of ``tenant_id`` with an idempotency key in ``keys``.
+
+        Filters on ``TENANT_KEY`` rather than ``tenant_id IS NULL`` so the
+        default account's lookups can use the unique constraint's index too.
+        """
+        return self.alias(tenant_key=TENANT_KEY).filter(tenant_key=tenant_id or 0, idempotency_key__in=list(keys))
+
+    def transition(self, to_status, event_id=None, **values):
+        """Move matched sessions to ``to_status`` if ``TRANSITIONS`` allows it.
+
+        Runs as one ``UPDATE ... WHERE status IN (<legal sources>) RETURNING``,
+        so no row is read or locked first and an illegal transition (e.g. a late
+        ``canceled`` after ``succeeded``) simply matches nothing. ``event_id`` is
+        appended to ``processed_events`` and ``values`` are written alongside the
+        new status. A ``PaymentEvent`` is appended for every changed session in
+        the same transaction, and the items of changed carts take the new
+        status with one more UPDATE (available as ``cart_items`` on those
+        sessions). Returns the sessions that actually changed.
+        """
+        sources = self.model.TRANSITIONS[to_status]
+        now = timezone.now()
+        values = {
+            'status': to_status,
+            'previous_status': F('status'),
+            'event_seq': F('event_seq') + 1,
+            'updated_at': now,
+            **values,
+        }
+        if event_id:
+            values['processed_events'] = AppendToJSONList('processed_events', event_id)
+
+        with transaction.atomic(using=self.db):
+            sessions = update_returning(self.filter(status__in=sources), values, self.RETURNING_FIELDS)
+            PaymentEvent.objects.using(self.db).bulk_create(
+                PaymentEvent.for_session(payment_session, event_id, now) for payment_session in sessions
+            )
+            carts = {payment_session.id: payment_session for payment_session in sessions
+                     if payment_session.payable_type == CART_PAYABLE_TYPE}
+            if carts:
+                for payment_session in carts.values():
+                    payment_session.cart_items = []
+                for item in PaymentSessionItem.objects.using(self.db).filter(
+                    payment_session_id__in=list(carts)
+                ).set_status(to_status):
+                    carts[item.payment_session_id].cart_items.append(item)
+        return sessions
+
 
 class PaymentSession(models.Model):
     STATUS_CHOICES = [
@@ -29,6 +210,17 @@ class PaymentSession(models.Model):
         ('refunded', 'Refunded'),
     ]
 
+    # Legal source statuses for each target status. Anything else is rejected,
+    # so a late or replayed event can never move a session backwards.
+    TRANSITIONS = {
+        'pending': ('created',),
+        'succeeded': ('created', 'pending', 'failed'),
+        'failed': ('created', 'pending'),
+        'canceled': ('created', 'pending', 'failed'),
+        'refunded': ('succeeded',),
+    }
+
+    tenant = models.ForeignKey(Tenant, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     payable_type = models.CharField(max_length=100, db_index=True)
     payable_id = models.CharField(max_length=255, db_index=True)
     amount_pence = models.IntegerField()
@@ -41,22 +233,51 @@ class PaymentSession(models.Model):
     success_url = models.TextField()
     cancel_url = models.TextField()
     metadata = models.JSONField(default=dict, blank=True)
-    idempotency_key = models.CharField(max_length=255, unique=True, db_index=True)
+    idempotency_key = models.CharField(max_length=255)
     processed_events = models.JSONField(default=list, blank=True)
+    # Status before the last transition and the seq of its PaymentEvent,
+    # maintained by PaymentSessionQuerySet.transition().
+    previous_status = models.CharField(max_length=20, blank=True, default='')
+    event_seq = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PaymentSessionQuerySet.as_manager()
+
     class Meta:
         db_table = 'payments_session'
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['payable_type', 'payable_id']),
             models.Index(fields=['status', 'created_at']),
+            # Changelist order (-created_at, -id) and date hierarchy probes.
+            models.Index(fields=['created_at', 'id'], name='payments_session_created_idx'),
+            # Tenant-scoped lookups, sweeps and changelists.
+            models.Index(fields=['tenant', 'payable_type', 'payable_id'], name='payments_session_tnt_payable'),
+            models.Index(fields=['tenant', 'status', 'created_at'], name='payments_session_tnt_status'),
+            models.Index(fields=['tenant', 'created_at', 'id'], name='payments_session_tnt_created'),
+            # Equality and the admin's prefix search; pattern ops work under any collation.
+            models.Index(fields=['idempotency_key'], name='payments_session_idem_idx', opclasses=['varchar_pattern_ops']),
+        ]
+        constraints = [
+            models.UniqueConstraint(TENANT_KEY, 'idempotency_key', name='payments_session_tenant_idem_unique'),
         ]
 
     def __str__(self):
         return f"{self.payable_type}:{self.payable_id} - {self.status} - {self.amount_pence/100:.2f} {self.currency}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        # A new session starts its event log; later status changes go through transition().
+        self.event_seq = 1
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            PaymentEvent.objects.using(self._state.db).create(
+                payment_session=self, seq=1, to_status=self.status, created_at=self.created_at,
+            )
+
     def mark_event_processed(self, event_id):
         if event_id not in self.processed_events:
             self.processed_events.append(event_id)
@@ -65,7 +286,205 @@ class PaymentSession(models.Model):
         return False
 
 
+class PaymentSessionItemQuerySet(models.QuerySet):
+    RETURNING_FIELDS = ('id', 'payment_session_id', 'payable_type', 'payable_id', 'amount_pence', 'status')
+
+    def set_status(self, status):
+        """Set ``status`` on the matched items with one ``UPDATE ... RETURNING``. Returns the items."""
+        return update_returning(self, {'status': status}, self.RETURNING_FIELDS)
+
+
+class PaymentSessionItem(models.Model):
+    """One payable paid for by a cart session (``payable_type`` ``"cart"``).
+
+    ``status`` follows the session's, kept in step by ``transition()``.
+    """
+    payment_session = models.ForeignKey(PaymentSession, on_delete=models.CASCADE, related_name='items', db_index=False)
+    payable_type = models.CharField(max_length=100)
+    payable_id = models.CharField(max_length=255)
+    amount_pence = models.IntegerField()
+    name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=PaymentSession.STATUS_CHOICES, default='created')
+
+    objects = PaymentSessionItemQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'payments_session_item'
+        ordering = ['payment_session', 'id']
+        constraints = [
+            # Also the index the status fan-out reads by payment session.
+            models.UniqueConstraint(
+                fields=['payment_session', 'payable_type', 'payable_id'], name='payments_session_item_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['payable_type', 'payable_id'], name='payments_session_item_payable'),
+        ]
+
+    def __str__(self):
+        return f"{self.payable_type}:{self.payable_id} in session {self.payment_session_id} - {self.status}"
+
+
+class PaymentEvent(models.Model):
+    """One status change of a payment session. Rows are only ever inserted.
+
+    ``seq`` numbers a session's events from 1; the global ``id`` orders all
+    events and is the position projections (``payments.projections``) resume from.
+    """
+    payment_session = models.ForeignKey(PaymentSession, on_delete=models.CASCADE, related_name='events', db_index=False)
+    seq = models.PositiveIntegerField()
+    from_status = models.CharField(max_length=20, blank=True, default='')
+    to_status = models.CharField(max_length=20)
+    stripe_event_id = models.CharField(max_length=255, blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'payments_event'
+        ordering = ['payment_session', 'seq']
+        constraints = [
+            models.UniqueConstraint(fields=['payment_session', 'seq'], name='payments_event_session_seq_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.payment_session_id}#{self.seq} {self.from_status or '-'} -> {self.to_status}"
+
+    @classmethod
+    def for_session(cls, payment_session, event_id=None, created_at=None):
+        """The event for a session just returned by ``transition()``."""
+        return cls(
+            payment_session_id=payment_session.id,
+            seq=payment_session.event_seq,
+            from_status=payment_session.previous_status,
+            to_status=payment_session.status,
+            stripe_event_id=event_id,
+            created_at=created_at or timezone.now(),
+        )
+
+
+class ParkedEventQuerySet(models.QuerySet):
+    def matching(self, **keys):
+        """Parked events carrying any of the given ``CORRELATION_KEYS`` values (lists), oldest first."""
+        condition = models.Q()
+        for key, values in keys.items():
+            values = [value for value in values if value]
+            if values:
+                condition |= models.Q(**{f'{key}__in': values})
+        if not condition:
+            return self.none()
+        return self.filter(condition).order_by('id')
+
+
+class ParkedEvent(models.Model):
+    """A webhook event that arrived before the row it refers to could be found.
+
+    Stored with every correlation key it carries so the handler that later
+    supplies one (e.g. ``checkout.session.completed`` setting the payment
+    intent id) can find and replay it with an index lookup.
+    """
+    CORRELATION_KEYS = ('payment_intent_id', 'checkout_session_id', 'charge_id', 'payment_session_id')
+
+    stripe_event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    payment_intent_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    checkout_session_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    charge_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    payment_session_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    # The tenant whose webhook secret verified the event; replays are scoped to it.
+    tenant = models.ForeignKey(Tenant, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = ParkedEventQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'payments_parked_event'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.event_type} {self.stripe_event_id}"
+
+    @staticmethod
+    def correlation_keys(event):
+        """The ``CORRELATION_KEYS`` values a Stripe event carries."""
+        obj = event['data']['object']
+        metadata = obj.get('metadata') or {}
+        keys = {'payment_session_id': metadata.get('payment_session_id')}
+        kind = event['type'].rsplit('.', 1)[0]
+        if kind == 'checkout.session':
+            keys.update(checkout_session_id=obj.get('id'), payment_intent_id=obj.get('payment_intent'))
+        elif kind == 'payment_intent':
+            keys['payment_intent_id'] = obj.get('id')
+        elif kind == 'charge':
+            keys.update(charge_id=obj.get('id'), payment_intent_id=obj.get('payment_intent'))
+        return {key: value for key, value in keys.items() if value}
+
+    @classmethod
+    def park(cls, event, tenant_id=None):
+        """Store ``event`` for replay; parking the same event twice keeps the first copy."""
+        return cls.objects.get_or_create(
+            stripe_event_id=event['id'],
+            defaults={'event_type': event['type'], 'payload': dict(event), 'tenant_id': tenant_id,
+                      **cls.correlation_keys(event)},
+        )[0]
+
+
+class ProjectionCheckpoint(models.Model):
+    """The highest ``PaymentEvent.id`` a projection has applied, and the lower ids it is still waiting for.
+
+    ``gaps`` holds ``[id, first seen (unix time)]`` pairs.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    gaps = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'payments_projection_checkpoint'
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class PaymentStatusTotal(models.Model):
+    """Projection: sessions currently in each status, per payable type."""
+    payable_type = models.CharField(max_length=100)
+    status = models.CharField(max_length=20)
+    count = models.BigIntegerField(default=0)
+    amount_pence = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'payments_status_total'
+        ordering = ['payable_type', 'status']
+        constraints = [
+            models.UniqueConstraint(fields=['payable_type', 'status'], name='payments_status_total_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.payable_type} {self.status}: {self.count}"
+
+
+class PaymentDailyTotal(models.Model):
+    """Projection: sessions entering each status per (UTC) day and payable type."""
+    day = models.DateField()
+    payable_type = models.CharField(max_length=100)
+    status = models.CharField(max_length=20)
+    count = models.BigIntegerField(default=0)
+    amount_pence = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'payments_daily_total'
+        ordering = ['-day', 'payable_type', 'status']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'payable_type', 'status'], name='payments_daily_total_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.payable_type} {self.status}: {self.count}"
+
+
 class Transaction(models.Model):
+    # Copied from the payment session so tenant reports don't need the join.
+    tenant = models.ForeignKey(Tenant, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     payment_session = models.ForeignKey(PaymentSession, on_delete=models.CASCADE, related_name='transactions')
     gross_amount_pence = models.IntegerField()
     fee_amount_pence = models.IntegerField(null=True, blank=True)
@@ -78,6 +497,10 @@ class Transaction(models.Model):
     class Meta:
         db_table = 'payments_transaction'
         ordering = ['-captured_at']
+        indexes = [
+            models.Index(fields=['captured_at', 'id'], name='payments_txn_captured_idx'),
+            models.Index(fields=['tenant', 'captured_at', 'id'], name='payments_txn_tnt_captured'),
+        ]
 
     def __str__(self):
         return f"Transaction {self.id} - {self.gross_amount_pence/100:.2f} {self.currency}"
@@ -90,6 +513,7 @@ class Refund(models.Model):
         ('failed', 'Failed'),
     ]
 
+    tenant = models.ForeignKey(Tenant, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='refunds')
     amount_pence = models.IntegerField()
     reason = models.TextField(blank=True, null=True)
@@ -100,6 +524,110 @@ class Refund(models.Model):
     class Meta:
         db_table = 'payments_refund'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='payments_refund_created_idx'),
+            models.Index(fields=['tenant', 'created_at', 'id'], name='payments_refund_tnt_created'),
+        ]
 
     def __str__(self):
         return f"Refund {self.id} - {self.amount_pence/100:.2f} - {self.status}"
+
+
+class RecurringCharge(models.Model):
+    """A customer's saved card charged ``amount_pence`` every ``interval_months``.
+
+    ``manage.py run_billing`` charges active rows whose ``next_charge_on``
+    has come, off-session (see ``payments.billing``). Each attempt is a
+    ``PaymentSession`` for ``payable_type``/``payable_id``.
+    """
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('past_due', 'Past due'),
+        ('canceled', 'Canceled'),
+    ]
+
+    tenant = models.ForeignKey(Tenant, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT, related_name='recurring_charges')
+    payable_type = models.CharField(max_length=100)
+    payable_id = models.CharField(max_length=255)
+    amount_pence = models.IntegerField()
+    currency = models.CharField(max_length=3, default='GBP')
+    interval_months = models.PositiveSmallIntegerField(default=1)
+    # Charges fall on this day of the month, or the last day of shorter months.
+    anchor_day = models.PositiveSmallIntegerField(blank=True)
+    next_charge_on = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    failure_count = models.PositiveSmallIntegerField(default=0)
+    last_charged_on = models.DateField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    metadata = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'payments_recurring_charge'
+        ordering = ['next_charge_on', 'id']
+        indexes = [
+            # The billing run's cohort, read in (next_charge_on, id) order.
+            models.Index(fields=['status', 'next_charge_on', 'id'], name='payments_recurring_due_idx'),
+            models.Index(fields=['tenant', 'status', 'next_charge_on'], name='payments_recurring_tnt_due'),
+            models.Index(fields=['payable_type', 'payable_id'], name='payments_recurring_payable'),
+        ]
+
+    def __str__(self):
+        return f"{self.payable_type}:{self.payable_id} - {self.amount_pence/100:.2f} {self.currency} every {self.interval_months}m"
+
+    def save(self, *args, **kwargs):
+        if not self.anchor_day:
+            self.anchor_day = self.next_charge_on.day
+        super().save(*args, **kwargs)
+
+
+class BatchJob(models.Model):
+    """An admin bulk action over a selection of payment sessions, run in the background.
+
+    ``query`` is the ``PaymentSessionAdmin`` changelist query string of the
+    selection; the ``run_batch_jobs`` worker rebuilds it and walks it in id
+    order. ``position`` is the last session id done, so an interrupted job
+    resumes where it stopped. ``total`` is an estimate.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('finished', 'Finished'),
+        ('failed', 'Failed'),
+    ]
+
+    action = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    query = models.TextField(blank=True)
+    total = models.IntegerField(null=True, blank=True)
+    position = models.BigIntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    stats = models.JSONField(default=dict, blank=True)
+    errors = models.JSONField(default=list, blank=True)
+    created_by = models.CharField(max_length=150, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'payments_batch_job'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.action} #{self.id} ({self.status})"
+
+
+class RateLimitBucket(models.Model):
+    name = models.CharField(max_length=100, primary_key=True)
+    tokens = models.FloatField()
+    updated = models.FloatField()
+    stats = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        db_table = 'payments_ratelimit_bucket'
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.1f} tokens"
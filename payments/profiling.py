@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 64
+
+
+def frame_label(code):
+    filename = code.co_filename
+    if filename.startswith(str(settings.BASE_DIR)):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[1]
+    return f'{filename}:{code.co_firstlineno}({code.co_name})'
+
+
+def folded_stack(frame):
+    """``root;...;leaf`` labels for ``frame``, the format flame graph tools read."""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Capture:
+    def __init__(self, kind, metadata):
+        self.kind = kind
+        self.metadata = metadata
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+
+
+class SamplingProfiler:
+    """Samples the stacks of watched threads from one background thread.
+
+    Watched threads do no profiling work themselves; while nothing is
+    watched the sampler thread sleeps on an event. Captures nest: each
+    thread has a stack of them, and every sample counts towards all of them.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.watched = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def watch(self, capture):
+        with self.lock:
+            self.watched.setdefault(threading.get_ident(), []).append(capture)
+            self.wakeup.set()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='payments-profiler', daemon=True)
+                self.thread.start()
+
+    def unwatch(self, capture):
+        with self.lock:
+            ident = threading.get_ident()
+            captures = self.watched.get(ident, [])
+            if capture in captures:
+                captures.remove(capture)
+            if not captures:
+                self.watched.pop(ident, None)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.watched:
+                    self.wakeup.clear()
+                else:
+                    frames = sys._current_frames()
+                    for ident, captures in self.watched.items():
+                        frame = frames.get(ident)
+                        if frame is not None:
+                            stack = folded_stack(frame)
+                            for capture in captures:
+                                capture.stacks[stack] += 1
+                    del frames
+            if not self.wakeup.is_set():
+                self.wakeup.wait()
+            else:
+                time.sleep(self.interval)
+
+
+_profiler = None
+
+
+def get_profiler():
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(settings.PROFILER_INTERVAL_MS / 1000)
+    return _profiler
+
+
+@contextmanager
+def profile_if_slow(kind, metadata=None):
+    """Sample the block and keep the profile only if it exceeds ``PROFILER_THRESHOLD_MS``.
+
+    A no-op unless ``PROFILER_ENABLED``. Must be entered and exited on the
+    thread doing the work.
+    """
+    if not settings.PROFILER_ENABLED:
+        yield
+        return
+
+    profiler = get_profiler()
+    capture = Capture(kind, metadata or {})
+    profiler.watch(capture)
+    try:
+        yield
+    finally:
+        profiler.unwatch(capture)
+        elapsed_ms = (time.perf_counter() - capture.started) * 1000
+        if elapsed_ms >= settings.PROFILER_THRESHOLD_MS and capture.stacks:
+            try:
+                write_capture(capture, elapsed_ms)
+            except OSError:
+                logger.warning('Could not write profile capture', exc_info=True)
+
+
+def write_capture(capture, elapsed_ms):
+    """Write ``capture`` to ``PROFILER_DIR`` and drop the oldest files beyond ``PROFILER_MAX_CAPTURES``."""
+    directory = settings.PROFILER_DIR
+    os.makedirs(directory, exist_ok=True)
+    now = timezone.now()
+    path = os.path.join(directory, f"{now:%Y%m%dT%H%M%S}-{capture.kind}-{uuid.uuid4().hex[:8]}.json")
+    with open(path, 'w') as f:
+        json.dump({
+            'kind': capture.kind,
+            'metadata': capture.metadata,
+            'captured_at': now.isoformat(),
+            'elapsed_ms': round(elapsed_ms, 1),
+            'interval_ms': settings.PROFILER_INTERVAL_MS,
+            'stacks': dict(capture.stacks),
+        }, f)
+    logger.info('Slow %s (%.0fms) profiled to %s', capture.kind, elapsed_ms, path)
+
+    captures = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    for name in captures[:-settings.PROFILER_MAX_CAPTURES]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    return path
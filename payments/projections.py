@@ -0,0 +1,141 @@
+"""Read models built from the ``PaymentEvent`` log.
+
+Each projection keeps a ``ProjectionCheckpoint`` with the id of the last event
+it applied, so an update only reads events written since then, in id order,
+``batch_size`` at a time. Each batch and its checkpoint are written in one
+transaction, which makes updates safe to interrupt and to re-run.
+
+Event ids are allocated when the row is inserted but become visible when the
+transaction commits, so a lower id can appear after a higher one was applied.
+Every id skipped over is kept in the checkpoint's ``gaps`` and looked up again
+on each update until its event shows up, or until it has been missing for
+``PAYMENTS_PROJECTION_GAP_SECONDS`` (its transaction rolled back). That must
+exceed the longest transaction that writes events; checkout holds one across
+its Stripe calls, so the default is derived from ``STRIPE_TIMEOUT_SECONDS``.
+"""
+import time
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import PaymentDailyTotal, PaymentEvent, PaymentStatusTotal, ProjectionCheckpoint
+
+EVENT_FIELDS = (
+    'id', 'from_status', 'to_status', 'created_at',
+    'payment_session__payable_type', 'payment_session__amount_pence',
+)
+
+
+class CountProjection:
+    """Adds ``(count, amount_pence)`` deltas to rows of ``model`` keyed by ``deltas()``."""
+    name = None
+    model = None
+
+    def deltas(self, event):
+        """Yield ``(key_dict, count, amount_pence)`` for one event."""
+        raise NotImplementedError
+
+    def apply(self, events):
+        totals = defaultdict(lambda: [0, 0])
+        for event in events:
+            for key, count, amount in self.deltas(event):
+                total = totals[tuple(sorted(key.items()))]
+                total[0] += count
+                total[1] += amount
+        for key, (count, amount) in totals.items():
+            key = dict(key)
+            updated = self.model.objects.filter(**key).update(
+                count=F('count') + count, amount_pence=F('amount_pence') + amount,
+            )
+            if not updated:
+                self.model.objects.create(**key, count=count, amount_pence=amount)
+
+    def reset(self):
+        self.model.objects.all().delete()
+
+
+class StatusTotals(CountProjection):
+    name = 'status_totals'
+    model = PaymentStatusTotal
+
+    def deltas(self, event):
+        payable_type = event['payment_session__payable_type']
+        amount = event['payment_session__amount_pence']
+        if event['from_status']:
+            yield {'payable_type': payable_type, 'status': event['from_status']}, -1, -amount
+        yield {'payable_type': payable_type, 'status': event['to_status']}, 1, amount
+
+
+class DailyTotals(CountProjection):
+    name = 'daily_totals'
+    model = PaymentDailyTotal
+
+    def deltas(self, event):
+        key = {
+            'day': event['created_at'].astimezone(dt_timezone.utc).date(),
+            'payable_type': event['payment_session__payable_type'],
+            'status': event['to_status'],
+        }
+        yield key, 1, event['payment_session__amount_pence']
+
+
+PROJECTIONS = (StatusTotals(), DailyTotals())
+
+
+def update_projection(projection, batch_size=None, gap_seconds=None):
+    """Apply the events written since ``projection``'s checkpoint, and any that filled its gaps. Returns the number applied."""
+    batch_size = batch_size or settings.PAYMENTS_PROJECTION_BATCH_SIZE
+    if gap_seconds is None:
+        gap_seconds = settings.PAYMENTS_PROJECTION_GAP_SECONDS
+    applied = 0
+    while True:
+        with transaction.atomic():
+            ProjectionCheckpoint.objects.get_or_create(name=projection.name)
+            checkpoint = ProjectionCheckpoint.objects.select_for_update().get(name=projection.name)
+            now = time.time()
+            gaps = {event_id: seen for event_id, seen in checkpoint.gaps}
+            late = list(
+                PaymentEvent.objects.filter(id__in=list(gaps)).order_by('id').values(*EVENT_FIELDS)
+            ) if gaps else []
+            events = list(
+                PaymentEvent.objects.filter(id__gt=checkpoint.position)
+                .order_by('id').values(*EVENT_FIELDS)[:batch_size]
+            )
+            for event in late:
+                del gaps[event['id']]
+            expected = checkpoint.position + 1
+            for event in events:
+                gaps.update((missing, now) for missing in range(expected, event['id']))
+                expected = event['id'] + 1
+            gaps = sorted([event_id, seen] for event_id, seen in gaps.items() if now - seen < gap_seconds)
+
+            if late or events:
+                projection.apply(late + events)
+            if events:
+                checkpoint.position = events[-1]['id']
+            if late or events or gaps != checkpoint.gaps:
+                checkpoint.gaps = gaps
+                checkpoint.save(update_fields=['position', 'gaps', 'updated_at'])
+        applied += len(late) + len(events)
+        if len(events) < batch_size:
+            return applied
+
+
+def rebuild_projection(projection, batch_size=None, gap_seconds=None):
+    """Drop ``projection``'s rows and replay the whole log."""
+    with transaction.atomic():
+        projection.reset()
+        ProjectionCheckpoint.objects.update_or_create(name=projection.name, defaults={'position': 0, 'gaps': []})
+    return update_projection(projection, batch_size=batch_size, gap_seconds=gap_seconds)
+
+
+def update_projections(batch_size=None, gap_seconds=None, rebuild=False):
+    """Bring every projection up to date. Returns ``{name: events applied}``."""
+    run = rebuild_projection if rebuild else update_projection
+    return {
+        projection.name: run(projection, batch_size=batch_size, gap_seconds=gap_seconds)
+        for projection in PROJECTIONS
+    }
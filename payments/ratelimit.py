@@ -0,0 +1,216 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts up to ``capacity``."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until ``tokens`` are available and take them. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class SharedTokenBucket:
+    """Token bucket whose state is shared by every process that opens it.
+
+    Subclasses provide ``state()``, a context manager yielding the bucket state
+    dict under an exclusive lock and persisting it on exit. ``BACKGROUND``
+    callers may not take the last ``background_reserve`` fraction of the
+    bucket, so interactive traffic (checkout) keeps headroom while bulk jobs
+    run. Wait times are aggregated per priority in the shared state.
+    """
+
+    def __init__(self, rate, capacity=None, background_reserve=0.2):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.background_reserve = self.capacity * background_reserve
+
+    def initial_state(self):
+        return {'tokens': self.capacity, 'updated': time.time(), 'stats': {}}
+
+    @contextmanager
+    def state(self):
+        raise NotImplementedError
+
+    def acquire(self, tokens=1, priority=INTERACTIVE):
+        """Block until ``tokens`` can be taken at ``priority``. Returns seconds waited."""
+        reserve = self.background_reserve if priority == BACKGROUND else 0.0
+        waited = 0.0
+        while True:
+            with self.state() as state:
+                now = time.time()
+                available = min(self.capacity, state['tokens'] + max(now - state['updated'], 0) * self.rate)
+                state['updated'] = now
+                if available - tokens >= reserve:
+                    state['tokens'] = available - tokens
+                    self.record_wait(state, priority, waited)
+                    break
+                state['tokens'] = available
+                delay = (tokens + reserve - available) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+        if waited > 1:
+            logger.warning('Waited %.2fs for a %s Stripe rate-limit token', waited, priority)
+        return waited
+
+    def try_acquire(self, tokens=1):
+        """Take ``tokens`` if they are available now. Returns 0, or the seconds until they will be."""
+        with self.state() as state:
+            now = time.time()
+            available = min(self.capacity, state['tokens'] + max(now - state['updated'], 0) * self.rate)
+            state['updated'] = now
+            if available >= tokens:
+                state['tokens'] = available - tokens
+                return 0.0
+            state['tokens'] = available
+            return (tokens - available) / self.rate
+
+    def record_wait(self, state, priority, waited):
+        stats = state['stats'].setdefault(priority, {'calls': 0, 'waited_calls': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0})
+        stats['calls'] += 1
+        if waited:
+            stats['waited_calls'] += 1
+            stats['wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+
+    def metrics(self):
+        """Per-priority call counts and wait times, aggregated across processes."""
+        with self.state() as state:
+            return json.loads(json.dumps(state['stats']))
+
+
+class MemoryTokenBucket(SharedTokenBucket):
+    """Process-local bucket (shared between threads only). For development and tests."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self._state = self.initial_state()
+
+    @contextmanager
+    def state(self):
+        with self.lock:
+            yield self._state
+
+
+class FileTokenBucket(SharedTokenBucket):
+    """Bucket stored in a small file and guarded with ``flock``; shared by all workers on one host."""
+
+    def __init__(self, path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+
+    @contextmanager
+    def state(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, 65536, 0)
+            try:
+                state = json.loads(raw) if raw else self.initial_state()
+            except ValueError:
+                state = self.initial_state()
+            yield state
+            data = json.dumps(state).encode()
+            os.pwrite(fd, data, 0)
+            os.ftruncate(fd, len(data))
+        finally:
+            os.close(fd)
+
+
+class CacheWindowCounter:
+    """Fixed-window request counter under ``key`` in a Django cache; shared by every process using that cache.
+
+    Each request is one atomic ``add``/``incr``, so concurrent requests cannot
+    all take the last slot (given a cache with atomic ``incr``: Redis,
+    Memcached or local memory). Across a window boundary a client may make up
+    to twice ``limit`` requests. Counters expire with their window.
+    """
+
+    def __init__(self, key, cache, limit, period):
+        self.key = key
+        self.cache = cache
+        self.limit = limit
+        self.period = period
+
+    def try_acquire(self):
+        """Count a request. Returns 0, or the seconds until the window resets if over ``limit``."""
+        now = time.time()
+        window = int(now // self.period)
+        key = f'{self.key}:{window}'
+        if self.cache.add(key, 1, self.period + 1):
+            count = 1
+        else:
+            try:
+                count = self.cache.incr(key)
+            except ValueError:
+                # Expired between add() and incr().
+                self.cache.add(key, 1, self.period + 1)
+                count = 1
+        if count <= self.limit:
+            return 0.0
+        return (window + 1) * self.period - now
+
+
+class DatabaseTokenBucket(SharedTokenBucket):
+    """Bucket stored in a ``RateLimitBucket`` row; shared across hosts.
+
+    Uses its own database alias so the row lock is released as soon as the
+    token is taken, even when the caller is inside a long transaction.
+    """
+
+    def __init__(self, name, using, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+        self.using = using
+
+    @contextmanager
+    def state(self):
+        from .models import RateLimitBucket
+
+        buckets = RateLimitBucket.objects.using(self.using)
+        with transaction.atomic(using=self.using):
+            bucket = buckets.select_for_update().filter(name=self.name).first()
+            if bucket is None:
+                # INSERT ... ON CONFLICT DO NOTHING, then lock whichever row won.
+                initial = self.initial_state()
+                buckets.bulk_create(
+                    [RateLimitBucket(name=self.name, tokens=initial['tokens'], updated=initial['updated'], stats={})],
+                    ignore_conflicts=True,
+                )
+                bucket = buckets.select_for_update().get(name=self.name)
+            state = {'tokens': bucket.tokens, 'updated': bucket.updated, 'stats': bucket.stats}
+            yield state
+            bucket.tokens, bucket.updated, bucket.stats = state['tokens'], state['updated'], state['stats']
+            bucket.save(using=self.using)
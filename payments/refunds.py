@@ -0,0 +1,182 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Refund, Transaction
+from .ratelimit import TokenBucket
+from .stripe_api import BACKGROUND, call_stripe, stripe
+from .tenants import preload_tenants
+
+logger = logging.getLogger(__name__)
+
+REFUND_CHUNK_SIZE = 100
+
+STRIPE_REFUND_STATUSES = {
+    'succeeded': 'succeeded',
+    'pending': 'requested',
+    'requires_action': 'requested',
+    'failed': 'failed',
+    'canceled': 'failed',
+}
+
+
+def refund_idempotency_key(refund):
+    return f"nbne-refund-{refund.id}"
+
+
+# Stripe rejected these requests, so no refund was made. Any other error
+# (connection failures, timeouts, 5xx) may have refunded in Stripe anyway.
+DEFINITE_ERRORS = (stripe.error.InvalidRequestError, stripe.error.CardError)
+
+
+def issue_stripe_refund(refund, provider_charge_id, limiter):
+    """Create one refund in Stripe. Returns ``(refund, stripe_refund_or_None, StripeError_or_None)``."""
+    params = {
+        'amount': refund.amount_pence,
+        'reason': 'requested_by_customer',
+        'metadata': {
+            'refund_id': str(refund.id),
+            'payment_session_id': str(refund.transaction.payment_session_id),
+        },
+        'idempotency_key': refund_idempotency_key(refund),
+    }
+    if provider_charge_id.startswith('ch_'):
+        params['charge'] = provider_charge_id
+    else:
+        params['payment_intent'] = provider_charge_id
+
+    limiter.acquire()
+    try:
+        return refund, call_stripe(
+            stripe.Refund.create, priority=BACKGROUND, tenant_id=refund.tenant_id, **params,
+        ), None
+    except stripe.error.StripeError as e:
+        return refund, None, e
+
+
+def create_refunds_bulk_internal(payment_session_ids=None, payable_type=None, payable_ids=None,
+                                 amount_pence=None, reason=None, concurrency=None,
+                                 rate_per_second=None, progress=None):
+    """Refund many succeeded payments at once. Callable from Python (no HTTP needed).
+
+    Select payments either by ``payment_session_ids`` or by ``payable_type``
+    (optionally narrowed to ``payable_ids``). Each payment is refunded in full,
+    or by ``amount_pence`` capped at what is left to refund.
+
+    Work is done in chunks: the chunk's ``Refund`` rows are inserted as
+    ``requested`` with one ``bulk_create``, then refunded in Stripe on
+    ``concurrency`` threads limited to ``rate_per_second`` calls, each with an
+    idempotency key derived from its ``Refund`` id so a retried run cannot
+    refund twice. Outcomes are written back with one ``bulk_update``.
+    ``progress(summary)`` is called after every chunk.
+
+    Only errors in ``DEFINITE_ERRORS`` mark a refund ``failed``. After any
+    other error Stripe may have refunded anyway, so the row stays
+    ``requested`` (``unconfirmed``), still counts against what is left to
+    refund, and the next run selecting it retries it under its original
+    idempotency key.
+
+    Returns:
+        dict with keys: requested, succeeded, pending, unconfirmed, failed, skipped, failures
+
+    Raises:
+        ValueError: if no selection is given or payments are disabled
+    """
+    if not settings.PAYMENTS_ENABLED:
+        raise ValueError('Payments are not enabled for this instance')
+    if not payment_session_ids and not payable_type:
+        raise ValueError('Provide payment_session_ids or payable_type')
+    if amount_pence is not None and amount_pence <= 0:
+        raise ValueError('Amount must be > 0')
+
+    transactions = Transaction.objects.filter(payment_session__status='succeeded')
+    if payment_session_ids:
+        transactions = transactions.filter(payment_session_id__in=payment_session_ids)
+    if payable_type:
+        transactions = transactions.filter(payment_session__payable_type=payable_type)
+    if payable_ids:
+        transactions = transactions.filter(payment_session__payable_id__in=[str(i) for i in payable_ids])
+    transactions = transactions.annotate(
+        refunded_pence=Coalesce(Sum('refunds__amount_pence', filter=~Q(refunds__status='failed')), 0)
+    )
+
+    limiter = TokenBucket(rate_per_second or settings.PAYMENTS_REFUND_RATE_PER_SECOND)
+    summary = {
+        'requested': 0, 'succeeded': 0, 'pending': 0, 'unconfirmed': 0, 'failed': 0, 'skipped': 0, 'failures': [],
+    }
+    last_id = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency or settings.PAYMENTS_REFUND_CONCURRENCY) as pool:
+        while True:
+            chunk = list(
+                transactions.filter(id__gt=last_id).order_by('id').values(
+                    'id', 'tenant_id', 'payment_session_id', 'gross_amount_pence', 'provider_charge_id',
+                    'refunded_pence',
+                )[:REFUND_CHUNK_SIZE]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1]['id']
+            charge_ids = {txn['id']: txn['provider_charge_id'] for txn in chunk}
+            session_ids = {txn['id']: txn['payment_session_id'] for txn in chunk}
+
+            # Refunds a previous run could not confirm are retried as they were.
+            unconfirmed = list(Refund.objects.filter(
+                transaction_id__in=list(charge_ids), status='requested', provider_refund_id__isnull=True,
+            ))
+            retrying = {refund.transaction_id for refund in unconfirmed}
+            pending_refunds = []
+            for txn in chunk:
+                if txn['id'] in retrying:
+                    continue
+                remaining = txn['gross_amount_pence'] - txn['refunded_pence']
+                amount = min(amount_pence or remaining, remaining)
+                if amount <= 0 or not txn['provider_charge_id']:
+                    summary['skipped'] += 1
+                    continue
+                refund = Refund(
+                    tenant_id=txn['tenant_id'], transaction_id=txn['id'],
+                    amount_pence=amount, reason=reason, status='requested',
+                )
+                pending_refunds.append(refund)
+
+            refunds = Refund.objects.bulk_create(pending_refunds) + unconfirmed
+            summary['requested'] += len(refunds)
+            for refund in refunds:
+                refund.transaction = Transaction(
+                    id=refund.transaction_id, payment_session_id=session_ids[refund.transaction_id],
+                )
+            preload_tenants(refund.tenant_id for refund in refunds)
+
+            results = pool.map(
+                lambda refund: issue_stripe_refund(refund, charge_ids[refund.transaction_id], limiter),
+                refunds,
+            )
+            for refund, stripe_refund, error in results:
+                if error:
+                    if isinstance(error, DEFINITE_ERRORS):
+                        refund.status = 'failed'
+                        summary['failed'] += 1
+                    else:
+                        summary['unconfirmed'] += 1
+                    summary['failures'].append({
+                        'payment_session_id': str(refund.transaction.payment_session_id),
+                        'refund_id': refund.id,
+                        'error': str(error),
+                    })
+                    continue
+                refund.provider_refund_id = stripe_refund['id']
+                refund.status = STRIPE_REFUND_STATUSES.get(stripe_refund['status'], 'requested')
+                summary['succeeded' if refund.status == 'succeeded' else 'pending'] += 1
+
+            Refund.objects.bulk_update(refunds, ['status', 'provider_refund_id'])
+
+            if progress:
+                progress(summary)
+
+    if summary['failures']:
+        logger.warning('Bulk refund finished with %d failure(s)', len(summary['failures']))
+    return summary
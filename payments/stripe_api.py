@@ -0,0 +1,103 @@
+import threading
+
+from django.conf import settings
+
+from .fastjson import loads
+from .lazy import LazyModule
+from .ratelimit import (
+    BACKGROUND, INTERACTIVE, DatabaseTokenBucket, FileTokenBucket, MemoryTokenBucket,
+)
+from .tenants import get_tenant
+from .timing import timed
+
+
+def _configure_stripe(module):
+    module.api_key = settings.STRIPE_SECRET_KEY
+    module.default_http_client = module.http_client.new_default_http_client(timeout=settings.STRIPE_TIMEOUT_SECONDS)
+    if settings.STRIPE_API_BASE:
+        module.api_base = settings.STRIPE_API_BASE
+
+
+stripe = LazyModule('stripe', on_load=_configure_stripe)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_stripe_limiter(tenant_id=None):
+    """The outbound Stripe rate limiter for ``tenant_id``'s account, configured by ``PAYMENTS_STRIPE_RATE_LIMIT_*``.
+
+    Stripe limits each account separately, so every tenant has its own
+    bucket of the configured size; ``None`` is the default account.
+    """
+    with _limiters_lock:
+        if tenant_id not in _limiters:
+            _limiters[tenant_id] = _make_limiter(tenant_id)
+        return _limiters[tenant_id]
+
+
+def _make_limiter(tenant_id):
+    options = {
+        'rate': settings.PAYMENTS_STRIPE_RATE_PER_SECOND,
+        'capacity': settings.PAYMENTS_STRIPE_RATE_BURST,
+        'background_reserve': settings.PAYMENTS_STRIPE_BACKGROUND_RESERVE,
+    }
+    backend = settings.PAYMENTS_STRIPE_RATE_LIMIT_BACKEND
+    if backend == 'file':
+        path = settings.PAYMENTS_STRIPE_RATE_LIMIT_PATH
+        return FileTokenBucket(path if tenant_id is None else f'{path}.{tenant_id}', **options)
+    if backend == 'database':
+        name = 'stripe' if tenant_id is None else f'stripe:{tenant_id}'
+        return DatabaseTokenBucket(name, settings.PAYMENTS_STRIPE_RATE_LIMIT_DB_ALIAS, **options)
+    if backend == 'memory':
+        return MemoryTokenBucket(**options)
+    raise ValueError(f'Unknown PAYMENTS_STRIPE_RATE_LIMIT_BACKEND: {backend}')
+
+
+def call_stripe(method, *args, priority=INTERACTIVE, tenant_id=None, **kwargs):
+    """Call a ``stripe.*`` API method once a rate-limit token is available.
+
+    Every outbound Stripe request in ``payments`` goes through here. Use
+    ``priority=BACKGROUND`` for batch work (sweeps, bulk refunds,
+    reconciliation) so it yields to customer-facing checkout traffic.
+    ``tenant_id`` sends the request with that tenant's secret key instead
+    of the process-wide ``stripe.api_key``, and takes the token from that
+    tenant's bucket.
+    """
+    if tenant_id is not None:
+        kwargs['api_key'] = get_tenant(tenant_id).stripe_secret_key
+    get_stripe_limiter(tenant_id).acquire(priority=priority)
+    with timed('stripe'):
+        return method(*args, **kwargs)
+
+
+class StripeEvent(dict):
+    """A webhook event as plain parsed JSON, with shortcuts for the fields handlers use.
+
+    Unlike ``stripe.Webhook.construct_event`` no ``StripeObject`` tree is
+    built; nested objects are ordinary dicts and lists.
+    """
+
+    @property
+    def id(self):
+        return self['id']
+
+    @property
+    def type(self):
+        return self['type']
+
+    @property
+    def object(self):
+        return self['data']['object']
+
+
+def construct_webhook_event(payload, sig_header, secret):
+    """Verify a webhook's ``Stripe-Signature`` and parse its body into a ``StripeEvent``.
+
+    Raises ``stripe.error.SignatureVerificationError`` for a bad signature and
+    ``ValueError`` for a body that is not JSON.
+    """
+    stripe.WebhookSignature.verify_header(
+        payload.decode('utf-8'), sig_header, secret, stripe.Webhook.DEFAULT_TOLERANCE
+    )
+    return StripeEvent(loads(payload))
@@ -0,0 +1,126 @@
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .callbacks import callback_payloads, dispatch_payment_events
+from .models import ParkedEvent, PaymentSession
+from .stripe_api import BACKGROUND, call_stripe, stripe
+from .tenants import preload_tenants
+
+logger = logging.getLogger(__name__)
+
+
+def expire_checkout_session(checkout_session_id, tenant_id=None):
+    """Expire one of ``tenant_id``'s Checkout Sessions in Stripe.
+
+    Returns ``'expired'`` if the session is (now) expired, ``'complete'`` if the
+    customer already paid (the session must be left for the webhook), or
+    ``'error'`` if Stripe could not be reached or refused for another reason.
+    """
+    if not checkout_session_id:
+        return 'expired'
+    try:
+        call_stripe(stripe.checkout.Session.expire, checkout_session_id, priority=BACKGROUND, tenant_id=tenant_id)
+        return 'expired'
+    except stripe.error.InvalidRequestError:
+        # Already expired or already completed; ask Stripe which.
+        try:
+            session = call_stripe(
+                stripe.checkout.Session.retrieve, checkout_session_id, priority=BACKGROUND, tenant_id=tenant_id,
+            )
+        except stripe.error.StripeError:
+            return 'error'
+        return 'complete' if session.get('status') == 'complete' else 'expired'
+    except stripe.error.StripeError:
+        logger.warning('Could not expire checkout session %s', checkout_session_id, exc_info=True)
+        return 'error'
+
+
+def cancel_sessions(session_ids):
+    """Cancel the given sessions with one conditional UPDATE and notify consumers.
+
+    Sessions that have moved on (e.g. succeeded) in the meantime are left
+    alone by the transition table. Returns the number of sessions cancelled.
+    """
+    with transaction.atomic():
+        canceled = PaymentSession.objects.filter(id__in=session_ids).transition('canceled')
+        if canceled:
+            events = callback_payloads(canceled)
+            transaction.on_commit(lambda: dispatch_payment_events(events))
+    return len(canceled)
+
+
+def purge_parked_events(max_age_hours=None):
+    """Delete parked webhook events nothing claimed within ``max_age_hours``.
+
+    Events for payments made outside this app (same Stripe account) never
+    match and would otherwise accumulate. Returns the number deleted.
+    """
+    max_age_hours = max_age_hours or settings.PAYMENTS_PARKED_EVENT_MAX_AGE_HOURS
+    cutoff = timezone.now() - timedelta(hours=max_age_hours)
+    deleted, _ = ParkedEvent.objects.filter(created_at__lt=cutoff).delete()
+    if deleted:
+        logger.info('Purged %s parked webhook events older than %sh', deleted, max_age_hours)
+    return deleted
+
+
+def sweep_stale_sessions(max_age_minutes=None, batch_size=None, concurrency=None, progress=None):
+    """Expire checkout sessions left ``pending`` for longer than ``max_age_minutes``.
+
+    Sessions are read in ``(status, created_at)`` index order, ``batch_size`` at a
+    time. Each batch is expired in Stripe on ``concurrency`` threads and the
+    sessions Stripe confirms as expired are cancelled with a single UPDATE;
+    consumers (e.g. bookings) are notified through the usual subscribers.
+    ``progress(stats)`` is called after every batch with running totals.
+    """
+    max_age_minutes = max_age_minutes or settings.PAYMENTS_SWEEP_MAX_AGE_MINUTES
+    batch_size = batch_size or settings.PAYMENTS_SWEEP_BATCH_SIZE
+    concurrency = concurrency or settings.PAYMENTS_SWEEP_CONCURRENCY
+
+    cutoff = timezone.now() - timedelta(minutes=max_age_minutes)
+    stats = Counter()
+    started = time.monotonic()
+    after = None
+
+    def expire(checkout_session_id, tenant_id):
+        try:
+            return expire_checkout_session(checkout_session_id, tenant_id)
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            stale = PaymentSession.objects.filter(status='pending', created_at__lt=cutoff)
+            if after:
+                stale = stale.filter(Q(created_at__gt=after[0]) | Q(created_at=after[0], id__gt=after[1]))
+            batch = list(
+                stale.order_by('created_at', 'id')
+                .values_list('id', 'stripe_checkout_session_id', 'created_at', 'tenant_id')[:batch_size]
+            )
+            if not batch:
+                break
+            after = (batch[-1][2], batch[-1][0])
+
+            preload_tenants(row[3] for row in batch)
+            outcomes = list(pool.map(expire, [row[1] for row in batch], [row[3] for row in batch]))
+            expired_ids = [row[0] for row, outcome in zip(batch, outcomes) if outcome == 'expired']
+
+            stats['batches'] += 1
+            stats['scanned'] += len(batch)
+            stats.update(outcomes)
+            stats['canceled'] += cancel_sessions(expired_ids) if expired_ids else 0
+            stats['elapsed_seconds'] = round(time.monotonic() - started, 3)
+
+            if progress:
+                progress(stats)
+            if len(batch) < batch_size:
+                break
+
+    return stats
@@ -0,0 +1,121 @@
+"""Per-tenant Stripe credentials, cached in a bounded LRU.
+
+Every process serves every tenant, so credentials are loaded on first use
+and kept for ``PAYMENTS_TENANT_CACHE_SECONDS`` in an LRU of at most
+``PAYMENTS_TENANT_CACHE_SIZE`` tenants. Saving or deleting a ``Tenant``
+evicts it in the current process; other processes pick the change up when
+their entry expires.
+
+A tenant id of ``None`` is the default account from settings.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+TenantConfig = namedtuple('TenantConfig', 'id slug stripe_secret_key stripe_webhook_secret is_active')
+
+
+def default_tenant():
+    return TenantConfig(None, '', settings.STRIPE_SECRET_KEY, settings.STRIPE_WEBHOOK_SECRET, True)
+
+
+class TenantCache:
+    """LRU of ``TenantConfig`` by id and by slug. Thread-safe."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """The config cached under ``key``, or ``load()``'s (``None`` is not cached)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                return entry[0]
+        config = load()
+        if config is not None:
+            with self._lock:
+                for entry_key in (('id', config.id), ('slug', config.slug)):
+                    self._entries[entry_key] = (config, now + self.ttl)
+                    self._entries.move_to_end(entry_key)
+                while len(self._entries) > self.maxsize * 2:
+                    self._entries.popitem(last=False)
+        return config
+
+    def evict(self, tenant_id=None, slug=None):
+        with self._lock:
+            entry = self._entries.pop(('id', tenant_id), None)
+            if entry:
+                # The slug it was cached under, in case it has just changed.
+                self._entries.pop(('slug', entry[0].slug), None)
+            self._entries.pop(('slug', slug), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+
+
+def get_tenant_cache():
+    global _cache
+    if _cache is None:
+        _cache = TenantCache(settings.PAYMENTS_TENANT_CACHE_SIZE, settings.PAYMENTS_TENANT_CACHE_SECONDS)
+    return _cache
+
+
+def _load(**lookup):
+    from .models import Tenant
+
+    row = Tenant.objects.filter(**lookup).values_list(
+        'id', 'slug', 'stripe_secret_key', 'stripe_webhook_secret', 'is_active'
+    ).first()
+    return TenantConfig(*row) if row else None
+
+
+def get_tenant(tenant_id):
+    """The credentials for ``tenant_id``. Raises ``Tenant.DoesNotExist``.
+
+    Inactive tenants are returned too: deactivating a tenant stops new
+    checkouts and webhooks, not the expiries and refunds of its payments.
+    """
+    if tenant_id is None:
+        return default_tenant()
+    config = get_tenant_cache().get(('id', tenant_id), lambda: _load(id=tenant_id))
+    if config is None:
+        from .models import Tenant
+        raise Tenant.DoesNotExist(f'No tenant with id {tenant_id}')
+    return config
+
+
+def get_tenant_by_slug(slug):
+    """The credentials for an active tenant, by slug; a blank slug is the default account."""
+    if not slug:
+        return default_tenant()
+    config = get_tenant_cache().get(('slug', slug), lambda: _load(slug=slug))
+    if config is None or not config.is_active:
+        from .models import Tenant
+        raise Tenant.DoesNotExist(f'No active tenant {slug!r}')
+    return config
+
+
+def preload_tenants(tenant_ids):
+    """Cache the credentials of ``tenant_ids`` before fanning Stripe calls out to a pool.
+
+    Loads each tenant once on the calling thread instead of on whichever
+    pool threads miss the cache first.
+    """
+    for tenant_id in set(tenant_ids):
+        get_tenant(tenant_id)
+
+
+def evict_tenant(sender, instance, **kwargs):
+    """``post_save``/``post_delete`` receiver for ``Tenant``."""
+    get_tenant_cache().evict(instance.id, instance.slug)
@@ -1,8 +1,41 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.utils import timezone
 from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 import json
-from .models import Customer, PaymentSession, Transaction, Refund
+import os
+import tempfile
+import time
+from io import StringIO
+from .models import (
+    BatchJob, Customer, ParkedEvent, PaymentDailyTotal, PaymentEvent, PaymentSession, PaymentSessionItem,
+    PaymentStatusTotal, ProjectionCheckpoint, RateLimitBucket, RecurringCharge, Refund, Tenant, Transaction,
+)
+from .batches import claim_batch_job, run_batch, start_batch
+from .billing import add_months, run_billing
+from .callbacks import (
+    batcher, callback_payloads, dispatch_payment_events, post_callback, register_payment_subscriber, sign_payload,
+    unregister_payment_subscriber, verify_signature,
+)
+from .ratelimit import BACKGROUND, INTERACTIVE, CacheWindowCounter, FileTokenBucket, MemoryTokenBucket
+from .refunds import create_refunds_bulk_internal
+from .stripe_api import get_stripe_limiter
+from .sweeper import purge_parked_events, sweep_stale_sessions
+from . import fastjson, timing
+from .lazy import LazyModule
+from .profiling import profile_if_slow
+from .projections import update_projections
+from .tenants import TenantCache, TenantConfig, get_tenant, get_tenant_by_slug
+from .views import (
+    handle_charge_refunded, handle_checkout_completed, handle_checkout_expired,
+    handle_payment_failed, handle_payment_intent_succeeded, handle_stripe_event,
+)
 
 
 class PaymentSessionIdempotencyTest(TestCase):
@@ -147,10 +180,10 @@ class WebhookSignatureTest(TestCase):
         )
         self.assertEqual(response.status_code, 400)
 
-    @patch('payments.views.stripe.Webhook.construct_event')
-    def test_webhook_rejects_invalid_signature(self, mock_construct_event):
+    @patch('payments.views.stripe.WebhookSignature.verify_header')
+    def test_webhook_rejects_invalid_signature(self, mock_verify_header):
         import stripe
-        mock_construct_event.side_effect = stripe.error.SignatureVerificationError(
+        mock_verify_header.side_effect = stripe.error.SignatureVerificationError(
             'Invalid signature', 'sig_header'
         )
 
@@ -164,6 +197,60 @@ class WebhookSignatureTest(TestCase):
         self.assertEqual(response.status_code, 400)
 
 
+    def test_signed_webhook_is_parsed_and_handled(self):
+        import stripe
+        payment_session = PaymentSession.objects.create(
+            payable_type='widget',
+            payable_id='1',
+            amount_pence=1000,
+            status='pending',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key='signed-webhook',
+            stripe_checkout_session_id='cs_signed',
+        )
+        payload = json.dumps({
+            'id': 'evt_signed',
+            'type': 'checkout.session.completed',
+            'data': {'object': {'id': 'cs_signed', 'payment_intent': 'pi_signed'}},
+        })
+        timestamp = int(time.time())
+        signature = stripe.WebhookSignature._compute_signature(f'{timestamp}.{payload}', settings.STRIPE_WEBHOOK_SECRET)
+
+        response = self.client.post(
+            '/api/payments/webhook/stripe/',
+            data=payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        payment_session.refresh_from_db()
+        self.assertEqual(payment_session.status, 'succeeded')
+        self.assertEqual(payment_session.processed_events, ['evt_signed'])
+
+
+class FastJsonTest(TestCase):
+    def test_dumps_matches_django_encoder_for_view_types(self):
+        from decimal import Decimal
+        from django.core.serializers.json import DjangoJSONEncoder
+        value = {'at': timezone.now(), 'amount': Decimal('1.50'), 'n': 1, 'name': 'Zoë'}
+        self.assertEqual(fastjson.loads(fastjson.dumps(value)), json.loads(json.dumps(value, cls=DjangoJSONEncoder)))
+
+    def test_status_shape_selects_only_its_columns(self):
+        payment_session = PaymentSession.objects.create(
+            payable_type='widget', payable_id='7', amount_pence=500, status='pending',
+            success_url='https://example.com/s', cancel_url='https://example.com/c', idempotency_key='shape',
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/payments/status/{payment_session.id}/')
+        self.assertNotIn('metadata', queries[0]['sql'])
+        self.assertEqual(response.json(), {
+            'payment_session_id': str(payment_session.id), 'payable_type': 'widget', 'payable_id': '7',
+            'status': 'pending', 'amount_pence': 500, 'currency': 'GBP',
+        })
+
+
 class PaymentValidationTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -236,3 +323,1362 @@ class CustomerCreationTest(TestCase):
         customer = Customer.objects.get(email='newcustomer@example.com')
         self.assertEqual(customer.name, 'New Customer')
         self.assertEqual(customer.provider_customer_id, 'cus_new123')
+
+
+class CustomerUpsertTest(TestCase):
+    def test_upsert_matches_email_case_insensitively(self):
+        first = Customer.objects.upsert('Bob@Example.com ', name='Bob')
+        second = Customer.objects.upsert('bob@example.COM', name='Robert', phone='+44123')
+
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(Customer.objects.count(), 1)
+        customer = Customer.objects.get()
+        self.assertEqual(customer.email, 'bob@example.com')
+        self.assertEqual(customer.name, 'Bob')
+        self.assertEqual(customer.phone, '+44123')
+
+    def test_upsert_is_one_statement(self):
+        Customer.objects.upsert('one@example.com')
+        with CaptureQueriesContext(connection) as queries:
+            customer = Customer.objects.upsert('ONE@example.com')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(customer.email, 'one@example.com')
+
+    def test_case_duplicate_rejected_by_database(self):
+        Customer.objects.create(email='dup@example.com')
+        with self.assertRaises(IntegrityError):
+            Customer.objects.bulk_create([Customer(email='DUP@example.com')])
+
+
+class PaymentSubscriberTest(TestCase):
+    def setUp(self):
+        self.received = []
+        self.subscriber = self.received.extend
+        register_payment_subscriber('widget', self.subscriber)
+        self.payment_session = PaymentSession.objects.create(
+            payable_type='widget',
+            payable_id='7',
+            amount_pence=1500,
+            status='pending',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key='subscriber-key',
+            stripe_checkout_session_id='cs_sub123',
+        )
+
+    def tearDown(self):
+        unregister_payment_subscriber('widget', self.subscriber)
+
+    @override_settings(PAYMENTS_WEBHOOK_CALLBACK_URL='https://consumer.example.com/callback/')
+    @patch('payments.callbacks.requests.post')
+    def test_subscriber_runs_on_commit_instead_of_http(self, mock_post):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            handle_checkout_completed({'id': 'cs_sub123', 'payment_intent': 'pi_sub123'}, 'evt_sub1')
+            self.assertEqual(self.received, [])
+
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(self.received, [{
+            'payable_type': 'widget',
+            'payable_id': '7',
+            'payment_session_id': str(self.payment_session.id),
+            'status': 'succeeded',
+        }])
+        mock_post.assert_not_called()
+
+    @override_settings(PAYMENTS_WEBHOOK_CALLBACK_URL='https://consumer.example.com/callback/')
+    @patch('payments.callbacks.requests.post')
+    def test_unsubscribed_types_use_http_callback(self, mock_post):
+        self.payment_session.payable_type = 'external'
+        self.payment_session.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_checkout_expired({'id': 'cs_sub123'}, 'evt_sub2')
+
+        self.assertEqual(self.received, [])
+        mock_post.assert_called_once()
+        self.assertEqual(json.loads(mock_post.call_args.kwargs['data'])['status'], 'canceled')
+
+
+@override_settings(
+    PAYMENTS_WEBHOOK_CALLBACK_BATCH_URL='https://consumer.example.com/batch/',
+    PAYMENTS_CALLBACK_SECRET='cb_secret',
+    PAYMENTS_CALLBACK_BATCH_WINDOW_MS=60000,
+    PAYMENTS_CALLBACK_BATCH_MAX_EVENTS=3,
+)
+class BatchCallbackTest(TestCase):
+    def setUp(self):
+        self.addCleanup(batcher.clear)
+
+    def event(self, session_id, status):
+        return {'payable_type': 'external', 'payable_id': session_id, 'payment_session_id': session_id, 'status': status}
+
+    @patch('payments.callbacks.requests.post')
+    def test_events_are_coalesced_into_one_signed_request(self, mock_post):
+        dispatch_payment_events([self.event('1', 'pending')])
+        dispatch_payment_events([self.event('2', 'succeeded'), self.event('1', 'succeeded')])
+        mock_post.assert_not_called()
+
+        batcher.flush()
+
+        mock_post.assert_called_once()
+        url, kwargs = mock_post.call_args.args[0], mock_post.call_args.kwargs
+        self.assertEqual(url, 'https://consumer.example.com/batch/')
+        self.assertEqual(json.loads(kwargs['data'])['events'], [self.event('2', 'succeeded'), self.event('1', 'succeeded')])
+        self.assertTrue(verify_signature(kwargs['data'], kwargs['headers']['X-Payments-Signature'], 'cb_secret'))
+
+    @patch('payments.callbacks.requests.post')
+    def test_full_batch_is_sent_immediately(self, mock_post):
+        dispatch_payment_events([self.event(str(n), 'canceled') for n in range(3)])
+        mock_post.assert_called_once()
+        self.assertEqual(len(json.loads(mock_post.call_args.kwargs['data'])['events']), 3)
+
+    @patch('payments.callbacks.requests.post')
+    def test_every_cart_item_is_sent(self, mock_post):
+        payment_session = PaymentSession.objects.create(
+            payable_type='cart', payable_id='cart-b', amount_pence=3000, status='succeeded',
+            success_url='https://example.com/success', cancel_url='https://example.com/cancel',
+            idempotency_key='cart-b',
+        )
+        PaymentSessionItem.objects.bulk_create([
+            PaymentSessionItem(payment_session=payment_session, payable_type='external', payable_id=str(n), amount_pence=1000)
+            for n in range(3)
+        ])
+
+        dispatch_payment_events(callback_payloads([payment_session]))
+
+        mock_post.assert_called_once()
+        events = json.loads(mock_post.call_args.kwargs['data'])['events']
+        self.assertEqual(sorted(event['payable_id'] for event in events), ['0', '1', '2'])
+        self.assertEqual({event['payment_session_id'] for event in events}, {str(payment_session.id)})
+
+    def test_signature_rejects_tampering_and_old_timestamps(self):
+        body = b'{"events":[]}'
+        self.assertTrue(verify_signature(body, sign_payload(body, 'cb_secret'), 'cb_secret'))
+        self.assertFalse(verify_signature(body + b' ', sign_payload(body, 'cb_secret'), 'cb_secret'))
+        self.assertFalse(verify_signature(body, sign_payload(body, 'cb_secret', time.time() - 3600), 'cb_secret'))
+        self.assertFalse(verify_signature(body, 'garbage', 'cb_secret'))
+
+
+class StaleSessionSweepTest(TestCase):
+    def make_session(self, key, age_minutes):
+        payment_session = PaymentSession.objects.create(
+            payable_type='widget',
+            payable_id=key,
+            amount_pence=1000,
+            status='pending',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key=f'sweep-{key}',
+            stripe_checkout_session_id=f'cs_{key}',
+        )
+        PaymentSession.objects.filter(id=payment_session.id).update(
+            created_at=timezone.now() - timedelta(minutes=age_minutes)
+        )
+        return payment_session
+
+    @patch('payments.sweeper.stripe.checkout.Session.retrieve')
+    @patch('payments.sweeper.stripe.checkout.Session.expire')
+    def test_sweep_cancels_only_stale_unpaid_sessions(self, mock_expire, mock_retrieve):
+        import stripe
+
+        def expire(checkout_session_id):
+            if checkout_session_id == 'cs_paid':
+                raise stripe.error.InvalidRequestError('Session is complete', None)
+            return MagicMock(status='expired')
+
+        mock_expire.side_effect = expire
+        mock_retrieve.return_value = {'status': 'complete'}
+
+        stale = [self.make_session(f'stale{n}', 120) for n in range(3)]
+        paid = self.make_session('paid', 120)
+        fresh = self.make_session('fresh', 5)
+
+        received = []
+        register_payment_subscriber('widget', received.extend)
+        self.addCleanup(unregister_payment_subscriber, 'widget', received.extend)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = sweep_stale_sessions(max_age_minutes=60, batch_size=2, concurrency=2)
+
+        self.assertEqual(stats['scanned'], 4)
+        self.assertEqual(stats['canceled'], 3)
+        self.assertEqual(stats['complete'], 1)
+        self.assertEqual(stats['batches'], 2)
+
+        statuses = dict(PaymentSession.objects.values_list('id', 'status'))
+        for payment_session in stale:
+            self.assertEqual(statuses[payment_session.id], 'canceled')
+        self.assertEqual(statuses[paid.id], 'pending')
+        self.assertEqual(statuses[fresh.id], 'pending')
+        self.assertEqual(sorted(event['payable_id'] for event in received), ['stale0', 'stale1', 'stale2'])
+
+
+class PaymentSessionTransitionTest(TestCase):
+    def setUp(self):
+        self.payment_session = PaymentSession.objects.create(
+            payable_type='widget',
+            payable_id='9',
+            amount_pence=2500,
+            status='pending',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key='transition-key',
+            stripe_checkout_session_id='cs_cas',
+            stripe_payment_intent_id='pi_cas',
+        )
+
+    def data_queries(self, captured):
+        return [q['sql'] for q in captured if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+
+    def test_completed_handler_uses_three_queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            handle_checkout_completed({'id': 'cs_cas', 'payment_intent': 'pi_cas'}, 'evt_cas1')
+
+        # UPDATE ... RETURNING, the event log row and the transaction.
+        self.assertEqual(len(self.data_queries(captured)), 3)
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'succeeded')
+        self.assertEqual(self.payment_session.processed_events, ['evt_cas1'])
+        self.assertEqual(self.payment_session.transactions.count(), 1)
+
+    def test_late_expiry_cannot_clobber_success(self):
+        handle_checkout_completed({'id': 'cs_cas', 'payment_intent': 'pi_cas'}, 'evt_cas1')
+
+        with CaptureQueriesContext(connection) as captured:
+            handle_checkout_expired({'id': 'cs_cas'}, 'evt_cas2')
+
+        # The no-op UPDATE, then the existence check that decides against parking it.
+        self.assertEqual(len(self.data_queries(captured)), 2)
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'succeeded')
+        self.assertNotIn('evt_cas2', self.payment_session.processed_events)
+
+    def test_replayed_success_events_create_one_transaction(self):
+        handle_checkout_completed({'id': 'cs_cas', 'payment_intent': 'pi_cas'}, 'evt_cas1')
+        handle_checkout_completed({'id': 'cs_cas', 'payment_intent': 'pi_cas'}, 'evt_cas1')
+        handle_payment_intent_succeeded({'id': 'pi_cas'}, 'evt_cas3')
+
+        self.assertEqual(self.payment_session.transactions.count(), 1)
+
+    def test_failed_payment_can_still_succeed(self):
+        handle_payment_failed({'id': 'pi_cas'}, 'evt_cas4')
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'failed')
+
+        handle_payment_intent_succeeded({'id': 'pi_cas'}, 'evt_cas5')
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'succeeded')
+        self.assertEqual(self.payment_session.processed_events, ['evt_cas4', 'evt_cas5'])
+
+    def test_refund_only_from_succeeded(self):
+        charge = {'id': 'pi_cas', 'refunds': {'data': [{'id': 're_1', 'amount': 2500, 'status': 'succeeded'}]}}
+        handle_charge_refunded(charge, 'evt_cas6')
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'pending')
+
+        handle_checkout_completed({'id': 'cs_cas', 'payment_intent': 'pi_cas'}, 'evt_cas7')
+        handle_charge_refunded(charge, 'evt_cas8')
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'refunded')
+        self.assertEqual(Refund.objects.filter(provider_refund_id='re_1').count(), 1)
+
+
+class PaymentEventLogTest(TestCase):
+    def create_session(self, key, payable_type='widget', amount_pence=1000):
+        return PaymentSession.objects.create(
+            payable_type=payable_type,
+            payable_id=key,
+            amount_pence=amount_pence,
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key=key,
+            stripe_checkout_session_id=f'cs_{key}',
+            stripe_payment_intent_id=f'pi_{key}',
+        )
+
+    def test_transitions_append_events(self):
+        payment_session = self.create_session('log1')
+        PaymentSession.objects.filter(id=payment_session.id).transition('pending')
+        handle_checkout_completed({'id': 'cs_log1', 'payment_intent': 'pi_log1'}, 'evt_log1')
+        handle_checkout_expired({'id': 'cs_log1'}, 'evt_log2')
+
+        events = list(payment_session.events.values_list('seq', 'from_status', 'to_status', 'stripe_event_id'))
+        self.assertEqual(events, [
+            (1, '', 'created', None),
+            (2, 'created', 'pending', None),
+            (3, 'pending', 'succeeded', 'evt_log1'),
+        ])
+        payment_session.refresh_from_db()
+        self.assertEqual(payment_session.event_seq, 3)
+
+    def test_seq_is_unique_per_session(self):
+        payment_session = self.create_session('log2')
+        with self.assertRaises(IntegrityError):
+            PaymentEvent.objects.create(payment_session=payment_session, seq=1, to_status='pending')
+
+    def test_projections_update_incrementally(self):
+        first = self.create_session('log3', amount_pence=1000)
+        second = self.create_session('log4', amount_pence=2500)
+        PaymentSession.objects.filter(id__in=[first.id, second.id]).transition('pending')
+
+        self.assertEqual(update_projections(), {'status_totals': 4, 'daily_totals': 4})
+        totals = {row.status: (row.count, row.amount_pence) for row in PaymentStatusTotal.objects.all()}
+        self.assertEqual(totals, {'created': (0, 0), 'pending': (2, 3500)})
+
+        handle_checkout_completed({'id': 'cs_log3', 'payment_intent': 'pi_log3'}, 'evt_log3')
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(update_projections(), {'status_totals': 1, 'daily_totals': 1})
+        self.assertLess(len(captured), 20)
+
+        totals = {row.status: (row.count, row.amount_pence) for row in PaymentStatusTotal.objects.all()}
+        self.assertEqual(totals['pending'], (1, 2500))
+        self.assertEqual(totals['succeeded'], (1, 1000))
+        daily = {row.status: row.count for row in PaymentDailyTotal.objects.filter(day=timezone.now().date())}
+        self.assertEqual(daily, {'created': 2, 'pending': 2, 'succeeded': 1})
+        self.assertEqual(
+            ProjectionCheckpoint.objects.get(name='status_totals').position,
+            PaymentEvent.objects.latest('id').id,
+        )
+
+    def test_late_commits_fill_gaps_and_rebuild_matches(self):
+        first = self.create_session('log5')
+        second = self.create_session('log7')
+        # The first session's event is still uncommitted when the projection runs.
+        late = PaymentEvent.objects.get(payment_session=first)
+        PaymentEvent.objects.filter(id=late.id).delete()
+
+        self.assertEqual(update_projections(), {'status_totals': 1, 'daily_totals': 1})
+        checkpoint = ProjectionCheckpoint.objects.get(name='status_totals')
+        self.assertEqual(checkpoint.position, PaymentEvent.objects.get(payment_session=second).id)
+        self.assertEqual([event_id for event_id, _ in checkpoint.gaps], [late.id])
+
+        late.save(force_insert=True)
+        self.assertEqual(update_projections(), {'status_totals': 1, 'daily_totals': 1})
+        self.assertEqual(ProjectionCheckpoint.objects.get(name='status_totals').gaps, [])
+        self.assertEqual(PaymentStatusTotal.objects.get(status='created').count, 2)
+        before = list(PaymentDailyTotal.objects.values_list('day', 'payable_type', 'status', 'count'))
+
+        self.assertEqual(update_projections(rebuild=True), {'status_totals': 2, 'daily_totals': 2})
+        after = list(PaymentDailyTotal.objects.values_list('day', 'payable_type', 'status', 'count'))
+        self.assertEqual(before, after)
+
+    def test_gaps_are_dropped_after_gap_seconds(self):
+        first = self.create_session('log8')
+        self.create_session('log9')
+        PaymentEvent.objects.filter(payment_session=first).delete()
+
+        update_projections()
+        self.assertEqual(len(ProjectionCheckpoint.objects.get(name='status_totals').gaps), 1)
+        self.assertEqual(update_projections(gap_seconds=0), {'status_totals': 0, 'daily_totals': 0})
+        self.assertEqual(ProjectionCheckpoint.objects.get(name='status_totals').gaps, [])
+
+    def test_command_reports_applied_events(self):
+        self.create_session('log6')
+        out = StringIO()
+        call_command('update_payment_projections', stdout=out)
+        self.assertIn('status_totals=1, daily_totals=1', out.getvalue())
+
+
+class ParkedEventTest(TestCase):
+    def setUp(self):
+        self.payment_session = PaymentSession.objects.create(
+            payable_type='widget',
+            payable_id='3',
+            amount_pence=4000,
+            status='pending',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key='parked-key',
+            stripe_checkout_session_id='cs_park',
+        )
+
+    def event(self, event_id, event_type, obj):
+        return {'id': event_id, 'type': event_type, 'data': {'object': obj}}
+
+    def test_early_payment_intent_event_is_parked_and_replayed(self):
+        handle_stripe_event(self.event('evt_pi', 'payment_intent.payment_failed', {
+            'id': 'pi_park', 'metadata': {'payment_session_id': str(self.payment_session.id)},
+        }))
+        parked = ParkedEvent.objects.get(stripe_event_id='evt_pi')
+        self.assertEqual(parked.payment_intent_id, 'pi_park')
+        self.assertEqual(parked.payment_session_id, str(self.payment_session.id))
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'pending')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_stripe_event(self.event('evt_cs', 'checkout.session.completed', {
+                'id': 'cs_park', 'payment_intent': 'pi_park',
+            }))
+
+        self.assertFalse(ParkedEvent.objects.exists())
+        self.payment_session.refresh_from_db()
+        # The late failure cannot undo the success, but it was consumed.
+        self.assertEqual(self.payment_session.status, 'succeeded')
+        self.assertEqual(self.payment_session.processed_events, ['evt_cs'])
+
+    def test_early_refund_is_replayed_once_transaction_exists(self):
+        self.payment_session.stripe_payment_intent_id = 'pi_refund'
+        self.payment_session.save(update_fields=['stripe_payment_intent_id'])
+        charge = {
+            'id': 'ch_refund', 'payment_intent': 'pi_refund',
+            'refunds': {'data': [{'id': 're_park', 'amount': 4000, 'status': 'succeeded'}]},
+        }
+        handle_stripe_event(self.event('evt_refund', 'charge.refunded', charge))
+        self.assertEqual(ParkedEvent.objects.get().charge_id, 'ch_refund')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_stripe_event(self.event('evt_paid', 'payment_intent.succeeded', {'id': 'pi_refund'}))
+
+        self.assertFalse(ParkedEvent.objects.exists())
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'refunded')
+        self.assertTrue(Refund.objects.filter(provider_refund_id='re_park').exists())
+
+    def test_key_stored_while_parking_replays_the_event(self):
+        park = ParkedEvent.park
+
+        def park_after_writer_commits(event, tenant_id=None):
+            # The checkout that stores the intent id commits between the lookup and the park.
+            PaymentSession.objects.filter(id=self.payment_session.id).update(stripe_payment_intent_id='pi_race')
+            return park(event, tenant_id)
+
+        with patch.object(ParkedEvent, 'park', side_effect=park_after_writer_commits):
+            with self.captureOnCommitCallbacks(execute=True):
+                handle_stripe_event(self.event('evt_race', 'payment_intent.payment_failed', {'id': 'pi_race'}))
+
+        self.assertFalse(ParkedEvent.objects.exists())
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'failed')
+
+    def test_matched_and_ignored_events_are_not_parked(self):
+        handle_stripe_event(self.event('evt_exp', 'checkout.session.expired', {'id': 'cs_park'}))
+        handle_stripe_event(self.event('evt_exp', 'checkout.session.expired', {'id': 'cs_park'}))
+        handle_stripe_event(self.event('evt_other', 'customer.created', {'id': 'cus_1'}))
+        self.assertFalse(ParkedEvent.objects.exists())
+
+    def test_tenant_events_only_touch_that_tenants_sessions(self):
+        tenant = Tenant.objects.create(slug='acme', name='Acme', stripe_webhook_secret='whsec_acme')
+        handle_stripe_event(self.event('evt_forged', 'checkout.session.completed', {'id': 'cs_park'}), tenant.id)
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'pending')
+        parked = ParkedEvent.objects.get(stripe_event_id='evt_forged')
+        self.assertEqual(parked.tenant_id, tenant.id)
+
+        # Replaying under the tenant it arrived for still cannot reach the default account's session.
+        with self.captureOnCommitCallbacks(execute=True):
+            handle_stripe_event(self.event('evt_cs', 'checkout.session.completed', {
+                'id': 'cs_park', 'payment_intent': 'pi_park',
+            }))
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.processed_events, ['evt_cs'])
+        self.assertTrue(ParkedEvent.objects.filter(stripe_event_id='evt_forged').exists())
+
+    def test_unmatched_replay_stays_parked_and_old_events_are_purged(self):
+        handle_stripe_event(self.event('evt_lost', 'payment_intent.succeeded', {'id': 'pi_elsewhere'}))
+        handle_stripe_event(self.event('evt_lost', 'payment_intent.succeeded', {'id': 'pi_elsewhere'}))
+        self.assertEqual(ParkedEvent.objects.count(), 1)
+
+        ParkedEvent.objects.update(created_at=timezone.now() - timedelta(hours=100))
+        self.assertEqual(purge_parked_events(max_age_hours=72), 1)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class LedgerAdminTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        customer = Customer.objects.create(email='ledger@example.com')
+        for n in range(3):
+            payment_session = PaymentSession.objects.create(
+                payable_type='widget',
+                payable_id=f'ledger-{n}',
+                amount_pence=1000 + n,
+                status='pending',
+                customer=customer,
+                success_url='https://example.com/success',
+                cancel_url='https://example.com/cancel',
+                idempotency_key=f'ledger-{n}',
+                stripe_checkout_session_id=f'cs_ledger{n}',
+            )
+            txn = Transaction.objects.create(payment_session=payment_session, gross_amount_pence=1000 + n)
+            Refund.objects.create(transaction=txn, amount_pence=100)
+
+    def test_changelists_do_not_count_or_query_per_row(self):
+        for url in ['/admin/payments/paymentsession/', '/admin/payments/transaction/', '/admin/payments/refund/']:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            sql = [q['sql'] for q in captured]
+            self.assertFalse([q for q in sql if 'COUNT(*)' in q and 'LIMIT' not in q], url)
+            self.assertLess(len(sql), 20, url)
+
+    def test_search_is_routed_to_indexed_columns(self):
+        cases = {
+            'cs_ledger1': ['ledger-1'],
+            'ledger-2': ['ledger-2'],
+            'LEDGER@example.com': ['ledger-0', 'ledger-1', 'ledger-2'],
+            'edger': [],
+        }
+        for term, expected in cases.items():
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get('/admin/payments/paymentsession/', {'q': term})
+            results = sorted(row.payable_id for row in response.context['cl'].result_list)
+            self.assertEqual(results, expected, term)
+            self.assertFalse([q['sql'] for q in captured if 'LIKE' in q['sql'] and "'%" in q['sql']], term)
+
+    def test_date_hierarchy_drilldown(self):
+        today = timezone.now()
+        response = self.client.get('/admin/payments/transaction/', {
+            'captured_at__year': today.year, 'captured_at__month': today.month,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+        days = response.context['cl'].queryset.datetimes('captured_at', 'day')
+        self.assertEqual([day.date() for day in days], [timezone.localdate(today)])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BatchActionTest(TestCase):
+    def setUp(self):
+        self.sessions = [
+            PaymentSession.objects.create(
+                payable_type='widget',
+                payable_id=f'batch{n}',
+                amount_pence=1000,
+                status='pending',
+                success_url='https://example.com/success',
+                cancel_url='https://example.com/cancel',
+                idempotency_key=f'batch-{n}',
+                stripe_checkout_session_id=f'cs_batch{n}',
+            )
+            for n in range(5)
+        ]
+        self.received = []
+        register_payment_subscriber('widget', self.received.extend)
+        self.addCleanup(unregister_payment_subscriber, 'widget', self.received.extend)
+
+    @patch('payments.batches.stripe.checkout.Session.retrieve')
+    def test_resync_applies_stripe_state_in_chunks(self, mock_retrieve):
+        import stripe
+        remote = {
+            'cs_batch0': {'status': 'complete', 'payment_status': 'paid', 'payment_intent': 'pi_batch0'},
+            'cs_batch1': {'status': 'expired'},
+            'cs_batch2': {'status': 'open'},
+        }
+
+        def retrieve(checkout_session_id):
+            if checkout_session_id == 'cs_batch3':
+                raise stripe.error.APIConnectionError('down')
+            return {'id': checkout_session_id, **remote.get(checkout_session_id, {'status': 'open'})}
+
+        mock_retrieve.side_effect = retrieve
+        job = start_batch('resync_from_stripe', 'payable_type=widget')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            job = run_batch(job.id, chunk_size=2, concurrency=2)
+
+        self.assertEqual(job.status, 'finished')
+        self.assertEqual(job.processed, 5)
+        self.assertEqual(job.position, self.sessions[-1].id)
+        self.assertEqual(job.stats, {'complete': 1, 'expired': 1, 'open': 2, 'error': 1})
+        self.assertEqual(job.errors, [{'payment_session_id': self.sessions[3].id, 'error': 'down'}])
+        statuses = dict(PaymentSession.objects.values_list('payable_id', 'status'))
+        self.assertEqual(statuses['batch0'], 'succeeded')
+        self.assertEqual(statuses['batch1'], 'canceled')
+        self.assertEqual(Transaction.objects.filter(provider_charge_id='pi_batch0').count(), 1)
+        self.assertEqual(sorted(event['status'] for event in self.received), ['canceled', 'succeeded'])
+
+    @patch('payments.batches.stripe.checkout.Session.expire')
+    def test_expire_resumes_from_position(self, mock_expire):
+        mock_expire.return_value = {'status': 'expired'}
+        job = start_batch('expire_in_stripe')
+        BatchJob.objects.filter(id=job.id).update(status='running', position=self.sessions[1].id, processed=2)
+
+        job = run_batch(job.id, chunk_size=10)
+
+        self.assertEqual(job.processed, 5)
+        self.assertEqual(job.stats, {'expired': 3, 'canceled': 3})
+        statuses = dict(PaymentSession.objects.values_list('payable_id', 'status'))
+        self.assertEqual(statuses['batch0'], 'pending')
+        self.assertEqual(statuses['batch4'], 'canceled')
+
+    def test_admin_action_queues_job_for_the_worker(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+
+        response = self.client.post('/admin/payments/paymentsession/', {
+            'action': 'resend_callback',
+            'select_across': '1',
+            '_selected_action': [self.sessions[0].id],
+            'index': '0',
+        }, follow=True)
+
+        job = BatchJob.objects.get()
+        self.assertEqual((job.status, job.query, job.total), ('queued', '', 5))
+        self.assertContains(response, f'batch job {job.id}')
+
+        stdout = StringIO()
+        call_command('run_batch_jobs', stdout=stdout)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.stats), ('finished', {'sent': 5}))
+        self.assertEqual(len(self.received), 5)
+        self.assertIsNone(claim_batch_job())
+
+    def test_admin_selection_keeps_filters_search_and_ticked_rows(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        PaymentSession.objects.filter(id=self.sessions[4].id).update(status='canceled')
+
+        self.client.post('/admin/payments/paymentsession/?status__exact=pending&q=batch', {
+            'action': 'resend_callback',
+            'select_across': '1',
+            '_selected_action': [self.sessions[0].id],
+            'index': '0',
+        })
+        self.client.post('/admin/payments/paymentsession/', {
+            'action': 'resend_callback',
+            'select_across': '0',
+            '_selected_action': [self.sessions[1].id, self.sessions[3].id],
+            'index': '0',
+        })
+
+        filtered, ticked = BatchJob.objects.order_by('id')
+        self.assertEqual(filtered.total, 4)
+        self.assertEqual(ticked.total, 2)
+        for job, expected in ((filtered, self.sessions[:4]), (ticked, [self.sessions[1], self.sessions[3]])):
+            with CaptureQueriesContext(connection) as queries:
+                job = run_batch(job.id, chunk_size=3)
+            self.assertEqual((job.status, job.processed, job.position), ('finished', len(expected), expected[-1].id))
+            self.assertFalse([q for q in queries.captured_queries if 'COUNT(' in q['sql']])
+        self.assertEqual(len(self.received), 6)
+
+
+class BulkRefundTest(TestCase):
+    def setUp(self):
+        self.transactions = []
+        for n in range(3):
+            payment_session = PaymentSession.objects.create(
+                payable_type='booking',
+                payable_id=str(n),
+                amount_pence=4000,
+                status='succeeded',
+                success_url='https://example.com/success',
+                cancel_url='https://example.com/cancel',
+                idempotency_key=f'bulk-refund-{n}',
+            )
+            self.transactions.append(Transaction.objects.create(
+                payment_session=payment_session,
+                gross_amount_pence=4000,
+                provider_charge_id=f'pi_bulk{n}',
+            ))
+
+    @patch('payments.refunds.stripe.Refund.create')
+    def test_refunds_selection_with_idempotency_keys(self, mock_refund_create):
+        import stripe
+
+        def create(**params):
+            if params['payment_intent'] == 'pi_bulk2':
+                raise stripe.error.CardError('Charge disputed', None, 'charge_disputed')
+            return {'id': f"re_{params['payment_intent']}", 'status': 'succeeded'}
+
+        mock_refund_create.side_effect = create
+
+        summary = create_refunds_bulk_internal(payable_type='booking', amount_pence=1500, reason='Class cancelled')
+
+        self.assertEqual(summary['requested'], 3)
+        self.assertEqual(summary['succeeded'], 2)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['failures'][0]['payment_session_id'], str(self.transactions[2].payment_session_id))
+
+        keys = {call.kwargs['idempotency_key'] for call in mock_refund_create.call_args_list}
+        self.assertEqual(keys, {f'nbne-refund-{refund.id}' for refund in Refund.objects.all()})
+
+        refund = Refund.objects.get(transaction=self.transactions[0])
+        self.assertEqual((refund.amount_pence, refund.status, refund.provider_refund_id), (1500, 'succeeded', 're_pi_bulk0'))
+        self.assertEqual(Refund.objects.get(transaction=self.transactions[2]).status, 'failed')
+
+    @patch('payments.refunds.stripe.Refund.create')
+    def test_partial_refunds_never_exceed_remaining_amount(self, mock_refund_create):
+        mock_refund_create.side_effect = lambda **params: {'id': f"re_{params['idempotency_key']}", 'status': 'pending'}
+        session_id = self.transactions[0].payment_session_id
+
+        create_refunds_bulk_internal(payment_session_ids=[session_id], amount_pence=3000)
+        create_refunds_bulk_internal(payment_session_ids=[session_id], amount_pence=3000)
+        self.assertEqual(mock_refund_create.call_args.kwargs['amount'], 1000)
+
+        summary = create_refunds_bulk_internal(payment_session_ids=[session_id])
+        self.assertEqual(summary['skipped'], 1)
+        self.assertEqual(sum(Refund.objects.values_list('amount_pence', flat=True)), 4000)
+
+    @patch('payments.refunds.stripe.Refund.create')
+    def test_ambiguous_errors_are_retried_with_the_same_key(self, mock_refund_create):
+        import stripe
+        session_id = self.transactions[0].payment_session_id
+        mock_refund_create.side_effect = stripe.error.APIConnectionError('Connection reset')
+
+        summary = create_refunds_bulk_internal(payment_session_ids=[session_id])
+        self.assertEqual((summary['unconfirmed'], summary['failed']), (1, 0))
+        refund = Refund.objects.get()
+        self.assertEqual(refund.status, 'requested')
+
+        mock_refund_create.side_effect = lambda **params: {'id': 're_retry', 'status': 'succeeded'}
+        summary = create_refunds_bulk_internal(payment_session_ids=[session_id])
+        self.assertEqual(summary['succeeded'], 1)
+        self.assertEqual(mock_refund_create.call_args.kwargs['idempotency_key'], f'nbne-refund-{refund.id}')
+        refund = Refund.objects.get()
+        self.assertEqual((refund.status, refund.provider_refund_id), ('succeeded', 're_retry'))
+
+    @patch('payments.refunds.stripe.Refund.create')
+    def test_webhook_confirms_an_unconfirmed_refund(self, mock_refund_create):
+        import stripe
+        mock_refund_create.side_effect = stripe.error.APIConnectionError('Timed out')
+        create_refunds_bulk_internal(payment_session_ids=[self.transactions[0].payment_session_id])
+        refund = Refund.objects.get()
+
+        handle_stripe_event({'id': 'evt_refunded', 'type': 'charge.refunded', 'data': {'object': {
+            'id': 'ch_bulk0', 'payment_intent': 'pi_bulk0', 'refunds': {'data': [{
+                'id': 're_late', 'amount': 4000, 'status': 'succeeded', 'metadata': {'refund_id': str(refund.id)},
+            }]},
+        }}})
+
+        refund = Refund.objects.get()
+        self.assertEqual((refund.status, refund.provider_refund_id), ('succeeded', 're_late'))
+
+    def test_selection_required(self):
+        with self.assertRaises(ValueError):
+            create_refunds_bulk_internal()
+
+
+class TenantTest(TestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(
+            slug='acme', name='Acme', stripe_secret_key='sk_test_acme', stripe_webhook_secret='whsec_acme',
+        )
+        self.checkout = {
+            'payable_type': 'booking',
+            'payable_id': '1',
+            'amount_pence': 1000,
+            'customer': {'email': 'shared@example.com'},
+            'success_url': 'https://example.com/success',
+            'cancel_url': 'https://example.com/cancel',
+            'idempotency_key': 'same-key',
+        }
+
+    def post_webhook(self, url, secret, payload):
+        import stripe
+        timestamp = int(time.time())
+        signature = stripe.WebhookSignature._compute_signature(f'{timestamp}.{payload}', secret)
+        return self.client.post(
+            url, data=payload, content_type='application/json', HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    @patch('payments.views.stripe.checkout.Session.create')
+    @patch('payments.views.stripe.Customer.create')
+    def test_checkout_uses_the_tenants_stripe_key(self, mock_customer_create, mock_session_create):
+        mock_customer_create.side_effect = lambda **kwargs: MagicMock(id=f"cus_{kwargs.get('api_key', 'default')}")
+        mock_session_create.side_effect = lambda **kwargs: MagicMock(
+            id=f"cs_{kwargs.get('api_key', 'default')}", url='https://checkout.stripe.com/test', payment_intent=None,
+        )
+
+        for body in (self.checkout, {**self.checkout, 'tenant': 'acme'}):
+            response = self.client.post('/api/payments/checkout/', data=json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertNotIn('api_key', mock_session_create.call_args_list[0].kwargs)
+        self.assertEqual(mock_session_create.call_args_list[1].kwargs['api_key'], 'sk_test_acme')
+        # Idempotency keys and customer emails are scoped to the tenant.
+        acme_session = PaymentSession.objects.get(tenant=self.tenant)
+        self.assertEqual(acme_session.stripe_checkout_session_id, 'cs_sk_test_acme')
+        self.assertEqual(acme_session.customer.tenant, self.tenant)
+        self.assertEqual(acme_session.customer.provider_customer_id, 'cus_sk_test_acme')
+        self.assertEqual(Customer.objects.filter(email='shared@example.com').count(), 2)
+
+        response = self.client.post(
+            '/api/payments/checkout/', data=json.dumps({**self.checkout, 'tenant': 'nope'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_webhooks_are_verified_with_the_tenants_secret(self):
+        payment_session = PaymentSession.objects.create(
+            tenant=self.tenant,
+            payable_type='booking',
+            payable_id='1',
+            amount_pence=1000,
+            status='pending',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key='tenant-webhook',
+            stripe_checkout_session_id='cs_tenant',
+        )
+        payload = json.dumps({
+            'id': 'evt_tenant',
+            'type': 'checkout.session.completed',
+            'data': {'object': {'id': 'cs_tenant', 'payment_intent': 'pi_tenant'}},
+        })
+
+        self.assertEqual(self.post_webhook('/api/payments/webhook/stripe/', 'whsec_acme', payload).status_code, 400)
+        self.assertEqual(self.post_webhook('/api/payments/webhook/stripe/other/', 'whsec_acme', payload).status_code, 404)
+        self.assertEqual(self.post_webhook('/api/payments/webhook/stripe/acme/', 'whsec_acme', payload).status_code, 200)
+
+        payment_session.refresh_from_db()
+        self.assertEqual(payment_session.status, 'succeeded')
+        self.assertEqual(payment_session.transactions.get().tenant, self.tenant)
+
+    @patch('payments.refunds.stripe.Refund.create')
+    def test_bulk_refunds_use_each_tenants_key(self, mock_refund_create):
+        mock_refund_create.side_effect = lambda **params: {'id': f"re_{params['payment_intent']}", 'status': 'succeeded'}
+        payment_session = PaymentSession.objects.create(
+            tenant=self.tenant,
+            payable_type='booking',
+            payable_id='1',
+            amount_pence=1000,
+            status='succeeded',
+            success_url='https://example.com/success',
+            cancel_url='https://example.com/cancel',
+            idempotency_key='tenant-refund',
+        )
+        Transaction.objects.create(
+            tenant=self.tenant, payment_session=payment_session, gross_amount_pence=1000, provider_charge_id='pi_acme',
+        )
+
+        create_refunds_bulk_internal(payment_session_ids=[payment_session.id])
+
+        self.assertEqual(mock_refund_create.call_args.kwargs['api_key'], 'sk_test_acme')
+        self.assertEqual(Refund.objects.get().tenant, self.tenant)
+
+    def test_credentials_are_cached_until_the_tenant_is_saved(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_tenant_by_slug('acme').stripe_secret_key, 'sk_test_acme')
+            self.assertEqual(get_tenant(self.tenant.id).stripe_secret_key, 'sk_test_acme')
+
+        self.tenant.stripe_secret_key = 'sk_test_rotated'
+        self.tenant.save()
+        self.assertEqual(get_tenant(self.tenant.id).stripe_secret_key, 'sk_test_rotated')
+
+        self.tenant.is_active = False
+        self.tenant.save()
+        with self.assertRaises(Tenant.DoesNotExist):
+            get_tenant_by_slug('acme')
+        # Existing payments can still be expired and refunded.
+        self.assertEqual(get_tenant(self.tenant.id).stripe_secret_key, 'sk_test_rotated')
+        self.assertIsNone(get_tenant(None).id)
+
+    def test_idempotency_key_lookups_are_scoped_to_the_tenant(self):
+        fields = {
+            'payable_type': 'booking', 'payable_id': '1', 'amount_pence': 1000,
+            'success_url': 'https://example.com/success', 'cancel_url': 'https://example.com/cancel',
+            'idempotency_key': 'same-key',
+        }
+        default_session = PaymentSession.objects.create(**fields)
+        acme_session = PaymentSession.objects.create(tenant=self.tenant, **fields)
+
+        self.assertEqual(list(PaymentSession.objects.with_keys(['same-key'])), [default_session])
+        self.assertEqual(list(PaymentSession.objects.with_keys(['same-key'], self.tenant.id)), [acme_session])
+
+    def test_cache_is_bounded(self):
+        cache = TenantCache(maxsize=2, ttl=60)
+        for n in range(3):
+            cache.get(('id', n), lambda: TenantConfig(n, f't{n}', f'sk_{n}', '', True))
+
+        self.assertEqual(cache.get(('id', 0), lambda: None), None)
+        self.assertEqual(cache.get(('slug', 't2'), lambda: None).stripe_secret_key, 'sk_2')
+
+
+class BillingRunTest(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.charges = []
+        for n in range(3):
+            customer = Customer.objects.create(
+                email=f'member{n}@example.com', provider_customer_id=f'cus_{n}', default_payment_method_id=f'pm_{n}',
+            )
+            self.charges.append(RecurringCharge.objects.create(
+                customer=customer, payable_type='membership', payable_id=str(n), amount_pence=3000,
+                next_charge_on=self.today - timedelta(days=n),
+            ))
+        self.no_card = RecurringCharge.objects.create(
+            customer=Customer.objects.create(email='nocard@example.com', provider_customer_id='cus_none'),
+            payable_type='membership', payable_id='nocard', amount_pence=3000, next_charge_on=self.today,
+        )
+        self.not_due = RecurringCharge.objects.create(
+            customer=self.charges[0].customer, payable_type='membership', payable_id='later', amount_pence=3000,
+            next_charge_on=self.today + timedelta(days=1),
+        )
+
+    @patch('payments.billing.stripe.PaymentIntent.create')
+    def test_charges_the_due_cohort(self, mock_create):
+        import stripe
+
+        def create(**params):
+            if params['customer'] == 'cus_1':
+                raise stripe.error.CardError('Your card was declined.', None, 'card_declined', json_body={
+                    'error': {'message': 'Your card was declined.',
+                              'payment_intent': {'id': 'pi_declined', 'status': 'requires_payment_method'}},
+                })
+            return {'id': f"pi_{params['customer']}", 'status': 'succeeded'}
+
+        mock_create.side_effect = create
+
+        summary = run_billing(batch_size=2)
+
+        self.assertEqual(
+            {key: summary[key] for key in ('due', 'succeeded', 'declined', 'errors', 'batches')},
+            {'due': 4, 'succeeded': 2, 'declined': 2, 'errors': 0, 'batches': 2},
+        )
+        self.assertEqual(len(summary['failures']), 2)
+        self.assertTrue(all(call.kwargs['off_session'] and call.kwargs['confirm'] for call in mock_create.call_args_list))
+        self.assertEqual(
+            sorted(call.kwargs['idempotency_key'] for call in mock_create.call_args_list),
+            sorted(f'nbne-billing-{charge.id}-{charge.next_charge_on}' for charge in self.charges),
+        )
+
+        paid = PaymentSession.objects.get(stripe_payment_intent_id='pi_cus_0')
+        self.assertEqual(paid.status, 'succeeded')
+        self.assertEqual(paid.transactions.get().gross_amount_pence, 3000)
+        self.assertEqual(list(paid.events.values_list('to_status', flat=True)), ['created', 'succeeded'])
+        self.assertEqual(PaymentSession.objects.get(stripe_payment_intent_id='pi_declined').status, 'failed')
+
+        charged, declined = RecurringCharge.objects.get(id=self.charges[0].id), RecurringCharge.objects.get(id=self.charges[1].id)
+        self.assertEqual(charged.last_charged_on, self.today)
+        self.assertEqual(charged.next_charge_on, add_months(self.today, 1, self.today.day))
+        self.assertEqual((declined.failure_count, declined.next_charge_on), (1, self.today + timedelta(days=3)))
+        self.no_card.refresh_from_db()
+        self.assertEqual((self.no_card.failure_count, self.no_card.last_error), (1, 'No saved payment method'))
+        self.assertFalse(PaymentSession.objects.filter(payable_id__in=['nocard', 'later']).exists())
+
+    @patch('payments.billing.stripe.PaymentIntent.create')
+    def test_rerun_after_stripe_errors_reuses_sessions_and_keys(self, mock_create):
+        import stripe
+        mock_create.side_effect = stripe.error.APIConnectionError('Network down')
+
+        summary = run_billing()
+        self.assertEqual(summary['errors'], 3)
+        self.assertEqual(RecurringCharge.objects.filter(next_charge_on__lte=self.today, failure_count=0).count(), 3)
+        first_keys = sorted(call.kwargs['idempotency_key'] for call in mock_create.call_args_list)
+
+        mock_create.reset_mock()
+        mock_create.side_effect = lambda **params: {'id': f"pi_{params['customer']}", 'status': 'processing'}
+        summary = run_billing()
+
+        self.assertEqual(summary['pending'], 3)
+        self.assertEqual(sorted(call.kwargs['idempotency_key'] for call in mock_create.call_args_list), first_keys)
+        self.assertEqual(PaymentSession.objects.filter(payable_type='membership').count(), 3)
+        self.assertEqual(set(PaymentSession.objects.values_list('status', flat=True)), {'pending'})
+
+    @patch('payments.billing.stripe.PaymentIntent.cancel')
+    @patch('payments.billing.stripe.PaymentIntent.create')
+    def test_non_terminal_intents_are_canceled_when_booked_as_failed(self, mock_create, mock_cancel):
+        mock_create.side_effect = lambda **params: {'id': f"pi_{params['customer']}", 'status': 'requires_action'}
+
+        summary = run_billing()
+
+        self.assertEqual(summary['declined'], 4)
+        self.assertEqual(
+            sorted(call.args[0] for call in mock_cancel.call_args_list), ['pi_cus_0', 'pi_cus_1', 'pi_cus_2'],
+        )
+        self.assertEqual(PaymentSession.objects.get(stripe_payment_intent_id='pi_cus_0').status, 'failed')
+
+    @patch('payments.billing.stripe.PaymentIntent.create')
+    def test_past_due_after_repeated_declines(self, mock_create):
+        mock_create.return_value = {'id': 'pi_ok', 'status': 'succeeded'}
+        with self.settings(PAYMENTS_BILLING_MAX_FAILURES=1):
+            run_billing(as_of=self.today)
+        self.no_card.refresh_from_db()
+        self.assertEqual(self.no_card.status, 'past_due')
+
+    def test_months_keep_their_anchor_day(self):
+        from datetime import date
+        self.assertEqual(add_months(date(2026, 1, 31), 1, 31), date(2026, 2, 28))
+        self.assertEqual(add_months(date(2026, 2, 28), 1, 31), date(2026, 3, 31))
+        self.assertEqual(add_months(date(2026, 11, 15), 3, 15), date(2027, 2, 15))
+
+    def test_payment_method_saved_from_checkout(self):
+        customer = self.no_card.customer
+        handle_payment_intent_succeeded(
+            {'id': 'pi_setup', 'customer': 'cus_none', 'payment_method': 'pm_saved', 'setup_future_usage': 'off_session'},
+            'evt_setup',
+        )
+        customer.refresh_from_db()
+        self.assertEqual(customer.default_payment_method_id, 'pm_saved')
+
+
+class CartCheckoutTest(TestCase):
+    def setUp(self):
+        self.cart = {
+            'items': [
+                {'payable_type': 'booking', 'payable_id': 1, 'amount_pence': 2500, 'name': 'Cut and finish'},
+                {'payable_type': 'booking', 'payable_id': 2, 'amount_pence': 1500},
+                {'payable_type': 'voucher', 'payable_id': 'v-9', 'amount_pence': 1000},
+            ],
+            'currency': 'GBP',
+            'success_url': 'https://example.com/success',
+            'cancel_url': 'https://example.com/cancel',
+            'idempotency_key': 'cart-1',
+        }
+        self.events = []
+        self.subscriber = lambda events: self.events.extend(events)
+        register_payment_subscriber('voucher', self.subscriber)
+
+    def tearDown(self):
+        unregister_payment_subscriber('voucher', self.subscriber)
+
+    def post(self, body):
+        return self.client.post('/api/payments/checkout/cart/', data=json.dumps(body), content_type='application/json')
+
+    @patch('payments.views.stripe.checkout.Session.create')
+    def test_one_stripe_session_for_many_payables(self, mock_session_create):
+        mock_session_create.return_value = MagicMock(id='cs_cart', url='https://checkout.stripe.com/cart', payment_intent=None)
+
+        response = self.post(self.cart)
+
+        self.assertEqual(response.status_code, 200)
+        mock_session_create.assert_called_once()
+        line_items = mock_session_create.call_args.kwargs['line_items']
+        self.assertEqual([item['price_data']['unit_amount'] for item in line_items], [2500, 1500, 1000])
+        self.assertEqual(line_items[0]['price_data']['product_data']['name'], 'Cut and finish')
+
+        payment_session = PaymentSession.objects.get(id=response.json()['payment_session_id'])
+        self.assertEqual((payment_session.payable_type, payment_session.amount_pence), ('cart', 5000))
+        self.assertEqual(
+            list(payment_session.items.values_list('payable_type', 'payable_id', 'status')),
+            [('booking', '1', 'pending'), ('booking', '2', 'pending'), ('voucher', 'v-9', 'pending')],
+        )
+
+    def test_invalid_carts_are_rejected(self):
+        for items in ([], [{'payable_type': 'booking', 'payable_id': 1}],
+                      [{'payable_type': 'booking', 'payable_id': 1, 'amount_pence': 100}] * 2,
+                      [{'payable_type': 'cart', 'payable_id': 1, 'amount_pence': 100}]):
+            self.assertEqual(self.post({**self.cart, 'items': items}).status_code, 400)
+        single = {**self.cart, 'payable_type': 'cart', 'payable_id': 'x', 'amount_pence': 100}
+        response = self.client.post('/api/payments/checkout/', data=json.dumps(single), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_webhook_status_fans_out_to_every_item(self):
+        payment_session = PaymentSession.objects.create(
+            payable_type='cart', payable_id='cart-1', amount_pence=3500, status='pending',
+            success_url='https://example.com/success', cancel_url='https://example.com/cancel',
+            idempotency_key='cart-1', stripe_checkout_session_id='cs_cart',
+        )
+        PaymentSessionItem.objects.bulk_create([
+            PaymentSessionItem(payment_session=payment_session, payable_type='voucher', payable_id=str(n), amount_pence=1000 + n)
+            for n in range(3)
+        ])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                handle_checkout_completed({'id': 'cs_cart', 'payment_intent': 'pi_cart'}, 'evt_cart')
+
+        item_updates = [q['sql'] for q in queries.captured_queries
+                        if q['sql'].startswith('UPDATE') and 'payments_session_item' in q['sql']]
+        self.assertEqual(len(item_updates), 1)
+        self.assertEqual(set(payment_session.items.values_list('status', flat=True)), {'succeeded'})
+        self.assertEqual(
+            sorted((event['payable_id'], event['status']) for event in self.events),
+            [('0', 'succeeded'), ('1', 'succeeded'), ('2', 'succeeded')],
+        )
+
+
+class CataloguePriceTest(TestCase):
+    @patch('payments.views.stripe.checkout.Session.create')
+    def test_catalogue_price_replaces_price_data_for_internal_callers_only(self, mock_session_create):
+        from .views import create_checkout_session_internal
+
+        mock_session_create.side_effect = [
+            MagicMock(id=f'cs_price_{n}', url='https://checkout.stripe.com/p', payment_intent=None) for n in range(2)
+        ]
+        data = {
+            'payable_type': 'booking', 'payable_id': '1', 'amount_pence': 1000, 'stripe_price_id': 'price_cut',
+            'success_url': 'https://example.com/success', 'cancel_url': 'https://example.com/cancel',
+        }
+
+        create_checkout_session_internal({**data, 'idempotency_key': 'price-1'})
+        self.assertEqual(mock_session_create.call_args.kwargs['line_items'], [{'price': 'price_cut', 'quantity': 1}])
+
+        self.client.post('/api/payments/checkout/', data=json.dumps({**data, 'idempotency_key': 'price-2'}),
+                         content_type='application/json')
+        self.assertEqual(mock_session_create.call_args.kwargs['line_items'][0]['price_data']['unit_amount'], 1000)
+
+    @patch('payments.catalogue.stripe.Price.modify')
+    @patch('payments.catalogue.stripe.Price.create')
+    @patch('payments.catalogue.stripe.Product.create')
+    def test_new_price_archives_the_old_one(self, mock_product_create, mock_price_create, mock_price_modify):
+        from .catalogue import sync_price, sync_product
+
+        mock_product_create.return_value = MagicMock(id='prod_1')
+        mock_price_create.return_value = MagicMock(id='price_2')
+
+        self.assertEqual(sync_product('service-1', 'Cut'), 'prod_1')
+        self.assertEqual(sync_price('service-1', 'prod_1', 1500, 'GBP', old_price_id='price_1'), 'price_2')
+        self.assertEqual(mock_price_create.call_args.kwargs['unit_amount'], 1500)
+        self.assertEqual(mock_price_create.call_args.kwargs['currency'], 'gbp')
+        mock_price_modify.assert_called_once()
+        self.assertEqual(mock_price_modify.call_args.args, ('price_1',))
+        self.assertEqual(mock_price_modify.call_args.kwargs['active'], False)
+
+
+class StripeRateLimiterTest(TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        os.unlink(self.path)
+        self.addCleanup(lambda: os.path.exists(self.path) and os.unlink(self.path))
+
+    def test_each_tenant_has_its_own_bucket(self):
+        for tenant_id in (1, 2):
+            self.addCleanup(lambda path=f'{self.path}.{tenant_id}': os.path.exists(path) and os.unlink(path))
+
+        with override_settings(PAYMENTS_STRIPE_RATE_LIMIT_BACKEND='file', PAYMENTS_STRIPE_RATE_LIMIT_PATH=self.path,
+                               PAYMENTS_STRIPE_RATE_PER_SECOND=0.001, PAYMENTS_STRIPE_RATE_BURST=2), \
+                patch.dict('payments.stripe_api._limiters', clear=True):
+            busy = get_stripe_limiter(1)
+            self.assertIs(get_stripe_limiter(1), busy)
+            self.assertEqual([busy.try_acquire(), busy.try_acquire()], [0.0, 0.0])
+            self.assertGreater(busy.try_acquire(), 0)
+            self.assertEqual(get_stripe_limiter(2).try_acquire(), 0.0)
+            self.assertEqual(get_stripe_limiter().try_acquire(), 0.0)
+
+    def test_file_bucket_is_shared_between_instances(self):
+        worker_a = FileTokenBucket(self.path, rate=1000, capacity=3)
+        worker_b = FileTokenBucket(self.path, rate=1000, capacity=3)
+
+        with patch('payments.ratelimit.time.time', return_value=1000.0), \
+                patch('payments.ratelimit.time.sleep') as mock_sleep:
+            mock_sleep.side_effect = lambda delay: None
+            worker_a.acquire()
+            worker_b.acquire()
+            worker_a.acquire()
+            with worker_b.state() as state:
+                self.assertAlmostEqual(state['tokens'], 0)
+
+    def test_background_priority_leaves_headroom_for_interactive(self):
+        bucket = MemoryTokenBucket(rate=1, capacity=5, background_reserve=0.4)
+        clock = [0.0]
+        sleeps = []
+
+        def sleep(delay):
+            sleeps.append(delay)
+            clock[0] += delay
+
+        with patch('payments.ratelimit.time.time', side_effect=lambda: clock[0]), \
+                patch('payments.ratelimit.time.sleep', side_effect=sleep):
+            bucket._state['updated'] = 0.0
+            for _ in range(3):
+                bucket.acquire(priority=BACKGROUND)
+            self.assertEqual(sleeps, [])
+
+            bucket.acquire(priority=BACKGROUND)
+            self.assertEqual(len(sleeps), 1)
+
+            bucket.acquire(priority=INTERACTIVE)
+            bucket.acquire(priority=INTERACTIVE)
+
+        metrics = bucket.metrics()
+        self.assertEqual(metrics[BACKGROUND]['calls'], 4)
+        self.assertEqual(metrics[BACKGROUND]['waited_calls'], 1)
+        self.assertEqual(metrics[INTERACTIVE]['calls'], 2)
+        self.assertEqual(metrics[INTERACTIVE]['waited_calls'], 0)
+
+    @patch('payments.views.stripe.checkout.Session.create')
+    def test_checkout_goes_through_limiter(self, mock_session_create):
+        mock_session_create.return_value = MagicMock(id='cs_rl', url='https://checkout.stripe.com/rl', payment_intent=None)
+        limiter = MagicMock()
+        with patch('payments.stripe_api.get_stripe_limiter', return_value=limiter):
+            self.client.post('/api/payments/checkout/', data=json.dumps({
+                'payable_type': 'booking',
+                'payable_id': '1',
+                'amount_pence': 1000,
+                'success_url': 'https://example.com/success',
+                'cancel_url': 'https://example.com/cancel',
+                'idempotency_key': 'rate-limited-key',
+            }), content_type='application/json')
+
+        limiter.acquire.assert_called_once_with(priority=INTERACTIVE)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttle-tests'}},
+    PAYMENTS_THROTTLE_CACHE='default',
+    PAYMENTS_THROTTLE_RATES={'checkout': '2/minute', 'booking': '1/hour'},
+)
+class ThrottleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def post(self, path='/api/payments/checkout/', **extra):
+        return self.client.post(path, data='{}', content_type='application/json', **extra)
+
+    def test_client_over_quota_gets_429_with_retry_after(self):
+        self.assertEqual([self.post().status_code for _ in range(3)], [400, 400, 429])
+
+        response = self.post()
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 60)
+        self.assertEqual(self.post(REMOTE_ADDR='10.0.0.2').status_code, 400)
+        self.assertEqual(self.post('/api/bookings/').status_code, 400)
+        self.assertEqual(self.post('/api/bookings/').status_code, 429)
+
+        stdout = StringIO()
+        call_command('throttle_stats', '--reset', stdout=stdout)
+        self.assertIn('checkout (2/minute): 2 throttled', stdout.getvalue())
+        self.assertIn('booking (1/hour): 1 throttled', stdout.getvalue())
+
+    def test_parallel_burst_cannot_exceed_the_limit(self):
+        counter = CacheWindowCounter('throttle:test', cache, 5, 60)
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            waits = list(pool.map(lambda _: counter.try_acquire(), range(20)))
+        self.assertEqual(waits.count(0), 5)
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        for spoofed in ('10.9.9.1', '10.9.9.2'):
+            self.assertEqual(self.post(HTTP_X_FORWARDED_FOR=spoofed).status_code, 400)
+        self.assertEqual(self.post(HTTP_X_FORWARDED_FOR='10.9.9.3').status_code, 429)
+
+    @override_settings(PAYMENTS_THROTTLE_NUM_PROXIES=1)
+    def test_client_ip_is_read_behind_a_proxy(self):
+        # The proxy appends the address it saw; anything before that is client-supplied.
+        for spoofed in ('10.9.9.1', '10.9.9.2'):
+            self.post(HTTP_X_FORWARDED_FOR=f'{spoofed}, 203.0.113.9')
+        self.assertEqual(self.post(HTTP_X_FORWARDED_FOR='10.9.9.3, 203.0.113.9').status_code, 429)
+        self.assertEqual(self.post(HTTP_X_FORWARDED_FOR='203.0.113.9, 198.51.100.4').status_code, 400)
+
+    @override_settings(PAYMENTS_THROTTLE_CACHE='missing')
+    def test_database_buckets_when_the_cache_is_unavailable(self):
+        with self.assertLogs('payments.throttling', 'WARNING'):
+            statuses = [self.post().status_code for _ in range(3)]
+        self.assertEqual(statuses, [400, 400, 429])
+        self.assertTrue(RateLimitBucket.objects.filter(name='throttle:checkout:ip:127.0.0.1').exists())
+
+        RateLimitBucket.objects.update(updated=time.time() - 3600)
+        call_command('sweep_stale_sessions', stdout=StringIO())
+        self.assertFalse(RateLimitBucket.objects.filter(name__startswith='throttle:').exists())
+
+
+class ServerTimingTest(TestCase):
+    checkout_payload = {
+        'payable_type': 'booking',
+        'payable_id': '1',
+        'amount_pence': 1000,
+        'customer': {'email': 'timing@example.com'},
+        'success_url': 'https://example.com/success',
+        'cancel_url': 'https://example.com/cancel',
+        'idempotency_key': 'timing-key',
+    }
+
+    @patch('payments.views.stripe.checkout.Session.create')
+    @patch('payments.views.stripe.Customer.create')
+    def test_checkout_reports_sql_and_stripe_time(self, mock_customer_create, mock_session_create):
+        mock_customer_create.return_value = MagicMock(id='cus_timing')
+        mock_session_create.return_value = MagicMock(id='cs_timing', url='https://checkout.stripe.com/t', payment_intent=None)
+
+        with self.assertLogs('payments.timing', level='INFO') as logs:
+            response = self.client.post(
+                '/api/payments/checkout/', data=json.dumps(self.checkout_payload), content_type='application/json'
+            )
+
+        header = response['Server-Timing']
+        self.assertIn('db;dur=', header)
+        self.assertIn('stripe;dur=', header)
+        self.assertIn('total;dur=', header)
+        self.assertIn('stripe_count=2', logs.output[0])
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_have_no_header(self):
+        response = self.client.get('/api/payments/status/999/')
+        self.assertNotIn('Server-Timing', response)
+
+    async def test_asgi_requests_are_timed(self):
+        response = await self.async_client.get('/api/payments/status/999/')
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(PAYMENTS_WEBHOOK_CALLBACK_URL='https://example.com/hook')
+    @patch('payments.callbacks.requests.post')
+    def test_outbound_callback_time_recorded(self, mock_post):
+        timings, token = timing.begin()
+        try:
+            post_callback({'status': 'succeeded'})
+        finally:
+            timing.end(token)
+        self.assertEqual(timings.counts, {'callback': 1})
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class SlowProfileTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        overrides = override_settings(
+            PROFILER_ENABLED=True, PROFILER_THRESHOLD_MS=30, PROFILER_INTERVAL_MS=1, PROFILER_DIR=self.directory,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_slow_block_is_captured_and_summarised(self):
+        with profile_if_slow('webhook', {'event_type': 'charge.refunded'}):
+            busy_wait(0.1)
+
+        captures = os.listdir(self.directory)
+        self.assertEqual(len(captures), 1)
+        with open(os.path.join(self.directory, captures[0])) as f:
+            capture = json.load(f)
+        self.assertEqual(capture['metadata'], {'event_type': 'charge.refunded'})
+
+        out = StringIO()
+        call_command('profile_summary', dir=self.directory, stdout=out)
+        self.assertIn('(busy_wait)', out.getvalue())
+
+    def test_nested_profiles_each_keep_their_samples(self):
+        with profile_if_slow('request'):
+            with profile_if_slow('webhook'):
+                busy_wait(0.05)
+            busy_wait(0.05)
+
+        kinds = {}
+        for name in os.listdir(self.directory):
+            with open(os.path.join(self.directory, name)) as f:
+                capture = json.load(f)
+            kinds[capture['kind']] = sum(capture['stacks'].values())
+        self.assertEqual(set(kinds), {'request', 'webhook'})
+        self.assertGreater(kinds['request'], kinds['webhook'])
+
+    def test_fast_block_is_discarded(self):
+        with profile_if_slow('request'):
+            pass
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @override_settings(PROFILER_THRESHOLD_MS=0, PROFILER_MAX_CAPTURES=2)
+    def test_capture_directory_is_rotated(self):
+        for _ in range(4):
+            with profile_if_slow('request'):
+                busy_wait(0.01)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+
+class ColdStartTest(TestCase):
+    def test_lazy_module_imports_on_first_use(self):
+        loaded = []
+        lazy_json = LazyModule('json', on_load=loaded.append)
+        self.assertEqual(loaded, [])
+        self.assertEqual(lazy_json.dumps([1]), '[1]')
+        lazy_json.loads('[]')
+        self.assertEqual(loaded, [json])
+
+    @patch('payments.management.commands.boot.call_command')
+    def test_boot_skips_unchanged_static_and_applied_migrations(self, mock_call_command):
+        static_root = tempfile.mkdtemp()
+        with override_settings(STATIC_ROOT=static_root):
+            call_command('boot', stdout=StringIO())
+            commands = [c.args[0] for c in mock_call_command.call_args_list]
+            self.assertEqual(commands, ['collectstatic', 'ensure_superuser'])
+
+            open(os.path.join(static_root, 'staticfiles.json'), 'w').close()
+            mock_call_command.reset_mock()
+            call_command('boot', stdout=StringIO())
+            commands = [c.args[0] for c in mock_call_command.call_args_list]
+            self.assertEqual(commands, ['ensure_superuser'])
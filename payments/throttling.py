@@ -0,0 +1,125 @@
+"""Inbound throttling for the public checkout and booking endpoints.
+
+``@throttle('checkout')`` limits each client of a route to
+``PAYMENTS_THROTTLE_RATES[route]`` (``'<requests>/<second|minute|hour|day>'``).
+Logged-in users are told apart by user id, everyone else by IP address.
+
+With ``PAYMENTS_THROTTLE_BACKEND=cache`` (the default) each client has a
+fixed-window counter in the ``PAYMENTS_THROTTLE_CACHE`` cache (one atomic
+``add``/``incr`` per request): Redis, or each process's memory without it.
+With ``database`` it has a token bucket in a ``RateLimitBucket`` row: a burst
+of that many requests, refilled evenly over the period. If the cache is
+unreachable, that request is counted in the database instead; the sweeper
+deletes idle buckets. A client over quota gets a 429 with ``Retry-After``
+before the view runs. Rejections are counted per route in the default cache
+(``manage.py throttle_stats``).
+"""
+import logging
+import math
+import time
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+from .fastjson import JsonResponse
+from .ratelimit import CacheWindowCounter, DatabaseTokenBucket
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+NAME_PREFIX = 'throttle:'
+
+_cache_failed_at = 0.0
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """``'20/minute'`` -> ``(20, 60)``."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period.strip()[0]]
+
+
+def client_id(request):
+    """``user:<id>`` for logged-in users, else ``ip:<address>``.
+
+    Behind ``PAYMENTS_THROTTLE_NUM_PROXIES`` trusted proxies the address is
+    read from ``X-Forwarded-For``, counting that many hops from the right.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    num_proxies = settings.PAYMENTS_THROTTLE_NUM_PROXIES
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if num_proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(',')]
+        return f'ip:{addresses[-min(num_proxies, len(addresses))]}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def take_token(route, client, rate):
+    """Count a request by ``client`` to ``route``. Returns 0, or seconds to wait."""
+    global _cache_failed_at
+    count, seconds = parse_rate(rate)
+    name = f'{NAME_PREFIX}{route}:{client}'
+    if settings.PAYMENTS_THROTTLE_BACKEND == 'cache':
+        try:
+            return CacheWindowCounter(name, caches[settings.PAYMENTS_THROTTLE_CACHE], count, seconds).try_acquire()
+        except Exception:
+            # Log once a minute, not on every request of an outage.
+            if time.monotonic() - _cache_failed_at > 60:
+                _cache_failed_at = time.monotonic()
+                logger.warning('Throttle cache unavailable; keeping buckets in the database', exc_info=True)
+    return DatabaseTokenBucket(
+        name, settings.PAYMENTS_THROTTLE_DB_ALIAS, rate=count / seconds, capacity=count, background_reserve=0,
+    ).try_acquire()
+
+
+def _count_key(route):
+    return f'{NAME_PREFIX}throttled:{route}'
+
+
+def count_throttled(route):
+    try:
+        cache.add(_count_key(route), 0, None)
+        cache.incr(_count_key(route))
+    except Exception:
+        pass
+
+
+def throttled_counts():
+    """Rejected requests per route since the counters were last reset."""
+    return {route: cache.get(_count_key(route), 0) for route in settings.PAYMENTS_THROTTLE_RATES}
+
+
+def reset_throttled_counts():
+    cache.delete_many([_count_key(route) for route in settings.PAYMENTS_THROTTLE_RATES])
+
+
+def purge_idle_buckets():
+    """Delete database buckets that have refilled since their last request. Returns the number deleted."""
+    from .models import RateLimitBucket
+
+    longest = max((parse_rate(rate)[1] for rate in settings.PAYMENTS_THROTTLE_RATES.values() if rate), default=0)
+    return RateLimitBucket.objects.using(settings.PAYMENTS_THROTTLE_DB_ALIAS).filter(
+        name__startswith=NAME_PREFIX, updated__lt=time.time() - longest,
+    ).delete()[0]
+
+
+def throttle(route):
+    """Reject a client's requests to the decorated view beyond ``PAYMENTS_THROTTLE_RATES[route]``."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            rate = settings.PAYMENTS_THROTTLE_RATES.get(route)
+            if settings.PAYMENTS_THROTTLE_ENABLED and rate:
+                wait = take_token(route, client_id(request), rate)
+                if wait:
+                    count_throttled(route)
+                    retry_after = max(1, math.ceil(wait))
+                    response = JsonResponse({'error': 'Too many requests', 'retry_after': retry_after}, status=429)
+                    response['Retry-After'] = str(retry_after)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
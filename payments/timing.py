@@ -0,0 +1,71 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar('payments_request_timings', default=None)
+
+
+class RequestTimings:
+    """Call counts and cumulative seconds per component for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = {}
+        self.seconds = {}
+
+    def add(self, name, seconds):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+    def server_timing_header(self):
+        parts = [
+            f'{name};dur={self.seconds[name] * 1000:.1f};desc="{self.counts[name]} calls"'
+            for name in sorted(self.seconds)
+        ]
+        parts.append(f'total;dur={self.total_seconds() * 1000:.1f}')
+        return ', '.join(parts)
+
+    def log_fields(self):
+        fields = {'total_ms': round(self.total_seconds() * 1000, 1)}
+        for name in sorted(self.seconds):
+            fields[f'{name}_count'] = self.counts[name]
+            fields[f'{name}_ms'] = round(self.seconds[name] * 1000, 1)
+        return fields
+
+
+def begin():
+    """Start collecting for the current request/task. Returns a token for ``end()``."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to ``name`` if a request is being timed."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def sql_execute_wrapper(execute, sql, params, many, context):
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+def install_sql_timing(sender, connection, **kwargs):
+    """``connection_created`` receiver: time every query run on ``connection``."""
+    if sql_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_execute_wrapper)
@@ -3,6 +3,8 @@ from . import views
 
 urlpatterns = [
     path('checkout/', views.create_checkout_session, name='create_checkout_session'),
+    path('checkout/cart/', views.create_cart_checkout_session, name='create_cart_checkout_session'),
     path('webhook/stripe/', views.stripe_webhook, name='stripe_webhook'),
+    path('webhook/stripe/<slug:tenant>/', views.stripe_webhook, name='tenant_stripe_webhook'),
     path('status/<int:payment_session_id>/', views.get_payment_status, name='get_payment_status'),
 ]
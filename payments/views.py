@@ -1,23 +1,59 @@
-import json
-import stripe
-import requests
 from django.conf import settings
-from django.http import JsonResponse, HttpResponse
+from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.db import transaction
-from .models import Customer, PaymentSession, Transaction, Refund
-
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from .models import (
+    CART_PAYABLE_TYPE, Customer, ParkedEvent, PaymentSession, PaymentSessionItem, Tenant, Transaction, Refund,
+)
+from .callbacks import checkout_created, trigger_callback
+from .profiling import profile_if_slow
+from .fastjson import JSONDecodeError, JsonResponse, ResponseShape, loads
+from .stripe_api import StripeEvent, call_stripe, construct_webhook_event, stripe
+from .tenants import get_tenant_by_slug
+from .throttling import throttle
+
+PAYMENT_STATUS_SHAPE = ResponseShape(
+    payment_session_id=('id', str),
+    payable_type='payable_type',
+    payable_id='payable_id',
+    status='status',
+    amount_pence='amount_pence',
+    currency='currency',
+)
+
+
+# Stripe accepts at most 100 line items per Checkout Session in payment mode.
+MAX_CART_ITEMS = 100
+
+
+def line_item(payable_type, payable_id, amount_pence, currency, name=None, price_id=None):
+    """A Checkout line item: the catalogue Price ``price_id`` if given, else ad-hoc ``price_data``."""
+    if price_id:
+        return {'price': price_id, 'quantity': 1}
+    return {
+        'price_data': {
+            'currency': currency.lower(),
+            'unit_amount': amount_pence,
+            'product_data': {
+                'name': name or f'{payable_type.title()} Payment',
+                'description': f'Payment for {payable_type} #{payable_id}',
+            },
+        },
+        'quantity': 1,
+    }
 
 
-def create_checkout_session_internal(data):
+def create_checkout_session_internal(data, items=None):
     """Create a Stripe Checkout Session. Callable from Python (no HTTP needed).
     
     Args:
         data: dict with keys: payable_type, payable_id, amount_pence, currency,
-              success_url, cancel_url, idempotency_key, customer (dict), metadata (dict)
+              success_url, cancel_url, idempotency_key, customer (dict), metadata (dict),
+              tenant (slug; optional, defaults to the settings-configured account),
+              save_payment_method (bool; keep the card for off-session charges, needs customer),
+              stripe_price_id (optional; a Price synced with ``payments.catalogue`` for
+              amount_pence, sent instead of ad-hoc price_data)
     
     Returns:
         dict with keys: checkout_url, payment_session_id, status
@@ -45,8 +81,20 @@ def create_checkout_session_internal(data):
     if amount_pence < 0:
         raise ValueError('Amount must be >= 0')
 
+    if payable_type == CART_PAYABLE_TYPE and items is None:
+        raise ValueError('Use create_cart_checkout_session_internal for carts')
+
+    save_payment_method = bool(data.get('save_payment_method'))
+    if save_payment_method and not (customer_data or {}).get('email'):
+        raise ValueError('save_payment_method requires a customer email')
+
+    try:
+        tenant_id = get_tenant_by_slug(data.get('tenant')).id
+    except Tenant.DoesNotExist:
+        raise ValueError(f"Unknown tenant: {data.get('tenant')}")
+
     with transaction.atomic():
-        existing_session = PaymentSession.objects.filter(idempotency_key=idempotency_key).first()
+        existing_session = PaymentSession.objects.with_keys([idempotency_key], tenant_id).first()
         if existing_session:
             checkout_url = f"https://checkout.stripe.com/c/pay/{existing_session.stripe_checkout_session_id}" if existing_session.stripe_checkout_session_id else None
             return {
@@ -57,27 +105,32 @@ def create_checkout_session_internal(data):
 
         customer = None
         if customer_data and customer_data.get('email'):
-            customer, created = Customer.objects.get_or_create(
-                email=customer_data['email'],
-                defaults={
-                    'name': customer_data.get('name', ''),
-                    'phone': customer_data.get('phone', ''),
-                }
+            customer = Customer.objects.upsert(
+                customer_data['email'],
+                name=customer_data.get('name', ''),
+                phone=customer_data.get('phone', ''),
+                tenant_id=tenant_id,
             )
 
             if not customer.provider_customer_id:
                 try:
-                    stripe_customer = stripe.Customer.create(
+                    stripe_customer = call_stripe(
+                        stripe.Customer.create,
                         email=customer.email,
                         name=customer.name,
                         phone=customer.phone,
+                        idempotency_key=f"nbne-customer-{customer.id}",
+                        tenant_id=tenant_id,
                     )
                     customer.provider_customer_id = stripe_customer.id
-                    customer.save(update_fields=['provider_customer_id'])
+                    Customer.objects.filter(
+                        id=customer.id, provider_customer_id__isnull=True
+                    ).update(provider_customer_id=stripe_customer.id)
                 except stripe.error.StripeError as e:
                     pass
 
         payment_session = PaymentSession.objects.create(
+            tenant_id=tenant_id,
             payable_type=payable_type,
             payable_id=str(payable_id),
             amount_pence=amount_pence,
@@ -89,6 +142,24 @@ def create_checkout_session_internal(data):
             metadata=metadata,
             idempotency_key=idempotency_key,
         )
+        if items:
+            PaymentSessionItem.objects.bulk_create(
+                PaymentSessionItem(
+                    payment_session=payment_session,
+                    payable_type=item['payable_type'],
+                    payable_id=str(item['payable_id']),
+                    amount_pence=item['amount_pence'],
+                    name=item.get('name') or '',
+                )
+                for item in items
+            )
+            line_items = [
+                line_item(item['payable_type'], item['payable_id'], item['amount_pence'], currency, item.get('name'),
+                          item.get('stripe_price_id'))
+                for item in items
+            ]
+        else:
+            line_items = [line_item(payable_type, payable_id, amount_pence, currency, price_id=data.get('stripe_price_id'))]
 
         checkout_metadata = {
             'payable_type': payable_type,
@@ -99,17 +170,7 @@ def create_checkout_session_internal(data):
 
         stripe_session_params = {
             'payment_method_types': ['card'],
-            'line_items': [{
-                'price_data': {
-                    'currency': currency.lower(),
-                    'unit_amount': amount_pence,
-                    'product_data': {
-                        'name': f'{payable_type.title()} Payment',
-                        'description': f'Payment for {payable_type} #{payable_id}',
-                    },
-                },
-                'quantity': 1,
-            }],
+            'line_items': line_items,
             'mode': 'payment',
             'success_url': success_url,
             'cancel_url': cancel_url,
@@ -118,13 +179,27 @@ def create_checkout_session_internal(data):
 
         if customer and customer.provider_customer_id:
             stripe_session_params['customer'] = customer.provider_customer_id
+        if save_payment_method:
+            # The card is stored in Stripe; payment_intent.succeeded records it on the customer.
+            stripe_session_params['payment_intent_data'] = {'setup_future_usage': 'off_session'}
 
-        checkout_session = stripe.checkout.Session.create(**stripe_session_params)
+        checkout_session = call_stripe(stripe.checkout.Session.create, tenant_id=tenant_id, **stripe_session_params)
 
-        payment_session.stripe_checkout_session_id = checkout_session.id
-        payment_session.stripe_payment_intent_id = checkout_session.payment_intent
+        PaymentSession.objects.filter(id=payment_session.id).transition(
+            'pending',
+            stripe_checkout_session_id=checkout_session.id,
+            stripe_payment_intent_id=checkout_session.payment_intent,
+        )
         payment_session.status = 'pending'
-        payment_session.save(update_fields=['stripe_checkout_session_id', 'stripe_payment_intent_id', 'status'])
+        replay_parked_events(
+            checkout_session_id=[checkout_session.id],
+            payment_intent_id=[checkout_session.payment_intent],
+            payment_session_id=[str(payment_session.id)],
+        )
+        checkout_created.send(
+            PaymentSession, payment_session=payment_session,
+            payables=[(item['payable_type'], str(item['payable_id'])) for item in items] if items else [(payable_type, str(payable_id))],
+        )
 
         return {
             'checkout_url': checkout_session.url,
@@ -133,6 +208,54 @@ def create_checkout_session_internal(data):
         }
 
 
+def create_cart_checkout_session_internal(data):
+    """Create one Stripe Checkout Session paying for several payables. Callable from Python.
+
+    Args:
+        data: as for ``create_checkout_session_internal`` but with ``items``
+              (a list of dicts with payable_type, payable_id, amount_pence and
+              an optional line item name and stripe_price_id) instead of
+              payable_type, payable_id and amount_pence
+
+    The session is recorded with ``payable_type`` ``"cart"`` (its
+    ``payable_id`` is the idempotency key) and one ``PaymentSessionItem``
+    per payable. Status changes reach every item, and consumers get one
+    callback per item.
+
+    Returns:
+        dict with keys: checkout_url, payment_session_id, status
+
+    Raises:
+        ValueError: if items are missing, duplicated or invalid
+        stripe.error.StripeError: if Stripe API call fails
+    """
+    items = data.get('items')
+    if not items or not isinstance(items, list):
+        raise ValueError('Missing required field: items')
+    if len(items) > MAX_CART_ITEMS:
+        raise ValueError(f'A cart can hold at most {MAX_CART_ITEMS} items')
+
+    seen = set()
+    for item in items:
+        if not isinstance(item, dict) or not all(item.get(key) is not None for key in ('payable_type', 'payable_id', 'amount_pence')):
+            raise ValueError('Each item needs payable_type, payable_id and amount_pence')
+        if item['payable_type'] == CART_PAYABLE_TYPE:
+            raise ValueError('Items cannot be carts')
+        if not isinstance(item['amount_pence'], int) or item['amount_pence'] < 0:
+            raise ValueError('Item amounts must be whole pence >= 0')
+        key = (item['payable_type'], str(item['payable_id']))
+        if key in seen:
+            raise ValueError(f'Duplicate item: {key[0]} #{key[1]}')
+        seen.add(key)
+
+    return create_checkout_session_internal({
+        **data,
+        'payable_type': CART_PAYABLE_TYPE,
+        'payable_id': data.get('idempotency_key'),
+        'amount_pence': sum(item['amount_pence'] for item in items),
+    }, items=items)
+
+
 def get_payment_status_internal(payment_session_id):
     """Get payment status. Callable from Python (no HTTP needed).
     
@@ -142,27 +265,25 @@ def get_payment_status_internal(payment_session_id):
     Raises:
         PaymentSession.DoesNotExist: if not found
     """
-    payment_session = PaymentSession.objects.get(id=payment_session_id)
-    return {
-        'payment_session_id': str(payment_session.id),
-        'payable_type': payment_session.payable_type,
-        'payable_id': payment_session.payable_id,
-        'status': payment_session.status,
-        'amount_pence': payment_session.amount_pence,
-        'currency': payment_session.currency,
-    }
+    return PAYMENT_STATUS_SHAPE.fetch(PaymentSession.objects.filter(id=payment_session_id))
 
 
-@csrf_exempt
-@require_http_methods(["POST"])
-def create_checkout_session(request):
+def _checkout_response(request, create):
     try:
-        data = json.loads(request.body)
-    except json.JSONDecodeError:
+        data = loads(request.body)
+    except JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
+    # Catalogue prices are for Python callers that priced the payment themselves;
+    # over HTTP nothing ties a client's price id to the amount recorded.
+    if isinstance(data, dict):
+        data.pop('stripe_price_id', None)
+        for item in data['items'] if isinstance(data.get('items'), list) else []:
+            if isinstance(item, dict):
+                item.pop('stripe_price_id', None)
+
     try:
-        result = create_checkout_session_internal(data)
+        result = create(data)
         return JsonResponse(result)
     except ValueError as e:
         return JsonResponse({'error': str(e)}, status=400)
@@ -172,207 +293,242 @@ def create_checkout_session(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def stripe_webhook(request):
+@throttle('checkout')
+def create_checkout_session(request):
+    return _checkout_response(request, create_checkout_session_internal)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@throttle('checkout')
+def create_cart_checkout_session(request):
+    return _checkout_response(request, create_cart_checkout_session_internal)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def stripe_webhook(request, tenant=None):
+    """Stripe webhook for the default account, or for ``tenant`` (slug) on its own endpoint."""
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
 
-    if not settings.STRIPE_WEBHOOK_SECRET:
+    try:
+        config = get_tenant_by_slug(tenant)
+    except Tenant.DoesNotExist:
+        return JsonResponse({'error': 'Unknown tenant'}, status=404)
+    webhook_secret = config.stripe_webhook_secret
+    if not webhook_secret:
         return JsonResponse({'error': 'Webhook secret not configured'}, status=500)
 
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
-        )
+        event = construct_webhook_event(payload, sig_header, webhook_secret)
     except ValueError:
         return JsonResponse({'error': 'Invalid payload'}, status=400)
     except stripe.error.SignatureVerificationError:
         return JsonResponse({'error': 'Invalid signature'}, status=400)
 
+    with profile_if_slow('webhook', {'event_id': event.id, 'event_type': event.type}):
+        handle_stripe_event(event, config.id)
+
+    return HttpResponse(status=200)
+
+
+def handle_stripe_event(event, tenant_id=None):
+    """Apply a Stripe event verified with ``tenant_id``'s secret, parking it if its payment session can't be found yet."""
+    if dispatch_stripe_event(event, tenant_id) is False:
+        ParkedEvent.park(event, tenant_id)
+        # A writer may have stored the missing key, committed and looked for
+        # parked events between our lookup and the park. Look again once the
+        # parked row is committed; the row lock stops a double replay.
+        replay_parked_events(**{key: [value] for key, value in ParkedEvent.correlation_keys(event).items()})
+
+
+def dispatch_stripe_event(event, tenant_id=None):
+    """Run the handler for ``event``.
+
+    Handlers only touch rows of ``tenant_id`` (``None``: the default
+    account), so one tenant's signed events cannot change another's payments.
+    Returns ``False`` if the objects the event refers to don't exist (yet),
+    ``True`` if they were found, and ``None`` for event types we ignore.
+    """
     event_id = event['id']
     event_type = event['type']
 
     if event_type == 'checkout.session.completed':
         session = event['data']['object']
-        handle_checkout_completed(session, event_id)
+        return handle_checkout_completed(session, event_id, tenant_id)
 
     elif event_type == 'payment_intent.succeeded':
         payment_intent = event['data']['object']
-        handle_payment_intent_succeeded(payment_intent, event_id)
+        return handle_payment_intent_succeeded(payment_intent, event_id, tenant_id)
 
     elif event_type == 'checkout.session.expired':
         session = event['data']['object']
-        handle_checkout_expired(session, event_id)
+        return handle_checkout_expired(session, event_id, tenant_id)
 
     elif event_type == 'payment_intent.payment_failed':
         payment_intent = event['data']['object']
-        handle_payment_failed(payment_intent, event_id)
+        return handle_payment_failed(payment_intent, event_id, tenant_id)
 
     elif event_type == 'charge.refunded':
         charge = event['data']['object']
-        handle_charge_refunded(charge, event_id)
-
-    return HttpResponse(status=200)
+        return handle_charge_refunded(charge, event_id, tenant_id)
 
 
-def handle_checkout_completed(session, event_id):
-    checkout_session_id = session['id']
-    payment_intent_id = session.get('payment_intent')
-
-    with transaction.atomic():
-        payment_session = PaymentSession.objects.filter(
-            stripe_checkout_session_id=checkout_session_id
-        ).select_for_update().first()
-
-        if not payment_session:
-            return
+def replay_parked_events(**keys):
+    """Replay parked events carrying any of ``keys`` once the current transaction commits.
 
-        if not payment_session.mark_event_processed(event_id):
-            return
+    Call wherever a correlation key first becomes known, e.g.
+    ``replay_parked_events(payment_intent_id=[payment_intent_id])``. Each event
+    is replayed in its own transaction with its row locked, for the tenant it
+    was received for, and stays parked if it still doesn't match.
+    """
+    def replay():
+        for parked_id in ParkedEvent.objects.matching(**keys).values_list('id', flat=True):
+            with transaction.atomic():
+                parked = ParkedEvent.objects.select_for_update(skip_locked=True).filter(id=parked_id).first()
+                if parked is None:
+                    continue
+                if dispatch_stripe_event(StripeEvent(parked.payload), parked.tenant_id) is not False:
+                    parked.delete()
 
-        payment_session.status = 'succeeded'
-        payment_session.stripe_payment_intent_id = payment_intent_id
-        payment_session.save(update_fields=['status', 'stripe_payment_intent_id', 'updated_at'])
+    transaction.on_commit(replay)
 
-        Transaction.objects.create(
-            payment_session=payment_session,
-            gross_amount_pence=payment_session.amount_pence,
-            currency=payment_session.currency,
-            provider_charge_id=session.get('payment_intent'),
-        )
 
-        trigger_callback(payment_session)
+def _found(changed, tenant_id, **lookup):
+    """Whether a session matching ``lookup`` exists; only queried when nothing transitioned."""
+    return bool(changed) or PaymentSession.objects.filter(tenant_id=tenant_id, **lookup).exists()
 
 
-def handle_payment_intent_succeeded(payment_intent, event_id):
-    payment_intent_id = payment_intent['id']
+def handle_checkout_completed(session, event_id, tenant_id=None):
+    checkout_session_id = session['id']
+    payment_intent_id = session.get('payment_intent')
 
     with transaction.atomic():
-        payment_session = PaymentSession.objects.filter(
-            stripe_payment_intent_id=payment_intent_id
-        ).select_for_update().first()
+        changed = PaymentSession.objects.filter(
+            tenant_id=tenant_id, stripe_checkout_session_id=checkout_session_id
+        ).transition('succeeded', event_id=event_id, stripe_payment_intent_id=payment_intent_id)
+        for payment_session in changed:
+            Transaction.objects.create(
+                tenant_id=payment_session.tenant_id,
+                payment_session=payment_session,
+                gross_amount_pence=payment_session.amount_pence,
+                currency=payment_session.currency,
+                provider_charge_id=payment_intent_id,
+            )
 
-        if not payment_session:
-            return
+            trigger_callback(payment_session)
+        if changed and payment_intent_id:
+            replay_parked_events(payment_intent_id=[payment_intent_id])
+        return _found(changed, tenant_id, stripe_checkout_session_id=checkout_session_id)
 
-        if not payment_session.mark_event_processed(event_id):
-            return
 
-        if payment_session.status != 'succeeded':
-            payment_session.status = 'succeeded'
-            payment_session.save(update_fields=['status', 'updated_at'])
+def handle_payment_intent_succeeded(payment_intent, event_id, tenant_id=None):
+    payment_intent_id = payment_intent['id']
 
-            if not payment_session.transactions.exists():
-                Transaction.objects.create(
-                    payment_session=payment_session,
-                    gross_amount_pence=payment_session.amount_pence,
-                    currency=payment_session.currency,
-                    provider_charge_id=payment_intent_id,
-                )
+    with transaction.atomic():
+        changed = PaymentSession.objects.filter(
+            tenant_id=tenant_id, stripe_payment_intent_id=payment_intent_id
+        ).transition('succeeded', event_id=event_id)
+        for payment_session in changed:
+            Transaction.objects.create(
+                tenant_id=payment_session.tenant_id,
+                payment_session=payment_session,
+                gross_amount_pence=payment_session.amount_pence,
+                currency=payment_session.currency,
+                provider_charge_id=payment_intent_id,
+            )
 
             trigger_callback(payment_session)
+        if changed:
+            # Refunds of this payment may have arrived before its transaction existed.
+            replay_parked_events(payment_intent_id=[payment_intent_id])
+        if payment_intent.get('setup_future_usage') == 'off_session' and payment_intent.get('customer'):
+            save_payment_method(payment_intent['customer'], payment_intent.get('payment_method'), tenant_id)
+        return _found(changed, tenant_id, stripe_payment_intent_id=payment_intent_id)
+
+
+def save_payment_method(provider_customer_id, payment_method_id, tenant_id=None):
+    """Record a card saved during checkout as the customer's off-session payment method."""
+    if payment_method_id:
+        Customer.objects.filter(tenant_id=tenant_id, provider_customer_id=provider_customer_id).update(
+            default_payment_method_id=payment_method_id,
+        )
 
 
-def handle_checkout_expired(session, event_id):
+def handle_checkout_expired(session, event_id, tenant_id=None):
     checkout_session_id = session['id']
 
     with transaction.atomic():
-        payment_session = PaymentSession.objects.filter(
-            stripe_checkout_session_id=checkout_session_id
-        ).select_for_update().first()
-
-        if not payment_session:
-            return
-
-        if not payment_session.mark_event_processed(event_id):
-            return
-
-        payment_session.status = 'canceled'
-        payment_session.save(update_fields=['status', 'updated_at'])
-
-        trigger_callback(payment_session)
+        changed = PaymentSession.objects.filter(
+            tenant_id=tenant_id, stripe_checkout_session_id=checkout_session_id
+        ).transition('canceled', event_id=event_id)
+        for payment_session in changed:
+            trigger_callback(payment_session)
+        return _found(changed, tenant_id, stripe_checkout_session_id=checkout_session_id)
 
 
-def handle_payment_failed(payment_intent, event_id):
+def handle_payment_failed(payment_intent, event_id, tenant_id=None):
     payment_intent_id = payment_intent['id']
 
     with transaction.atomic():
-        payment_session = PaymentSession.objects.filter(
-            stripe_payment_intent_id=payment_intent_id
-        ).select_for_update().first()
-
-        if not payment_session:
-            return
-
-        if not payment_session.mark_event_processed(event_id):
-            return
-
-        payment_session.status = 'failed'
-        payment_session.save(update_fields=['status', 'updated_at'])
-
-        trigger_callback(payment_session)
+        changed = PaymentSession.objects.filter(
+            tenant_id=tenant_id, stripe_payment_intent_id=payment_intent_id
+        ).transition('failed', event_id=event_id)
+        for payment_session in changed:
+            trigger_callback(payment_session)
+        return _found(changed, tenant_id, stripe_payment_intent_id=payment_intent_id)
 
 
-def handle_charge_refunded(charge, event_id):
+def handle_charge_refunded(charge, event_id, tenant_id=None):
     charge_id = charge['id']
     refunds = charge.get('refunds', {}).get('data', [])
+    # Transactions record the payment intent id as the charge id.
+    charge_ids = [charge_id] + ([charge['payment_intent']] if charge.get('payment_intent') else [])
 
     with transaction.atomic():
-        transactions = Transaction.objects.filter(provider_charge_id=charge_id).select_for_update()
-
-        for txn in transactions:
-            payment_session = txn.payment_session
-
-            if not payment_session.mark_event_processed(event_id):
-                continue
-
-            payment_session.status = 'refunded'
-            payment_session.save(update_fields=['status', 'updated_at'])
-
-            for refund_data in refunds:
-                Refund.objects.get_or_create(
+        transactions = list(
+            Transaction.objects.filter(tenant_id=tenant_id, provider_charge_id__in=charge_ids)
+            .values_list('id', 'payment_session_id')
+        )
+        if not transactions:
+            return False
+
+        # Refund rows are recorded even when the session is already refunded
+        # (a second partial refund produces a new charge.refunded event).
+        # Refunds issued through create_refunds_bulk_internal already have a row.
+        for refund_data in refunds:
+            refund_status = 'succeeded' if refund_data['status'] == 'succeeded' else 'failed'
+            # A bulk refund whose Stripe call errored has no provider id yet; find it by its metadata.
+            own_id = (refund_data.get('metadata') or {}).get('refund_id')
+            updated = Refund.objects.filter(
+                tenant_id=tenant_id, provider_refund_id=refund_data['id']
+            ).update(status=refund_status)
+            if not updated and str(own_id or '').isdigit():
+                updated = Refund.objects.filter(
+                    tenant_id=tenant_id, id=own_id, provider_refund_id__isnull=True,
+                    transaction_id__in=[transaction_id for transaction_id, _ in transactions],
+                ).update(status=refund_status, provider_refund_id=refund_data['id'])
+            if not updated:
+                Refund.objects.create(
+                    tenant_id=tenant_id,
                     provider_refund_id=refund_data['id'],
-                    defaults={
-                        'transaction': txn,
-                        'amount_pence': refund_data['amount'],
-                        'status': 'succeeded' if refund_data['status'] == 'succeeded' else 'failed',
-                        'reason': refund_data.get('reason', ''),
-                    }
+                    transaction_id=transactions[0][0],
+                    amount_pence=refund_data['amount'],
+                    status=refund_status,
+                    reason=refund_data.get('reason', ''),
                 )
 
+        for payment_session in PaymentSession.objects.filter(
+            id__in=[payment_session_id for _, payment_session_id in transactions]
+        ).transition('refunded', event_id=event_id):
             trigger_callback(payment_session)
-
-
-def trigger_callback(payment_session):
-    if not settings.PAYMENTS_WEBHOOK_CALLBACK_URL:
-        return
-
-    try:
-        callback_data = {
-            'payable_type': payment_session.payable_type,
-            'payable_id': payment_session.payable_id,
-            'payment_session_id': str(payment_session.id),
-            'status': payment_session.status,
-        }
-        requests.post(
-            settings.PAYMENTS_WEBHOOK_CALLBACK_URL,
-            json=callback_data,
-            timeout=5
-        )
-    except Exception:
-        pass
+        return True
 
 
 @require_http_methods(["GET"])
 def get_payment_status(request, payment_session_id):
     try:
-        payment_session = PaymentSession.objects.get(id=payment_session_id)
-        return JsonResponse({
-            'payment_session_id': str(payment_session.id),
-            'payable_type': payment_session.payable_type,
-            'payable_id': payment_session.payable_id,
-            'status': payment_session.status,
-            'amount_pence': payment_session.amount_pence,
-            'currency': payment_session.currency,
-        })
+        return JsonResponse(get_payment_status_internal(payment_session_id))
     except PaymentSession.DoesNotExist:
         return JsonResponse({'error': 'Payment session not found'}, status=404)